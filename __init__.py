@@ -15,9 +15,10 @@ from CTFd.plugins.ctfd_chall_manager.models import (
 from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
     ChallManagerException,
 )
+from CTFd.plugins.ctfd_chall_manager.utils.challenge_index import challenge_index
 from CTFd.plugins.ctfd_chall_manager.utils.challenge_store import (
     get_challenge,
-    query_challenges,
+    iter_challenge_records,
 )
 from CTFd.plugins.ctfd_chall_manager.utils.helpers import (
     calculate_all_mana_used,
@@ -26,11 +27,11 @@ from CTFd.plugins.ctfd_chall_manager.utils.helpers import (
 )
 from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import query_instance
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.settings import settings
 from CTFd.plugins.ctfd_chall_manager.utils.setup import setup_default_configs
 from CTFd.plugins.migrations import upgrade
 from CTFd.utils import get_config, set_config
 from CTFd.utils import user as current_user
-from CTFd.utils.challenges import get_all_challenges
 from CTFd.utils.config import is_teams_mode
 from CTFd.utils.decorators import admins_only, authed_only
 from flask import Blueprint, redirect, render_template, request, url_for
@@ -97,30 +98,30 @@ def load(app):  # pylint: disable=too-many-statements
     @admins_only
     def admin_instances():  # pylint: disable=unused-variable
         logger.debug("Accessing admin instances page.")
-        result = []
+        instances = []
 
+        # challenges are streamed, so only their instances are kept in memory
         try:
-            result = query_challenges()
-            logger.info("retrieved %s challenges successfully", len(result))
+            for challenge in iter_challenge_records():
+                instances.extend(i.to_dict() for i in challenge.instances)
+            logger.info("retrieved %s instances successfully", len(instances))
         except ChallManagerException as e:
             logger.error("error querying challenges: %s", e)
-
-        instances = []
-
-        for challenge in result:
-            for instance in challenge["instances"]:
-                instances.append(instance)
+            instances = []  # do not display a partial list
 
         user_mode = get_config("user_mode")
+        challenges = challenge_index.all()
         for i in instances:
-            # get_all_challenges() may return an empty list if the underlying challenge
-            # was deleted directly in Chall-Manager. Keep the row but label it clearly.
-            challenge = get_all_challenges(admin=True, id=i["challengeId"])
+            # the challenge may be missing if it was deleted from CTFd but not
+            # from Chall-Manager. Keep the row but label it clearly.
+            challenge = challenges.get(int(i["challengeId"]))
 
             if challenge:
-                i["challengeName"] = challenge[0].name
+                i["challengeName"] = challenge.name
+                i["challengeCategory"] = challenge.category
             else:
                 i["challengeName"] = f"Unknown challenge #{i['challengeId']}"
+                i["challengeCategory"] = "unknown"
                 logger.warning(
                     "challenge_id %s referenced by Chall-Manager does not exist anymore in CTFd",
                     i["challengeId"],
@@ -212,7 +213,7 @@ def load(app):  # pylint: disable=too-many-statements
     @page_blueprint.route("/instances")
     @authed_only
     def instances():  # pylint: disable=unused-variable
-        mana_total = int(get_config("chall-manager:chall-manager_mana_total"))
+        mana_total = settings.get_int("chall-manager_mana_total")
         mana_enabled = mana_total > 0
         mana_remaining = mana_total
         mana_used = 0
@@ -243,14 +244,9 @@ def load(app):  # pylint: disable=too-many-statements
             )
 
         for i in instances:
-            # Add CTFd infos, admin=False means do no display hidden challenges
-            challenge_entries = get_all_challenges(admin=False, id=i["challengeId"])
-            challenge = DynamicIaCChallenge.query.filter_by(id=i["challengeId"]).first()
-            # if challenge is not hidden
-            if len(challenge_entries) == 1:
-                i["challengeName"] = challenge_entries[0].name
-                i["challengeCategory"] = challenge_entries[0].category
-            elif challenge is None:
+            # Add CTFd infos, do no display hidden challenges
+            challenge = challenge_index.get(int(i["challengeId"]))
+            if challenge is None:
                 logger.warning(
                     "challenge_id %s referenced by Chall-Manager does not exist anymore in CTFd",
                     i["challengeId"],
@@ -258,6 +254,9 @@ def load(app):  # pylint: disable=too-many-statements
                 i["challengeName"] = f"Unknown challenge #{i['challengeId']}"
                 i["challengeCategory"] = "unknown"
                 i["connectionInfo"] = "unavailable"
+            elif challenge.is_visible():
+                i["challengeName"] = challenge.name
+                i["challengeCategory"] = challenge.category
             else:  # challenge exists but is hidden
                 i["challengeName"] = "hidden"
                 i["challengeCategory"] = "hidden"
@@ -5,7 +5,10 @@ This module register API endpoints for the plugin in CTFd (/api/v1).
 from CTFd.api import CTFd_API_v1
 from CTFd.plugins.ctfd_chall_manager.api.admin.imports import AdminImport
 from CTFd.plugins.ctfd_chall_manager.api.admin.instance import AdminInstance
+from CTFd.plugins.ctfd_chall_manager.api.admin.locks import AdminLocks
+from CTFd.plugins.ctfd_chall_manager.api.admin.metrics import AdminMetrics
 from CTFd.plugins.ctfd_chall_manager.api.instance import UserInstance
+from CTFd.plugins.ctfd_chall_manager.api.job import UserJob
 from CTFd.plugins.ctfd_chall_manager.api.mana import UserMana
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
 from flask_restx import Namespace
@@ -34,8 +37,11 @@ def register_api_endpoints():
     # add resources to namespaces
     admin_namespace.add_resource(AdminInstance, "/instance")
     admin_namespace.add_resource(AdminImport, "/import")
+    admin_namespace.add_resource(AdminMetrics, "/metrics")
+    admin_namespace.add_resource(AdminLocks, "/locks")
     user_namespace.add_resource(UserInstance, "/instance")
     user_namespace.add_resource(UserMana, "/mana")
+    user_namespace.add_resource(UserJob, "/job")
 
     # register namespace in CTFd
     CTFd_API_v1.add_namespace(admin_namespace, path="/plugins/ctfd-chall-manager/admin")
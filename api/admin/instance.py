@@ -13,7 +13,7 @@ from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import (
     get_instance,
     update_instance,
 )
-from CTFd.plugins.ctfd_chall_manager.utils.lock import load_or_store
+from CTFd.plugins.ctfd_chall_manager.utils.lock import InstanceLock
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
 from CTFd.utils import user as current_user
 from CTFd.utils.decorators import admins_only
@@ -112,10 +112,12 @@ class AdminInstance(Resource):
             source_id,
         )
 
-        try:
-            lock = load_or_store(f"{source_id}")
-            lock.lock()
+        # the mana checks are bypassed, so no other operation runs on the source
+        lock = InstanceLock(challenge_id, source_id, exclusive=True)
+        if not lock.lock():
+            abort(429, "an operation is already in progress for this source")
 
+        try:
             result = create_instance(challenge_id, source_id)
             logger.info(
                 "instance for challenge_id: %s, source_id: %s created successfully",
@@ -182,6 +184,10 @@ class AdminInstance(Resource):
             source_id,
         )
 
+        lock = InstanceLock(challenge_id, source_id)
+        if not lock.lock():
+            abort(429, "an operation is already in progress for this instance")
+
         try:
             logger.debug(
                 "updating instance for challenge_id: %s, source_id: %s",
@@ -202,6 +208,10 @@ class AdminInstance(Resource):
                 "message": e.message,
             }, e.http_code
 
+        finally:
+            logger.debug("unlock %s", lock)
+            lock.unlock()
+
         return {"success": True, "data": result}, 200
 
     @staticmethod
@@ -232,10 +242,12 @@ class AdminInstance(Resource):
             source_id,
         )
 
-        try:
-            lock = load_or_store(f"{source_id}")
-            lock.lock()
+        # the mana checks are bypassed, so no other operation runs on the source
+        lock = InstanceLock(challenge_id, source_id, exclusive=True)
+        if not lock.lock():
+            abort(429, "an operation is already in progress for this source")
 
+        try:
             logger.debug(
                 "deleting instance for challenge_id: %s, source_id: %s",
                 challenge_id,
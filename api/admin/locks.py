@@ -0,0 +1,65 @@
+"""
+This module describes the AdminLocks API endpoints of the plugin:
+Route: /api/v1/plugins/ctfd-chall-manager/admin/locks.
+"""
+
+import redis
+from CTFd.api.v1.helpers.request import validate_args
+from CTFd.plugins.ctfd_chall_manager.utils.lock import force_release, list_locks
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.utils import user as current_user
+from CTFd.utils.decorators import admins_only
+from flask_restx import Resource, abort
+
+# Configure logger for this module
+logger = configure_logger(__name__)
+
+
+# region AdminLocks
+# Resource to monitor and release the locks
+class AdminLocks(Resource):
+    """
+    AdminLocks is an admin API endpoint to list the locks currently held,
+    and force the release of a stuck one (e.g. held by a killed worker).
+    Without Redis, locks are local to each CTFd worker, so the values are those
+    of the worker that served the request.
+    """
+
+    @staticmethod
+    @admins_only
+    def get():
+        """
+        List the locks currently held, with the seconds before they expire.
+        """
+        try:
+            locks = list_locks()
+        except redis.RedisError as e:
+            logger.error("error while listing locks: %s", e)
+            return {"success": False, "message": "cannot list locks"}, 500
+
+        return {"success": True, "data": locks}, 200
+
+    @staticmethod
+    @admins_only
+    @validate_args({"name": (str, None)}, location="json")
+    def delete(json_args):
+        """
+        Force the release of the lock name, whoever holds it.
+        """
+        admin_id = current_user.get_current_user()
+        name = json_args.pop("name", None)
+        if not name:
+            abort(400, "missing name", success=False)
+
+        logger.info("admin %s request force release of lock %s", admin_id, name)
+
+        try:
+            released = force_release(name)
+        except redis.RedisError as e:
+            logger.error("error while releasing lock %s: %s", name, e)
+            return {"success": False, "message": "cannot release lock"}, 500
+
+        if not released:
+            abort(404, "no such lock held", success=False)
+
+        return {"success": True, "data": {}}, 200
@@ -0,0 +1,52 @@
+"""
+This module describes the AdminMetrics API endpoint of the plugin:
+Route: /api/v1/plugins/ctfd-chall-manager/admin/metrics.
+"""
+
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_client import get_client
+from CTFd.plugins.ctfd_chall_manager.utils.circuit_breaker import breaker
+from CTFd.plugins.ctfd_chall_manager.utils.instance_cache import instance_cache
+from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import flights
+from CTFd.plugins.ctfd_chall_manager.utils.jobs import provisioner
+from CTFd.plugins.ctfd_chall_manager.utils.lock import lock_is_local, registry
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.mana_ledger import mana_ledger
+from CTFd.utils.decorators import admins_only
+from flask_restx import Resource
+
+# Configure logger for this module
+logger = configure_logger(__name__)
+
+
+# region AdminMetrics
+# Resource to monitor the plugin internals
+class AdminMetrics(Resource):  # pylint: disable=too-few-public-methods
+    """
+    AdminMetrics is an admin API endpoint exposing the plugin internal metrics.
+    Metrics are collected per process, so the values are those of the
+    CTFd worker that served the request.
+    """
+
+    @staticmethod
+    @admins_only
+    def get():
+        """
+        Retrieve the metrics of the current worker.
+        """
+        logger.debug("retrieving plugin metrics")
+        return {
+            "success": True,
+            "data": {
+                "client": get_client().stats(),
+                "breaker": {
+                    "state": breaker.state(),
+                    "failure_threshold": breaker.failure_threshold,
+                    "recovery_timeout": breaker.recovery_timeout,
+                },
+                "singleflight": flights.stats(),
+                "instance_cache": instance_cache.stats(),
+                "mana_ledger": mana_ledger.stats(),
+                "locks": {"distributed": not lock_is_local, **registry.stats()},
+                "provisioning": provisioner.stats(),
+            },
+        }, 200
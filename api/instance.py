@@ -4,15 +4,16 @@ Route: /api/v1/plugins/ctfd-chall-manager/instance.
 """
 
 from CTFd.api.v1.helpers.request import validate_args
-from CTFd.plugins.ctfd_chall_manager.models import DynamicIaCChallenge
 from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
     ChallManagerException,
 )
 from CTFd.plugins.ctfd_chall_manager.utils.decorators import challenge_visible
 from CTFd.plugins.ctfd_chall_manager.utils.helpers import (
-    check_source_can_create_instance,
+    cancel_mana_reservation,
     check_source_can_edit_instance,
     check_source_can_patch_instance,
+    load_challenge,
+    reserve_instance_mana,
 )
 from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import (
     create_instance,
@@ -20,11 +21,18 @@ from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import (
     get_instance,
     update_instance,
 )
-from CTFd.plugins.ctfd_chall_manager.utils.lock import load_or_store
+from CTFd.plugins.ctfd_chall_manager.utils.jobs import provisioner
+from CTFd.plugins.ctfd_chall_manager.utils.lock import InstanceLock
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.mana_ledger import (
+    IN_PROGRESS,
+    REFUSED,
+    RESERVED,
+)
 from CTFd.utils import user as current_user
 from CTFd.utils.config import is_teams_mode
 from CTFd.utils.decorators import authed_only
+from flask import current_app
 from flask_restx import Resource, abort
 
 # Configure logger for this module
@@ -71,7 +79,7 @@ class UserInstance(Resource):
             abort(400, "missing argument challenge_id of source_id", success=False)
 
         # if challenge is shared
-        challenge = DynamicIaCChallenge.query.filter_by(id=challenge_id).first()
+        challenge = load_challenge(challenge_id)
         if challenge.shared:
             source_id = 0
 
@@ -106,6 +114,8 @@ class UserInstance(Resource):
         """
         Create an instance of challengeId provided on Chall-Manager.
         This method requires user to be authenticated and has suffisant mana to perform creation.
+        If asynchronous provisioning is enabled, the instance is created in background
+        and the job id is returned (202), its state is polled on /job.
         """
         challenge_id = json_args.pop("challengeId", None)
         if challenge_id is None:
@@ -125,24 +135,60 @@ class UserInstance(Resource):
                 logger.info("user %s has no team, abort", user_id)
                 abort(403, "unauthorized", success=False)
 
-        lock = load_or_store(str(source_id))
-        if lock.is_locked():
-            logger.debug("instance creation already in progress, abort")
-            abort(429, "instance creation already in progress", success=False)
+        # fail fast if an operation is already in progress for the instance,
+        # operations on the other challenges of the source run in parallel
+        lock = InstanceLock(challenge_id, source_id)
+        if not lock.try_lock():
+            logger.debug("instance operation already in progress, abort")
+            abort(
+                429,
+                "an operation is already in progress for this instance",
+                success=False,
+            )
 
+        reservation, exists, handed_over = None, False, False
         try:
-            logger.debug("post /instance acquire the player lock for %s", source_id)
-            lock.lock()
-
-            if not check_source_can_create_instance(challenge_id, source_id):
+            # concurrent creations for a source run in parallel, as long as
+            # the source can afford all of them
+            reservation = reserve_instance_mana(challenge_id, source_id)
+            if reservation == IN_PROGRESS:
+                logger.debug("instance creation already in progress, abort")
+                abort(429, "instance creation already in progress", success=False)
+            if reservation == REFUSED:
                 abort(403, "You or your team used up all your mana.", success=False)
 
+            if provisioner.enabled:
+                # pylint: disable-next=protected-access
+                app = current_app._get_current_object()
+                job = provisioner.submit(
+                    app, challenge_id, source_id, reservation, lock
+                )
+                # the job ends the reservation, and releases the locks
+                reservation, handed_over = None, True
+                logger.info(
+                    "instance for challenge_id: %s, source_id: %s submitted as job %s",
+                    challenge_id,
+                    source_id,
+                    job.id,
+                )
+                return {
+                    "success": True,
+                    "data": {
+                        "jobId": job.id,
+                        "state": job.state,
+                        # seconds after which the job is reported failed
+                        "timeout": provisioner.queue_timeout()
+                        + provisioner.stale_after(),
+                    },
+                }, 202
+
             logger.debug(
                 "creating instance for challenge_id: %s, source_id: %s",
                 challenge_id,
                 source_id,
             )
             result = create_instance(challenge_id, source_id)
+            reservation = None  # ended by the creation
             logger.info(
                 "instance for challenge_id: %s, source_id: %s created successfully",
                 challenge_id,
@@ -150,7 +196,8 @@ class UserInstance(Resource):
             )
 
         except ChallManagerException as e:
-            if "already exist" in e.message:
+            exists = "already exist" in e.message
+            if exists:
                 return {
                     "success": False,
                     "message": "instance already exists",
@@ -161,8 +208,13 @@ class UserInstance(Resource):
             }, e.http_code
 
         finally:
-            logger.debug("post /instance release the player lock for %s", source_id)
-            lock.unlock()
+            # the reservation was not ended (any error), do not make the
+            # retries wait for it to expire
+            if reservation == RESERVED:
+                cancel_mana_reservation(challenge_id, source_id, instance_exists=exists)
+            if not handed_over:
+                logger.debug("post /instance release the lock of %s", lock)
+                lock.unlock()
 
         # return only necessary values
         data = {}
@@ -202,6 +254,16 @@ class UserInstance(Resource):
         if not check_source_can_patch_instance(challenge_id, source_id):
             abort(403, "unauthorized", success=False)
 
+        # fail fast if an operation is already in progress for the instance
+        lock = InstanceLock(challenge_id, source_id)
+        if not lock.try_lock():
+            logger.debug("instance operation already in progress, abort")
+            abort(
+                429,
+                "an operation is already in progress for this instance",
+                success=False,
+            )
+
         try:
             logger.debug(
                 "updating instance for challenge_id: %s, source_id: %s",
@@ -221,6 +283,10 @@ class UserInstance(Resource):
                 "message": "error while patching instance, contact admins",
             }, e.http_code
 
+        finally:
+            logger.debug("patch /instance release the lock of %s", lock)
+            lock.unlock()
+
         return {
             "success": True,
             "data": {"message": "Your instance has been renewed !"},
@@ -252,16 +318,18 @@ class UserInstance(Resource):
                 logger.info("user %s has no team, abort", user_id)
                 abort(403, "unauthorized", success=False)
 
-        lock = load_or_store(str(source_id))
-        if lock.is_locked():
-            logger.debug("instance deletion already in progress, abort")
-            abort(429, "instance deletion already in progress", success=False)
+        # fail fast if an operation is already in progress for the instance
+        lock = InstanceLock(challenge_id, source_id)
+        logger.debug("delete /instance acquire the lock of %s", lock)
+        if not lock.try_lock():
+            logger.debug("instance operation already in progress, abort")
+            abort(
+                429,
+                "an operation is already in progress for this instance",
+                success=False,
+            )
 
         try:
-            # lock = load_or_store(f"{source_id}")
-            logger.debug("delete /instance acquire the player lock for %s", source_id)
-            lock.lock()
-
             if not check_source_can_edit_instance(challenge_id, source_id):
                 abort(403, "unauthorized", success=False)
 
@@ -285,7 +353,7 @@ class UserInstance(Resource):
             }, e.http_code
 
         finally:
-            logger.debug("delete /instance release the player lock for %s", source_id)
+            logger.debug("delete /instance release the lock of %s", lock)
             lock.unlock()
 
         return {"success": True, "data": {}}, 200
@@ -0,0 +1,70 @@
+"""
+This module describes the UserJob API endpoint of the plugin:
+Route: /api/v1/plugins/ctfd-chall-manager/job.
+"""
+
+from CTFd.api.v1.helpers.request import validate_args
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
+    ChallManagerException,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.jobs import provisioner
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.utils import user as current_user
+from CTFd.utils.config import is_teams_mode
+from CTFd.utils.decorators import authed_only
+from flask_restx import Resource, abort
+
+# Configure logger for this module
+logger = configure_logger(__name__)
+
+
+# region UserJob
+class UserJob(Resource):  # pylint: disable=too-few-public-methods
+    """
+    UserJob class handle R operation on /job, the instance creations
+    running in background (see UserInstance.post).
+    A source can only retrieve its own jobs.
+    """
+
+    @staticmethod
+    @authed_only
+    @validate_args({"jobId": (str, None)}, location="query")
+    def get(query_args):
+        """
+        Retrieve the state of the job jobId, and the instance once created.
+        """
+        job_id = query_args.pop("jobId", None)
+        if not job_id:
+            abort(400, "missing jobId", success=False)
+
+        # in teams mode, the jobs belong to the team of the user
+        user = current_user.get_current_user()
+        source_id = user.team_id if is_teams_mode() else user.id
+        if not source_id:
+            logger.info("user %s has no team, abort", user.id)
+            abort(403, "unauthorized", success=False)
+
+        try:
+            job = provisioner.get(job_id)
+        except ChallManagerException as e:
+            logger.error("error while getting job %s: %s", job_id, e)
+            return {
+                "success": False,
+                "message": "error while getting job info, contact admins",
+            }, e.http_code
+
+        # do not disclose the jobs of the other sources
+        if job is None or job.source_id != int(source_id):
+            abort(404, "job not found", success=False)
+
+        data = {
+            "jobId": job.id,
+            "challengeId": job.challenge_id,
+            "state": job.state,
+        }
+        if job.message:
+            data["message"] = job.message
+        if job.data:
+            data.update(job.data)
+
+        return {"success": True, "data": data}, 200
@@ -6,10 +6,9 @@ Route: /api/v1/plugins/ctfd-chall-manager/mana
 from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
     ChallManagerException,
 )
-from CTFd.plugins.ctfd_chall_manager.utils.helpers import calculate_mana_used
-from CTFd.plugins.ctfd_chall_manager.utils.lock import load_or_store
+from CTFd.plugins.ctfd_chall_manager.utils.helpers import calculate_mana_usage
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
-from CTFd.utils import get_config
+from CTFd.plugins.ctfd_chall_manager.utils.settings import settings
 from CTFd.utils import user as current_user
 from CTFd.utils.config import is_teams_mode
 from CTFd.utils.decorators import authed_only
@@ -31,8 +30,10 @@ class UserMana(Resource):
         """
         Retrieve the actual mana used by the sourceId.
         If CTFd is in Team mode, the mana_used will be amound all players of a team.
+        The mana reserved by creations in progress is included in used,
+        and also returned as pending.
         """
-        mana_total = int(get_config("chall-manager:chall-manager_mana_total"))
+        mana_total = settings.get_int("chall-manager_mana_total")
 
         # If mana disabled, return 0 immediatly
         if mana_total == 0:
@@ -40,6 +41,7 @@ class UserMana(Resource):
                 "success": True,
                 "data": {
                     "used": 0,
+                    "pending": 0,
                     "total": 0,
                 },
             }, 200
@@ -56,13 +58,11 @@ class UserMana(Resource):
                 )
                 abort(403, "unauthorized", success=False)
 
+        # the ledger is read without the lock of the source, so the response
+        # does not wait for the creations in progress
         try:
-            lock = load_or_store(str(source_id))
-            logger.debug("get /mana acquire the player lock for %s", source_id)
-            lock.lock()
-
-            mana = calculate_mana_used(source_id)
-            logger.debug("retrieved mana for source_id: %s, mana: %s", source_id, mana)
+            usage = calculate_mana_usage(source_id)
+            logger.debug("retrieved mana for source_id: %s, mana: %s", source_id, usage)
         except ChallManagerException as e:
             logger.error(
                 "error while calculating the mana for source_id %s: %s", source_id, e
@@ -72,14 +72,11 @@ class UserMana(Resource):
                 "message": "error while calculating your mana",
             }, 500
 
-        finally:
-            logger.debug("get /mana release the player lock for %s", source_id)
-            lock.unlock()
-
         return {
             "success": True,
             "data": {
-                "used": mana,
+                "used": usage["used"],
+                "pending": usage["pending"],
                 "total": mana_total,
             },
         }, 200
@@ -159,6 +159,10 @@ function loadInfo() {
                 $('.cm-panel-mana-cost-div').hide();
             } else {
                 let remaining = manaResponse.total - manaResponse.used;
+                if (manaResponse.pending > 0) {
+                    // mana reserved by instances being created
+                    remaining += " (" + manaResponse.pending + " pending)";
+                }
                 $('#cm-challenge-mana-remaining').html(remaining);
             }
         }
@@ -256,6 +260,46 @@ CTFd._internal.challenge.renew = function () {
     });
 };
 
+// Poll the job of an instance created in background until it is over, or
+// timeout seconds passed, resolves with a response like the one of a
+// synchronous creation
+function pollJob(jobId, timeout) {
+    const url = "/api/v1/plugins/ctfd-chall-manager/job?jobId=" + jobId;
+    const pollInterval = 2000; // 2s
+    // the job is reported failed after timeout, give up a bit later
+    const deadline = Date.now() + ((timeout || 900) + 30) * 1000;
+
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            if (Date.now() > deadline) {
+                resolve({success: false, message: "instance creation is taking too long, reload the page later"});
+                return;
+            }
+            CTFd.fetch(url, {
+                method: 'GET',
+                credentials: 'same-origin',
+                headers: {
+                    'Accept': 'application/json',
+                    'Content-Type': 'application/json'
+                },
+            }).then(handleResponse).then(response => {
+                if (!response.success) {
+                    resolve(response);
+                } else if (response.data.state === "succeeded") {
+                    resolve({success: true, data: response.data});
+                } else if (response.data.state === "failed") {
+                    resolve({success: false, message: response.data.message});
+                } else {
+                    setTimeout(poll, pollInterval);
+                }
+            }).catch(error => {
+                reject(error);
+            });
+        };
+        setTimeout(poll, pollInterval);
+    });
+}
+
 CTFd._internal.challenge.boot = function() {
     return new Promise((resolve, reject) => {
         var challenge_id = CTFd._internal.challenge.data.id;
@@ -277,6 +321,13 @@ CTFd._internal.challenge.boot = function() {
             },
             body: JSON.stringify(params)
         }).then(handleResponse).then(response => {
+            if (response.success && response.data.jobId) {
+                // instance is created in background, wait for it
+                $('#whale-button-boot').text("Deploying...");
+                return pollJob(response.data.jobId, response.data.timeout);
+            }
+            return response;
+        }).then(response => {
             if (response.success) {
                 loadInfo();
                 CTFd._functions.events.eventAlert({
@@ -0,0 +1,140 @@
+"""
+Micro-benchmark of the decoding of a query_challenges payload.
+
+It compares the stdlib decoding into plain dicts (previous behavior) with the
+plugin decoding (orjson if installed, compact records), on a generated NDJSON
+payload of 20 challenges with 500 instances each (10k instances).
+
+Usage:
+    python hack/benchmark/decoding.py
+"""
+
+import importlib.util
+import json
+import os
+import time
+import tracemalloc
+
+CHALLENGES = 20
+INSTANCES_PER_CHALLENGE = 500
+ROUNDS = 5
+
+
+def load_records_module():
+    """
+    Load utils/records.py without importing CTFd.
+    """
+    path = os.path.join(
+        os.path.dirname(__file__), os.pardir, os.pardir, "utils", "records.py"
+    )
+    spec = importlib.util.spec_from_file_location("records", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_payload() -> list[bytes]:
+    """
+    Generate the NDJSON lines streamed by GET /api/v1/challenge.
+    """
+    lines = []
+    for c in range(1, CHALLENGES + 1):
+        instances = [
+            {
+                "challengeId": str(c),
+                "sourceId": str(s),
+                "since": "2025-05-24T10:00:00.123456789Z",
+                "lastRenew": "2025-05-24T10:30:00.123456789Z",
+                "until": "2025-05-24T11:30:00.123456789Z",
+                "connectionInfo": f"nc {c}-{s}.ctf.example.com 1337",
+                "flags": [f"CTF{{{c:04d}-{s:06d}-0123456789abcdef}}"],
+                "additional": {"image": "registry:5000/examples/deploy:latest"},
+            }
+            for s in range(1, INSTANCES_PER_CHALLENGE + 1)
+        ]
+        challenge = {
+            "id": str(c),
+            "hash": "0" * 64,
+            "scenario": "registry:5000/examples/deploy:latest",
+            "timeout": "3600s",
+            "until": None,
+            "additional": {"image": "registry:5000/examples/deploy:latest"},
+            "min": 0,
+            "max": 0,
+            "instances": instances,
+        }
+        lines.append(json.dumps({"result": challenge}).encode())
+    return lines
+
+
+def decode_stdlib(lines: list[bytes]) -> list:
+    """
+    Previous behavior: stdlib json into whole dicts.
+    """
+    return [json.loads(line.decode("utf-8"))["result"] for line in lines]
+
+
+def decode_fast(records, lines: list[bytes]) -> list:
+    """
+    Plugin decoder into whole dicts, to isolate the decoder gain.
+    """
+    return [records.loads(line)["result"] for line in lines]
+
+
+def decode_records(records, lines: list[bytes]) -> list:
+    """
+    Plugin behavior: fast decoding into compact records.
+    """
+    return [
+        records.ChallengeRecord.from_json(records.loads(line)["result"])
+        for line in lines
+    ]
+
+
+def measure(fn, lines):
+    """
+    Returns the best parse time (s) and the memory retained by the result (bytes).
+    """
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn(lines)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = fn(lines)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, retained
+
+
+def main():
+    """
+    Run the benchmark and print the results.
+    """
+    records = load_records_module()
+    lines = generate_payload()
+    size = sum(len(line) for line in lines)
+    print(
+        f"payload: {CHALLENGES} challenges, "
+        f"{CHALLENGES * INSTANCES_PER_CHALLENGE} instances, {size / 1e6:.1f} MB"
+    )
+    print(f"decoder: {'orjson' if records.orjson is not None else 'json (stdlib)'}")
+
+    base_time, base_mem = measure(decode_stdlib, lines)
+    fast_time, fast_mem = measure(lambda x: decode_fast(records, x), lines)
+    rec_time, rec_mem = measure(lambda x: decode_records(records, x), lines)
+
+    print(f"{'':18}{'parse (ms)':>12}{'retained (MB)':>16}")
+    print(f"{'json + dicts':18}{base_time * 1e3:>12.1f}{base_mem / 1e6:>16.1f}")
+    print(f"{'decoder + dicts':18}{fast_time * 1e3:>12.1f}{fast_mem / 1e6:>16.1f}")
+    print(f"{'plugin records':18}{rec_time * 1e3:>12.1f}{rec_mem / 1e6:>16.1f}")
+    print(
+        f"speedup x{base_time / rec_time:.2f}, "
+        f"memory saved {100 * (1 - rec_mem / base_mem):.0f}%"
+    )
+
+
+if __name__ == "__main__":
+    main()
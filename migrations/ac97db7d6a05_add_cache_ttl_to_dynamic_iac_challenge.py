@@ -0,0 +1,36 @@
+"""Add cache_ttl column to dynamic_iac challenges
+
+Revision ID: ac97db7d6a05
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from CTFd.plugins.migrations import get_columns_for_table
+
+# revision identifiers, used by Alembic.
+# pylint: disable=invalid-name
+revision = "ac97db7d6a05"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# table name generated by Flask-SQLAlchemy for DynamicIaCChallenge
+TABLE = "dynamic_ia_c_challenge"
+
+
+def upgrade(op=None):
+    """
+    Add the per-challenge instance cache policy.
+    """
+    columns = get_columns_for_table(op=op, table_name=TABLE, names_only=True)
+    if "cache_ttl" not in columns:
+        op.add_column(TABLE, sa.Column("cache_ttl", sa.Integer(), nullable=True))
+
+
+def downgrade(op=None):
+    """
+    Remove the per-challenge instance cache policy.
+    """
+    op.drop_column(TABLE, "cache_ttl")
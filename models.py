@@ -19,10 +19,12 @@ from CTFd.plugins.challenges.logic import (
     challenge_attempt_any,
     challenge_attempt_team,
 )
+from CTFd.plugins.ctfd_chall_manager.utils.bus import CHALLENGE_DELETED
 from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
     ChallManagerException,
     ChallManagerPluginException,
 )
+from CTFd.plugins.ctfd_chall_manager.utils.challenge_index import challenge_index
 from CTFd.plugins.ctfd_chall_manager.utils.challenge_store import (
     create_challenge,
     delete_challenge,
@@ -32,6 +34,7 @@ from CTFd.plugins.ctfd_chall_manager.utils.challenge_store import (
 from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import (
     delete_instance,
     get_instance,
+    invalidate_instances,
 )
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
 from CTFd.plugins.dynamic_challenges import DynamicChallenge, DynamicValueChallenge
@@ -59,6 +62,8 @@ class DynamicIaCChallenge(DynamicChallenge):
     shared = db.Column(db.Boolean, default=False)
     destroy_on_flag = db.Column(db.Boolean, default=False)
     additional = db.Column(db.JSON, default={})
+    # seconds the instances are cached, None for the default policy
+    cache_ttl = db.Column(db.Integer)
 
     # Pooler feature
     min = db.Column(db.Integer, default=0)
@@ -79,6 +84,10 @@ class DynamicIaCChallenge(DynamicChallenge):
             destroy_on_flag={self.destroy_on_flag})"
 
 
+# keep the challenges index up to date
+challenge_index.track(DynamicIaCChallenge)
+
+
 class DynamicIaCValueChallenge(DynamicValueChallenge):
     """
     DynamicIaCValueChallenge defines the function CRUD of a dynamic_iac challenge type.
@@ -181,6 +190,7 @@ class DynamicIaCValueChallenge(DynamicValueChallenge):
                 ),  # do not display additional for all user, can contains secrets
                 "min": challenge.min,
                 "max": challenge.max,
+                "cache_ttl": challenge.cache_ttl,
             }
         )
 
@@ -205,6 +215,13 @@ class DynamicIaCValueChallenge(DynamicValueChallenge):
         except ChallManagerPluginException as e:
             raise ChallengeUpdateException from e
 
+        # cached instances are stored with the cache policy of the challenge,
+        # and the instances of a shared challenge are cached for all sources
+        policy_changed = any(
+            attr in data and data[attr] != getattr(challenge, attr)
+            for attr in ("cache_ttl", "shared")
+        )
+
         # update on database
         for attr, value in data.items():
             # We need to set these to floats so that the next operations don't operate on strings
@@ -218,6 +235,8 @@ class DynamicIaCValueChallenge(DynamicValueChallenge):
         # if there is no update on chall-manager attributes
         if not params:
             logger.debug("do not update challenge attributes on chall-manager")
+            if policy_changed:
+                invalidate_instances(challenge_id=challenge.id)
             return super().calculate_value(challenge)
 
         # send updates to CM
@@ -227,6 +246,9 @@ class DynamicIaCValueChallenge(DynamicValueChallenge):
             logger.error("error while patching the challenge: %s", e)
             raise ChallengeUpdateException(e.message) from e
 
+        # cached instances may hold outdated connection informations or flags
+        invalidate_instances(challenge_id=challenge.id)
+
         return super().calculate_value(challenge)
 
     @classmethod
@@ -255,10 +277,15 @@ class DynamicIaCValueChallenge(DynamicValueChallenge):
                     "failed to delete challenge %s from CM: %s", challenge.id, e
                 )
 
+        invalidate_instances(challenge_id=challenge.id)
+
         # then delete it on CTFd
-        logger.debug("deleting challenge %s on CTFd", challenge.id)
+        challenge_id = challenge.id
+        logger.debug("deleting challenge %s on CTFd", challenge_id)
         super().delete(challenge)
-        logger.info("challenge %s on CTFd deleted successfully", challenge.id)
+        # CTFd deletes the challenge with a bulk query, not seen by the index
+        challenge_index.notify(CHALLENGE_DELETED, challenge_id)
+        logger.info("challenge %s on CTFd deleted successfully", challenge_id)
 
     @classmethod
     def attempt(
@@ -420,9 +447,10 @@ def prepare_ctfdcm_database(data) -> dict | ChallManagerPluginException:
         "additional": {},
         "until": None,
         "timeout": None,
+        "cache_ttl": None,
     }
     # Integer
-    for k in ["min", "max", "mana_cost"]:
+    for k in ["min", "max", "mana_cost", "cache_ttl"]:
         if k in data.keys():
             try:
                 data[k] = int(data[k]) if data[k] != "" else defaults[k]
@@ -432,6 +460,12 @@ def prepare_ctfdcm_database(data) -> dict | ChallManagerPluginException:
                     f"{k} cannot be convert into int, got {data[k]}"
                 ) from e
 
+    if data.get("cache_ttl") is not None and data["cache_ttl"] < 0:
+        logger.error("cache_ttl cannot be negative, got %s", data["cache_ttl"])
+        raise ChallManagerPluginException(
+            f"cache_ttl cannot be negative, got {data['cache_ttl']}"
+        )
+
     # Boolean
     for k in ["shared", "destroy_on_flag"]:
         if k in data.keys():
@@ -0,0 +1,68 @@
+"""
+This module defines all tests cases for the /admin/locks endpoint.
+"""
+
+import json
+import unittest
+
+import requests
+
+from .utils import config
+
+
+# pylint: disable=invalid-name,missing-timeout,duplicate-code
+class Test_F_AdminLocks(unittest.TestCase):
+    """
+    Test_F_AdminLocks defines all tests cases for the /admin/locks endpoint.
+    """
+
+    def test_user_connection_is_denied(self):
+        """
+        Performs calls on admin endpoint with user account.
+        Must be denied.
+        """
+        r = requests.get(
+            f"{config.plugin_url}/admin/locks", headers=config.headers_user
+        )
+        self.assertEqual(r.status_code, 403)
+
+        r = requests.delete(
+            f"{config.plugin_url}/admin/locks",
+            headers=config.headers_user,
+            json={"name": "1"},
+        )
+        self.assertEqual(r.status_code, 403)
+
+    def test_list_locks(self):
+        """
+        Checks that the locks currently held are listed.
+        """
+        r = requests.get(
+            f"{config.plugin_url}/admin/locks", headers=config.headers_admin
+        )
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+        self.assertIsInstance(a["data"], list)
+        for lock in a["data"]:
+            for k in ["name", "ttl"]:
+                self.assertIn(k, lock)
+
+    def test_release_missing_arg(self):
+        """
+        Checks that the name of the lock to release is required.
+        """
+        r = requests.delete(
+            f"{config.plugin_url}/admin/locks", headers=config.headers_admin, json={}
+        )
+        self.assertEqual(r.status_code, 400)
+
+    def test_release_unknown_lock(self):
+        """
+        Checks that releasing a lock which is not held fails.
+        """
+        r = requests.delete(
+            f"{config.plugin_url}/admin/locks",
+            headers=config.headers_admin,
+            json={"name": "not-held"},
+        )
+        self.assertEqual(r.status_code, 404)
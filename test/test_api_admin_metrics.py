@@ -0,0 +1,114 @@
+"""
+This module defines all tests cases for the /admin/metrics endpoint.
+"""
+
+import json
+import unittest
+
+import requests
+
+from .utils import config, create_challenge, delete_challenge
+
+
+# pylint: disable=invalid-name,missing-timeout,duplicate-code
+class Test_F_AdminMetrics(unittest.TestCase):
+    """
+    Test_F_AdminMetrics defines all tests cases for the /admin/metrics endpoint.
+    """
+
+    def test_user_connection_is_denied(self):
+        """
+        Performs calls on admin endpoint with user account.
+        Must be denied.
+        """
+        r = requests.get(
+            f"{config.plugin_url}/admin/metrics", headers=config.headers_user
+        )
+        self.assertEqual(r.status_code, 403)
+
+    def test_client_stats(self):
+        """
+        Checks that the connection pool statistics are exposed.
+        """
+        chall_id = create_challenge()
+
+        r = requests.get(
+            f"{config.plugin_url}/admin/metrics", headers=config.headers_admin
+        )
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        client = a["data"]["client"]
+        for k in ["pool_maxsize", "in_flight", "peak_in_flight", "requests"]:
+            self.assertIn(k, client)
+        self.assertTrue(client["pool_maxsize"] > 0)
+        self.assertTrue(client["in_flight"] >= 0)
+
+        delete_challenge(chall_id)
+
+    def test_instance_cache_stats(self):
+        """
+        Checks that the hits and misses of both cache tiers are exposed.
+        """
+        r = requests.get(
+            f"{config.plugin_url}/admin/metrics", headers=config.headers_admin
+        )
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        instance_cache = a["data"]["instance_cache"]
+        for k in ["hits", "misses", "evictions", "size"]:
+            self.assertIn(k, instance_cache["local"])
+        for k in ["hits", "misses"]:
+            self.assertIn(k, instance_cache["shared"])
+        self.assertIn("early_refreshes", instance_cache)
+
+    def test_mana_ledger_stats(self):
+        """
+        Checks that the reconciliations of the mana ledger are exposed.
+        """
+        # the ledger is reconciled at least once before the first mana check
+        r = requests.get(f"{config.plugin_url}/mana", headers=config.headers_user)
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        r = requests.get(
+            f"{config.plugin_url}/admin/metrics", headers=config.headers_admin
+        )
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        mana_ledger = a["data"]["mana_ledger"]
+        for k in ["reconciliations", "corrections", "reconciled_at"]:
+            self.assertIn(k, mana_ledger)
+        self.assertIsNotNone(mana_ledger["reconciled_at"])
+
+    def test_locks_stats(self):
+        """
+        Checks that the size and the contention of the local locks registry
+        are exposed.
+        """
+        r = requests.get(
+            f"{config.plugin_url}/admin/metrics", headers=config.headers_admin
+        )
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        locks = a["data"]["locks"]
+        for k in ["distributed", "size", "lookups", "created", "contended"]:
+            self.assertIn(k, locks)
+        self.assertTrue(locks["size"] >= 0)
+
+    def test_provisioning_stats(self):
+        """
+        Checks that the jobs of the asynchronous provisioning are exposed.
+        """
+        r = requests.get(
+            f"{config.plugin_url}/admin/metrics", headers=config.headers_admin
+        )
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        provisioning = a["data"]["provisioning"]
+        for k in ["enabled", "workers", "submitted", "running", "succeeded", "failed"]:
+            self.assertIn(k, provisioning)
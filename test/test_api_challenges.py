@@ -160,6 +160,32 @@ class Test_F_Challenges(unittest.TestCase):
         # Finally, clean the testing environment
         delete_challenge(chall_id)
 
+    def test_update_cache_ttl(self):
+        """
+        Performs tests on the instances cache policy, which is CTFd specific.
+        """
+        chall_id = create_challenge()
+
+        r = requests.get(
+            f"{config.ctfd_url}/api/v1/challenges/{chall_id}",
+            headers=config.headers_admin,
+        )
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+        self.assertEqual(a["data"]["cache_ttl"], None)  # default policy
+
+        for value, expected in [("120", 120), ("0", 0), ("", None)]:
+            r = requests.patch(
+                f"{config.ctfd_url}/api/v1/challenges/{chall_id}",
+                headers=config.headers_admin,
+                data=json.dumps({"cache_ttl": value}),
+            )
+            a = json.loads(r.text)
+            self.assertEqual(a["success"], True)
+            self.assertEqual(a["data"]["cache_ttl"], expected)
+
+        delete_challenge(chall_id)
+
     def test_cannot_create_challenge_if_no_scenario(self):
         """
         Performs tests that CTFd will generate an error if mandatory value is missing.
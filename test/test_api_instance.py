@@ -151,9 +151,8 @@ class Test_F_UserInstance(unittest.TestCase):
 
     def test_create_multi_instances(self):
         """
-        Tests concurrent creation of 3 instances, ensuring only 1 or 2 is approved.
-        The other requests should be rate-limited (HTTP 429).
-        If thread1 completes before thread2 starts, mana limitation may approve 2.
+        Tests concurrent creation of 3 instances, ensuring exactly 2 are approved.
+        Creations run in parallel, the mana is reserved so the third one is refused.
         """
         results = {}
         lock = threading.Lock()
@@ -194,12 +193,10 @@ class Test_F_UserInstance(unittest.TestCase):
             else:
                 formatted_result["failure"].append(instance_id)
 
-        self.assertTrue(
-            len(formatted_result["success"]) <= 2
-        )  # can be 2 if the thread1 in completed before thread2 start
-        self.assertTrue(
-            len(formatted_result["failure"]) >= 1
-        )  # at least one cannot be done (mana limitation)
+        self.assertEqual(len(formatted_result["success"]), 2)
+        self.assertEqual(
+            len(formatted_result["failure"]), 1
+        )  # cannot be done (mana limitation)
 
         # Clean test environment
         for i in formatted_result["success"]:
@@ -0,0 +1,89 @@
+"""
+This module defines tests cases on /job
+"""
+
+import json
+import time
+import unittest
+
+import requests
+
+from .utils import (
+    config,
+    create_challenge,
+    delete_challenge,
+    delete_instance,
+    post_instance,
+)
+
+
+# pylint: disable=invalid-name,missing-timeout,duplicate-code
+class Test_F_UserJob(unittest.TestCase):
+    """
+    Test_F_UserJob defines tests cases on /job
+    """
+
+    def test_missing_job_id(self):
+        """
+        Checks that the jobId is required.
+        """
+        r = requests.get(f"{config.plugin_url}/job", headers=config.headers_user)
+        self.assertEqual(r.status_code, 400)
+
+    def test_unknown_job(self):
+        """
+        Checks that an unknown job is not found.
+        """
+        r = requests.get(
+            f"{config.plugin_url}/job?jobId=unknown", headers=config.headers_user
+        )
+        self.assertEqual(r.status_code, 404)
+
+    def test_job_is_polled(self):
+        """
+        Checks that an instance created in background can be polled until
+        it is created, if asynchronous provisioning is enabled.
+        """
+        chall_id = create_challenge()
+
+        r = post_instance(chall_id)
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        if r.status_code == 202:
+            job_id = a["data"]["jobId"]
+            self.assertIn(a["data"]["state"], ["pending", "running"])
+
+            # the jobs of a source are not disclosed to the other ones
+            r = requests.get(
+                f"{config.plugin_url}/job?jobId={job_id}",
+                headers=config.headers_admin,
+            )
+            self.assertEqual(r.status_code, 404)
+
+            state = None
+            for _ in range(60):
+                r = requests.get(
+                    f"{config.plugin_url}/job?jobId={job_id}",
+                    headers=config.headers_user,
+                )
+                a = json.loads(r.text)
+                self.assertEqual(a["success"], True)
+                state = a["data"]["state"]
+                if state in ["succeeded", "failed"]:
+                    break
+                time.sleep(2)
+
+            self.assertEqual(state, "succeeded")
+            self.assertEqual(a["data"]["challengeId"], chall_id)
+            self.assertIn("since", a["data"])
+        else:
+            # synchronous provisioning
+            self.assertEqual(r.status_code, 200)
+            self.assertIn("since", a["data"])
+
+        r = delete_instance(chall_id)
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        delete_challenge(chall_id)
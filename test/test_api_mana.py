@@ -29,6 +29,8 @@ class Test_F_UserMana(unittest.TestCase):
         r = requests.get(f"{config.plugin_url}/mana", headers=config.headers_user)
         a = json.loads(r.text)
         self.assertEqual(a["success"], True)
+        for k in ["used", "pending", "total"]:
+            self.assertIn(k, a["data"])
 
     def test_mana_is_consum(self):
         """
@@ -48,9 +50,39 @@ class Test_F_UserMana(unittest.TestCase):
         r = requests.get(f"{config.plugin_url}/mana", headers=config.headers_user)
         a = json.loads(r.text)
         self.assertEqual(a["data"]["used"], mana_cost)
+        self.assertEqual(a["data"]["pending"], 0)  # instance created
 
         r = delete_instance(chall_id)
         a = json.loads(r.text)
         self.assertEqual(a["success"], True)
 
         delete_challenge(chall_id)
+
+    def test_mana_is_released(self):
+        """
+        Checks that mana is released once the instance is deleted.
+        """
+        mana_cost = 3
+        chall_id = create_challenge(mana_cost=mana_cost)
+
+        r = requests.get(f"{config.plugin_url}/mana", headers=config.headers_user)
+        a = json.loads(r.text)
+        used = a["data"]["used"]
+
+        r = post_instance(chall_id)
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        r = requests.get(f"{config.plugin_url}/mana", headers=config.headers_user)
+        a = json.loads(r.text)
+        self.assertEqual(a["data"]["used"], used + mana_cost)
+
+        r = delete_instance(chall_id)
+        a = json.loads(r.text)
+        self.assertEqual(a["success"], True)
+
+        r = requests.get(f"{config.plugin_url}/mana", headers=config.headers_user)
+        a = json.loads(r.text)
+        self.assertEqual(a["data"]["used"], used)
+
+        delete_challenge(chall_id)
@@ -0,0 +1,4 @@
+"""
+Unit tests of the plugin mechanisms, run inside CTFd (i.e. with the plugin installed
+in CTFd/plugins/ctfd_chall_manager), without Chall-Manager.
+"""
@@ -0,0 +1,80 @@
+"""
+This module defines the unit tests of the invalidation bus.
+"""
+
+import json
+from unittest import mock
+
+from CTFd.plugins.ctfd_chall_manager.utils import bus
+from CTFd.plugins.ctfd_chall_manager.utils.bus import (
+    INSTANCE_CREATED,
+    INSTANCE_DELETED,
+    Event,
+)
+
+from .utils import PluginTestCase
+
+
+def _message(event_origin: str, event_type: str = INSTANCE_CREATED) -> bytes:
+    return json.dumps(
+        {"origin": event_origin, "type": event_type, "challenge_id": 1, "source_id": 2}
+    ).encode()
+
+
+# pylint: disable=invalid-name,protected-access
+class Test_U_Bus(PluginTestCase):
+    """
+    Test_U_Bus defines the tests cases of the delivery of the events.
+    """
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.patch(bus, "_handlers", {})
+        self.handler = mock.Mock()
+        bus.on(INSTANCE_CREATED, self.handler)
+
+    def test_ignores_own_events(self):
+        """
+        Checks that a worker does not handle the events it published.
+        """
+        bus._dispatch(_message(bus.origin()))
+        self.handler.assert_not_called()
+
+    def test_handles_other_events(self):
+        """
+        Checks that the events of the other workers reach the handlers of their type.
+        """
+        bus._dispatch(_message("other:1"))
+        bus._dispatch(_message("other:1", INSTANCE_DELETED))
+        self.handler.assert_called_once_with(
+            Event(INSTANCE_CREATED, challenge_id=1, source_id=2)
+        )
+
+    def test_handler_errors_are_isolated(self):
+        """
+        Checks that a failing handler does not prevent the next ones.
+        """
+        failing = mock.Mock(side_effect=ValueError("boom"))
+        self.patch(bus, "_handlers", {INSTANCE_CREATED: [failing, self.handler]})
+
+        bus._dispatch(_message("other:1"))
+        self.handler.assert_called_once()
+
+    def test_origin_is_per_process(self):
+        """
+        Checks that a forked worker gets its own origin.
+        """
+        own = bus.origin()
+        with mock.patch.object(bus.os, "getpid", return_value=-1):
+            self.assertNotEqual(bus.origin(), own)
+
+    def test_emit_carries_origin(self):
+        """
+        Checks that the events published are tagged with the origin.
+        """
+        publish = self.patch(bus, "publish", mock.Mock(return_value=True))
+
+        self.assertTrue(bus.emit(Event(INSTANCE_CREATED, challenge_id=1)))
+        message = json.loads(publish.call_args.args[1])
+        self.assertEqual(message["origin"], bus.origin())
+        self.assertEqual(message["type"], INSTANCE_CREATED)
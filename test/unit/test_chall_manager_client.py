@@ -0,0 +1,138 @@
+"""
+This module defines the unit tests of the retries of the Chall-Manager client.
+"""
+
+import io
+from unittest import mock
+
+import requests
+from CTFd.plugins.ctfd_chall_manager.utils import chall_manager_client, circuit_breaker
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_client import (
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    ChallManagerClient,
+    _backoff,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.circuit_breaker import CircuitBreaker
+
+from .utils import FakeClock, PluginTestCase
+
+
+def _response(status_code: int) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.raw = io.BytesIO(b"")
+    return resp
+
+
+# pylint: disable=invalid-name
+class Test_U_ChallManagerClient(PluginTestCase):
+    """
+    Test_U_ChallManagerClient defines the tests cases of the retries
+    of idempotent calls.
+    """
+
+    modules = (circuit_breaker,)
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.clock = self.patch(chall_manager_client, "time", FakeClock())
+        self.patch(chall_manager_client, "_backoff", lambda attempt: 1.0)
+        self.patch(
+            chall_manager_client,
+            "breaker",
+            CircuitBreaker("test", failure_threshold=100, recovery_timeout=10),
+        )
+        self.client = ChallManagerClient(pool_maxsize=1, retry_attempts=3)
+        self.patch(self.client, "url", lambda path: f"http://cm{path}")
+
+    def test_retries_transient_failures(self):
+        """
+        Checks that idempotent calls are retried until they succeed.
+        """
+        with mock.patch.object(
+            self.client.session,
+            "request",
+            side_effect=[_response(503), _response(502), _response(200)],
+        ) as request:
+            resp = self.client.get("/api/v1/instance", timeout=(5, 30))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(request.call_count, 3)
+        stats = self.client.stats()
+        self.assertEqual(stats["retries"], 2)
+        self.assertEqual(stats["retry_succeeded"], 1)
+
+    def test_attempts_are_bounded(self):
+        """
+        Checks that a call is attempted at most retry_attempts times.
+        """
+        with mock.patch.object(
+            self.client.session, "request", return_value=_response(503)
+        ) as request:
+            resp = self.client.get("/api/v1/instance", timeout=(5, 30))
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(self.client.stats()["retry_exhausted"], 1)
+
+    def test_writes_are_not_retried(self):
+        """
+        Checks that non-idempotent calls are sent once.
+        """
+        with mock.patch.object(
+            self.client.session, "request", return_value=_response(503)
+        ) as request:
+            self.client.post("/api/v1/instance", timeout=(5, 30))
+
+        self.assertEqual(request.call_count, 1)
+
+    def test_attempts_share_the_budget(self):
+        """
+        Checks that each attempt only gets the remaining budget of the call,
+        and that no attempt starts if it cannot connect within it.
+        """
+        timeouts = []
+
+        def timing_out(*_args, timeout=None, **_kwargs):
+            timeouts.append(timeout)
+            self.clock.sleep(sum(timeout))
+            raise requests.Timeout()
+
+        start = self.clock.now
+        with mock.patch.object(self.client.session, "request", side_effect=timing_out):
+            with self.assertRaises(requests.Timeout):
+                self.client.get("/api/v1/instance", timeout=(5, 30))
+
+        # 35s for the first attempt, then 1s of backoff: not enough left to connect
+        self.assertEqual(timeouts, [(5, 30)])
+        self.assertLessEqual(self.clock.now - start, 35)
+
+        def refused_then_timing_out(*args, timeout=None, **kwargs):
+            if not timeouts:
+                timeouts.append(timeout)
+                raise requests.ConnectionError()
+            return timing_out(*args, timeout=timeout, **kwargs)
+
+        timeouts.clear()
+        start = self.clock.now
+        with mock.patch.object(
+            self.client.session, "request", side_effect=refused_then_timing_out
+        ):
+            with self.assertRaises(requests.Timeout):
+                self.client.get("/api/v1/instance", timeout=(5, 30))
+
+        # the first attempt failed at once, the next one only got the budget left
+        self.assertEqual(timeouts, [(5, 30), (5, 29)])
+        self.assertLessEqual(self.clock.now - start, 35)
+
+    def test_backoff_is_capped(self):
+        """
+        Checks that the delay between two attempts is capped.
+        """
+        for attempt in range(10):
+            delay = _backoff(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(
+                delay, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt)
+            )
@@ -0,0 +1,157 @@
+"""
+This module defines the unit tests of the circuit breaker.
+"""
+
+from unittest import mock
+
+import requests
+from CTFd.plugins.ctfd_chall_manager.utils import chall_manager_client, circuit_breaker
+from CTFd.plugins.ctfd_chall_manager.utils.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+)
+
+from .utils import FakeClock, PluginTestCase
+
+
+# pylint: disable=invalid-name,no-member
+class _CircuitBreakerTests:
+    """
+    _CircuitBreakerTests defines the tests cases of the circuit breaker,
+    run with local and distributed states.
+    """
+
+    modules = (circuit_breaker,)
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.clock = self.patch(circuit_breaker, "time", FakeClock())
+        self.breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=10)
+
+    def test_opens_after_threshold(self):
+        """
+        Checks that the breaker opens after failure_threshold consecutive failures.
+        """
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_failures(self):
+        """
+        Checks that only consecutive failures open the breaker.
+        """
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+    def test_single_probe_when_half_open(self):
+        """
+        Checks that a single call is let through once recovery_timeout is elapsed.
+        """
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.sleep(10)
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_probe_success_closes(self):
+        """
+        Checks that a successful probe closes the breaker.
+        """
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.sleep(10)
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_probe_failure_reopens(self):
+        """
+        Checks that a failed probe opens the breaker for another recovery_timeout.
+        """
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.sleep(10)
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.clock.sleep(10)
+        self.assertTrue(self.breaker.allow())
+
+    def test_unexpected_error_ends_probe(self):
+        """
+        Checks that a probe failing with an unexpected error does not leave
+        the breaker half-open forever.
+        """
+        if self.redis:
+            self.skipTest("distributed probes expire on their own")
+
+        client = chall_manager_client.ChallManagerClient(pool_maxsize=1)
+        self.patch(chall_manager_client, "breaker", self.breaker)
+        self.patch(client, "url", lambda path: f"http://cm{path}")
+
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.sleep(10)
+
+        with mock.patch.object(client.session, "request", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                client.get("/healthcheck")
+        self.assertTrue(self.breaker.allow())
+
+    def test_request_failure_is_recorded(self):
+        """
+        Checks that the calls of the client record their outcome.
+        """
+        client = chall_manager_client.ChallManagerClient(pool_maxsize=1)
+        self.patch(chall_manager_client, "breaker", self.breaker)
+        self.patch(client, "url", lambda path: f"http://cm{path}")
+
+        with mock.patch.object(
+            client.session, "request", side_effect=requests.ConnectionError
+        ):
+            for _ in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    client.post("/api/v1/instance")
+        self.assertEqual(self.breaker.state(), OPEN)
+
+
+class Test_U_CircuitBreaker(_CircuitBreakerTests, PluginTestCase):
+    """
+    Test_U_CircuitBreaker runs the tests cases with process local states.
+    """
+
+
+class Test_U_CircuitBreakerRedis(_CircuitBreakerTests, PluginTestCase):
+    """
+    Test_U_CircuitBreakerRedis runs the tests cases with states shared on Redis.
+    """
+
+    redis = True
+
+    def test_success_writes_nothing_when_closed(self):
+        """
+        Checks that a successful call does not write the state of a closed breaker.
+        """
+        self.breaker.record_success()
+        self.assertEqual(self.client.exists("chall-manager:breaker:test"), 0)
+
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.assertEqual(
+            self.client.hget("chall-manager:breaker:test", "failures"), b"0"
+        )
@@ -0,0 +1,153 @@
+"""
+This module defines the unit tests of the mana reservations of the instances.
+"""
+
+from types import SimpleNamespace
+from unittest import mock
+
+from CTFd.plugins.ctfd_chall_manager.utils import helpers, mana_ledger
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
+    ChallManagerException,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.helpers import (
+    calculate_mana_usage,
+    reserve_instance_mana,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.instance_cache import LocalCache
+from CTFd.plugins.ctfd_chall_manager.utils.mana_ledger import (
+    IN_PROGRESS,
+    REFUSED,
+    RESERVED,
+    ManaLedger,
+)
+
+from .utils import PluginTestCase
+
+CHALLENGES = {
+    1: SimpleNamespace(mana_cost=3, shared=False),
+    2: SimpleNamespace(mana_cost=0, shared=False),
+    3: SimpleNamespace(mana_cost=3, shared=False),
+}
+
+
+# pylint: disable=invalid-name,no-member
+class _ReserveTests:
+    """
+    _ReserveTests defines the tests cases of reserve_instance_mana,
+    run with local and distributed states.
+    """
+
+    modules = (mana_ledger,)
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.mana_total = 5
+        self.patch(
+            helpers,
+            "settings",
+            mock.Mock(get_int=lambda key, default=0: self.mana_total),
+        )
+        self.patch(helpers, "challenge_index", mock.Mock(all=lambda: CHALLENGES))
+        self.patch(helpers, "load_challenge", CHALLENGES.get)
+        self.patch(helpers, "timeout_for", lambda kind: (5, 30))
+        self.patch(helpers, "mana_ledger", ManaLedger(reconcile_interval=300))
+        self.ensure = self.patch(helpers, "ensure_mana_ledger_reconciled", mock.Mock())
+        self.records = self.patch(
+            helpers, "iter_instance_records", mock.Mock(return_value=iter(()))
+        )
+        self.patch(helpers, "reconciled_sources", LocalCache(16, 10))
+
+    def assert_chall_manager_reached(self, reached: bool):
+        """
+        Checks whether the reservation reached Chall-Manager (reconciliation).
+        """
+        self.assertEqual(self.ensure.called or self.records.called, reached)
+
+    def test_mana_disabled(self):
+        """
+        Checks that without mana, the reservation does not reach Chall-Manager
+        and only detects the creations in progress.
+        """
+        self.mana_total = 0
+
+        self.assertEqual(reserve_instance_mana(1, 1), RESERVED)
+        self.assertEqual(reserve_instance_mana(1, 1), IN_PROGRESS)
+        self.assert_chall_manager_reached(False)
+
+    def test_free_instance(self):
+        """
+        Checks that a free instance does not reach Chall-Manager.
+        """
+        self.assertEqual(reserve_instance_mana(2, 1), RESERVED)
+        self.assert_chall_manager_reached(False)
+
+    def test_charged_instance(self):
+        """
+        Checks that a charged instance is reserved on a reconciled ledger.
+        """
+        self.assertEqual(reserve_instance_mana(1, 1), RESERVED)
+        self.assert_chall_manager_reached(True)
+
+    def test_unavailable_refuses(self):
+        """
+        Checks that a charged instance is refused if the ledger cannot be reconciled.
+        """
+        self.ensure.side_effect = ChallManagerException()
+        self.records.side_effect = ChallManagerException()
+
+        self.assertEqual(reserve_instance_mana(1, 1), REFUSED)
+
+
+class Test_U_Reserve(_ReserveTests, PluginTestCase):
+    """
+    Test_U_Reserve runs the reservation tests with local states.
+    """
+
+    def test_checks_other_workers(self):
+        """
+        Checks that the instances created by other workers are counted.
+        """
+        self.records.return_value = iter(
+            (SimpleNamespace(challenge_id="3", until=None),)
+        )
+
+        self.assertEqual(reserve_instance_mana(1, 1), REFUSED)
+        self.ensure.assert_not_called()
+
+    def test_usage_counts_other_workers(self):
+        """
+        Checks that the mana used counts the instances created by other workers,
+        reconciling a source at most once per interval.
+        """
+        self.records.return_value = iter(
+            (SimpleNamespace(challenge_id="3", until=None),)
+        )
+
+        self.assertEqual(calculate_mana_usage(1), {"used": 3, "pending": 0})
+        self.assertEqual(calculate_mana_usage(1), {"used": 3, "pending": 0})
+        self.records.assert_called_once_with(1)
+
+    def test_usage_unavailable_uses_ledger(self):
+        """
+        Checks that the mana used is read from the ledger of the worker if
+        Chall-Manager cannot be reached.
+        """
+        self.records.side_effect = ChallManagerException()
+
+        self.assertEqual(calculate_mana_usage(1), {"used": 0, "pending": 0})
+
+
+class Test_U_ReserveRedis(_ReserveTests, PluginTestCase):
+    """
+    Test_U_ReserveRedis runs the reservation tests with states in Redis.
+    """
+
+    redis = True
+
+    def test_uses_shared_ledger(self):
+        """
+        Checks that the shared ledger is not reconciled per source.
+        """
+        self.assertEqual(reserve_instance_mana(1, 1), RESERVED)
+        self.ensure.assert_called_once()
+        self.records.assert_not_called()
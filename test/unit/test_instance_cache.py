@@ -0,0 +1,96 @@
+"""
+This module defines the unit tests of the two-tier instances cache.
+"""
+
+from CTFd.plugins.ctfd_chall_manager.utils import instance_cache
+from CTFd.plugins.ctfd_chall_manager.utils.instance_cache import (
+    _INVALIDATE_LUA,
+    InstanceCache,
+    LocalCache,
+)
+
+from .utils import FakeCache, PluginTestCase
+
+
+# pylint: disable=invalid-name,no-member
+class _InstanceCacheTests:
+    """
+    _InstanceCacheTests defines the tests cases of the instances cache,
+    run with local and distributed states.
+    """
+
+    modules = (instance_cache,)
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.cache = self.patch(instance_cache, "cache", FakeCache(self.client))
+        self.patch(instance_cache, "listening", lambda: True)
+        if self.client is not None:
+            self.patch(
+                instance_cache,
+                "_invalidate_script",
+                self.client.register_script(_INVALIDATE_LUA),
+            )
+        self.instances = InstanceCache(LocalCache(16, 5))
+
+    def test_invalidate_tags(self):
+        """
+        Checks that the keys of a tag are deleted from both tiers,
+        and the keys of the other tags are kept.
+        """
+        self.instances.set("instance:1:1", {"a": 1}, timeout=60)
+        self.instances.set("instance:1:2", {"a": 2}, timeout=60)
+        self.instances.set("instance:2:1", {"a": 3}, timeout=60)
+        self.instances.tag(("instance:1:1", "instance:1:2"), ("challenge:1",), 60)
+        self.instances.tag(("instance:2:1",), ("challenge:2",), 60)
+
+        self.assertEqual(self.instances.invalidate_tags("challenge:1"), 2)
+
+        self.assertIsNone(self.instances.get("instance:1:1"))
+        self.assertIsNone(self.cache.get("instance:1:2"))
+        self.assertIsNone(self.instances.local.get("instance:1:2"))
+        self.assertEqual(self.instances.get("instance:2:1"), {"a": 3})
+        self.assertEqual(self.instances.invalidate_tags("challenge:1"), 0)
+
+    def test_tags_are_shared(self):
+        """
+        Checks that keys tagged by a worker are deleted by another one.
+        """
+        self.instances.set("instance:1:1", {"a": 1}, timeout=60)
+        self.instances.tag(("instance:1:1",), ("challenge:1",), 60)
+
+        other = InstanceCache(LocalCache(16, 5))
+        self.assertEqual(other.invalidate_tags("challenge:1"), 1)
+        self.assertIsNone(self.cache.get("instance:1:1"))
+
+    def test_tags_accumulate(self):
+        """
+        Checks that tagging keys keeps the keys already tagged.
+        """
+        self.instances.set("instance:1:1", {"a": 1}, timeout=60)
+        self.instances.set("instance:1:2", {"a": 2}, timeout=60)
+        self.instances.tag(("instance:1:1",), ("challenge:1",), 60)
+        self.instances.tag(("instance:1:2",), ("challenge:1",), 60)
+
+        self.assertEqual(self.instances.invalidate_tags("challenge:1"), 2)
+
+
+class Test_U_InstanceCache(_InstanceCacheTests, PluginTestCase):
+    """
+    Test_U_InstanceCache runs the instances cache tests with local states.
+    """
+
+
+class Test_U_InstanceCacheRedis(_InstanceCacheTests, PluginTestCase):
+    """
+    Test_U_InstanceCacheRedis runs the instances cache tests with states in Redis.
+    """
+
+    redis = True
+
+    def test_tags_expire(self):
+        """
+        Checks that the tags expire, so they do not grow unbounded.
+        """
+        self.instances.tag(("instance:1:1",), ("challenge:1",), 60)
+        self.assertEqual(self.client.ttl("chall-manager:tag:challenge:1"), 60)
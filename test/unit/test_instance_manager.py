@@ -0,0 +1,192 @@
+"""
+This module defines the unit tests of the instances informations cache.
+"""
+
+import datetime
+import json
+from unittest import mock
+
+import requests
+from CTFd.plugins.ctfd_chall_manager.utils import (
+    instance_cache,
+    instance_manager,
+    singleflight,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
+    ChallManagerException,
+    ChallManagerUnavailableException,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.instance_cache import (
+    InstanceCache,
+    LocalCache,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import (
+    MISSING,
+    get_instance,
+    query_instance,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.records import InstanceRecord
+
+from .utils import FakeCache, PluginTestCase
+
+CACHE_KEY = "instance:1:2"
+INSTANCE = {"challengeId": "1", "sourceId": "2", "since": "2026-01-01T00:00:00Z"}
+NOT_FOUND = {"code": 5, "message": "instance not found", "details": []}
+
+
+def _response(status_code: int, body: dict) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.url = "http://cm/api/v1/instance/1/2"
+    resp.reason = "Not Found" if status_code == 404 else "OK"
+    resp._content = json.dumps(body).encode()  # pylint: disable=protected-access
+    resp.elapsed = datetime.timedelta(seconds=0.1)
+    return resp
+
+
+# pylint: disable=invalid-name,no-member
+class _InstanceManagerTests:
+    """
+    _InstanceManagerTests defines the tests cases of the instances informations
+    cache, run with local and distributed states.
+    """
+
+    modules = (instance_cache, singleflight)
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.cache = FakeCache(self.client)
+        self.patch(instance_cache, "cache", self.cache)
+        self.patch(instance_manager, "cache", self.cache)
+        self.patch(instance_cache, "listening", lambda: True)
+        self.patch(instance_manager, "challenge_index", mock.Mock(get=lambda _: None))
+        self.instance_cache = self.patch(
+            instance_manager, "instance_cache", InstanceCache(LocalCache(16, 5))
+        )
+        self.cm = mock.Mock()
+        self.patch(instance_manager, "get_client", lambda: self.cm)
+        self.patch(instance_manager, "timeout_for", lambda kind: (5, 30))
+
+    def test_missing_instance_is_cached(self):
+        """
+        Checks that an instance known to not exist is not requested again
+        until the negative entry expires.
+        """
+        self.cm.get.return_value = _response(404, NOT_FOUND)
+
+        for _ in range(3):
+            with self.assertRaises(ChallManagerException) as ctx:
+                get_instance(1, 2)
+            self.assertEqual(ctx.exception.http_code, 404)
+            self.assertEqual(ctx.exception.message, "instance not found")
+
+        self.assertEqual(self.cm.get.call_count, 1)
+
+    def test_missing_instance_does_not_overwrite(self):
+        """
+        Checks that the negative entry does not overwrite an instance created
+        meanwhile.
+        """
+        self.cm.get.return_value = _response(404, NOT_FOUND)
+        self.cache.set(CACHE_KEY, (INSTANCE, 2e9, 0.0), timeout=60)
+
+        with self.assertRaises(ChallManagerException):
+            instance_manager._fetch_instance(1, 2)  # pylint: disable=protected-access
+
+        self.assertEqual(self.cache.get(CACHE_KEY)[0], INSTANCE)
+
+    def test_created_instance_replaces_missing(self):
+        """
+        Checks that the negative entry is replaced once the instance is stored.
+        """
+        self.cm.get.return_value = _response(404, NOT_FOUND)
+        with self.assertRaises(ChallManagerException):
+            get_instance(1, 2)
+        self.assertIn(MISSING, self.instance_cache.get(CACHE_KEY))
+
+        instance_manager._store(1, 2, INSTANCE)  # pylint: disable=protected-access
+
+        self.assertEqual(get_instance(1, 2), INSTANCE)
+        self.assertEqual(self.cm.get.call_count, 1)
+
+    def test_refresh_claimed_once(self):
+        """
+        Checks that a single caller refreshes an entry close to expire,
+        while the others are served the cached value.
+        """
+        self.instance_cache.set(CACHE_KEY, INSTANCE, timeout=60)
+        self.patch(self.instance_cache, "should_refresh", lambda entry: True)
+        fetch = self.patch(
+            instance_manager, "_fetch_instance", mock.Mock(return_value=INSTANCE)
+        )
+        self.instance_cache.claim_refresh(CACHE_KEY, timeout=5)
+
+        self.assertEqual(get_instance(1, 2), INSTANCE)
+        fetch.assert_not_called()
+
+        self.instance_cache.release_refresh(CACHE_KEY)
+        self.assertEqual(get_instance(1, 2), INSTANCE)
+        fetch.assert_called_once_with(1, 2)
+        self.assertTrue(self.instance_cache.claim_refresh(CACHE_KEY, timeout=5))
+
+    def test_refresh_failure_serves_cache(self):
+        """
+        Checks that the cached value is served if the early refresh fails.
+        """
+        self.instance_cache.set(CACHE_KEY, INSTANCE, timeout=60)
+        self.patch(self.instance_cache, "should_refresh", lambda entry: True)
+        self.cm.get.side_effect = requests.ConnectionError()
+
+        self.assertEqual(get_instance(1, 2), INSTANCE)
+        self.assertEqual(self.cm.get.call_count, 1)
+
+    def test_refresh_missing_instance(self):
+        """
+        Checks that an entry which early refresh finds no instance is replaced
+        by a negative one.
+        """
+        self.instance_cache.set(CACHE_KEY, INSTANCE, timeout=60)
+        self.patch(self.instance_cache, "should_refresh", lambda entry: True)
+        self.cm.get.return_value = _response(404, NOT_FOUND)
+
+        with self.assertRaises(ChallManagerException):
+            get_instance(1, 2)
+        self.patch(self.instance_cache, "should_refresh", lambda entry: False)
+        with self.assertRaises(ChallManagerException):
+            get_instance(1, 2)
+        self.assertEqual(self.cm.get.call_count, 1)
+
+    def test_query_unavailable_serves_stale(self):
+        """
+        Checks that the last instances queried are served while Chall-Manager
+        is unavailable, without the expired ones.
+        """
+        expired = dict(INSTANCE, challengeId="3", until="2000-01-01T00:00:00Z")
+        records = self.patch(
+            instance_manager,
+            "iter_instance_records",
+            mock.Mock(return_value=iter((InstanceRecord.from_json(INSTANCE),))),
+        )
+        queried = query_instance(2)
+        self.assertEqual(queried[0]["challengeId"], "1")
+
+        self.cache.set("stale-query:2", queried + [expired])
+        records.side_effect = ChallManagerUnavailableException()
+        self.assertEqual([i["challengeId"] for i in query_instance(2)], ["1"])
+
+        with self.assertRaises(ChallManagerUnavailableException):
+            query_instance(3)
+
+
+class Test_U_InstanceManager(_InstanceManagerTests, PluginTestCase):
+    """
+    Test_U_InstanceManager runs the instances cache tests with local states.
+    """
+
+
+class Test_U_InstanceManagerRedis(_InstanceManagerTests, PluginTestCase):
+    """
+    Test_U_InstanceManagerRedis runs the instances cache tests with states in Redis.
+    """
+
+    redis = True
@@ -0,0 +1,221 @@
+"""
+This module defines the unit tests of the instances created in background.
+"""
+
+import contextlib
+import queue
+import threading
+from unittest import mock
+
+from CTFd.plugins.ctfd_chall_manager.utils import helpers, jobs, mana_ledger
+from CTFd.plugins.ctfd_chall_manager.utils.jobs import (
+    FAILED,
+    PENDING,
+    RUNNING,
+    SUCCEEDED,
+    Job,
+    Provisioner,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.mana_ledger import (
+    EXISTS,
+    REFUSED,
+    RELEASED,
+    RESERVED,
+    ManaLedger,
+)
+
+from .utils import FakeClock, PluginTestCase
+
+
+# pylint: disable=invalid-name,no-member,protected-access
+class _ProvisionerTests:
+    """
+    _ProvisionerTests defines the tests cases of the jobs, run with local and
+    distributed states. Jobs are run by the test thread.
+    """
+
+    modules = (jobs, mana_ledger)
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.clock = self.patch(mana_ledger, "time", FakeClock())
+        self.patch(jobs, "time", self.clock)
+        self.ledger = self.patch(helpers, "mana_ledger", ManaLedger(300))
+        self.patch(helpers, "timeout_for", lambda kind: (5, 30))
+        self.patch(jobs, "timeout_for", lambda kind: (5, 30))
+        self.reserve = self.patch(helpers, "reserve_instance_mana", mock.Mock())
+        self.lock = mock.Mock()
+        self.create = self.patch(jobs, "create_instance", mock.Mock())
+        self.app = mock.Mock(app_context=contextlib.nullcontext)
+        self.provisioner = Provisioner(enabled=True, workers=1)
+
+    def run_job(self, wait: float = 0) -> Job:
+        """
+        Runs the creation of the instance of challenge 1 for source 1,
+        which mana is reserved for 10 seconds, after waiting wait seconds.
+        """
+        self.assertEqual(
+            self.ledger.reserve(1, 1, lambda _: 1, mana_total=5, timeout=10), RESERVED
+        )
+        self.clock.sleep(wait)
+        job = Job("job", 1, 1)
+        self.provisioner.store.save(job)
+        self.provisioner._run(self.app, job, RESERVED, self.lock)
+        return self.provisioner.store.get("job")
+
+    def test_reservation_is_renewed(self):
+        """
+        Checks that the reservation is extended for the creation timeout once
+        the job starts.
+        """
+        expires_at = {}
+
+        def create(challenge_id, source_id):
+            expires_at["value"] = self.ledger.entries(source_id)[challenge_id][0]
+            return {"connectionInfo": "nc localhost 1337"}
+
+        self.create.side_effect = create
+
+        job = self.run_job(wait=5)
+
+        self.assertEqual(job.state, SUCCEEDED)
+        self.assertEqual(expires_at["value"], self.clock.time() + 35)
+
+    def test_expired_reservation_is_checked_again(self):
+        """
+        Checks that the mana is checked again if the reservation expired while
+        the job was waiting.
+        """
+        self.reserve.return_value = REFUSED
+
+        job = self.run_job(wait=11)
+
+        self.assertEqual(job.state, FAILED)
+        self.reserve.assert_called_once_with(1, 1)
+        self.create.assert_not_called()
+
+    def test_unexpected_error_cancels_reservation(self):
+        """
+        Checks that the reservation is ended if the job fails unexpectedly.
+        """
+        self.create.side_effect = ValueError("boom")
+
+        job = self.run_job()
+
+        self.assertEqual(job.state, FAILED)
+        self.assertEqual(self.ledger.entries(1)[1].expires_at, RELEASED)
+        self.lock.unlock.assert_called_once()
+
+    def test_locks_handed_over(self):
+        """
+        Checks that the job releases the locks acquired by the request.
+        """
+        self.create.return_value = {"connectionInfo": "nc localhost 1337"}
+
+        job = self.run_job()
+
+        self.assertEqual(job.state, SUCCEEDED)
+        self.lock.adopt.assert_called_once()
+        self.lock.unlock.assert_called_once()
+
+    def test_stale_job_is_failed(self):
+        """
+        Checks that a job which did not change for too long is reported failed.
+        """
+        job = Job("job", 1, 1, state=RUNNING)
+        self.provisioner.store.save(job)
+        self.clock.sleep(self.provisioner.stale_after() + 1)
+
+        self.assertEqual(self.provisioner.get("job").state, FAILED)
+
+        job.state = SUCCEEDED
+        self.provisioner.store.save(job)
+        self.assertEqual(self.provisioner.get("job").state, SUCCEEDED)
+
+    def test_running_job(self):
+        """
+        Checks that a job which recently changed is reported as is.
+        """
+        self.provisioner.store.save(Job("job", 1, 1))
+        self.assertEqual(self.provisioner.get("job").state, PENDING)
+        self.assertIsNone(self.provisioner.get("other"))
+
+    def test_queued_jobs(self):
+        """
+        Checks that the jobs waiting for a thread are not reported failed while
+        the ones before them run, and that a job that waited too long is not
+        run once reported failed.
+        """
+        self.patch(jobs, "QUEUE_TIMEOUT", 100)
+        started = queue.Queue()
+        releases = {i: threading.Event() for i in (1, 2, 3)}
+
+        def create(challenge_id, _source_id):
+            started.put(challenge_id)
+            releases[challenge_id].wait(5)
+            return {}
+
+        self.create.side_effect = create
+        submitted = [
+            self.provisioner.submit(self.app, i, 1, EXISTS, self.lock)
+            for i in (1, 2, 3)
+        ]
+        self.assertEqual(started.get(timeout=5), 1)
+
+        self.clock.sleep(30)
+        releases[1].set()
+        self.assertEqual(started.get(timeout=5), 2)
+
+        # queued for longer than a creation can run
+        self.clock.sleep(10)
+        states = [self.provisioner.get(job.id).state for job in submitted]
+        self.assertEqual(states[1:], [RUNNING, PENDING])
+
+        self.clock.sleep(100)
+        self.assertEqual(self.provisioner.get(submitted[2].id).state, FAILED)
+        releases[2].set()
+        self.provisioner._pool().shutdown(wait=True)
+
+        self.assertEqual(self.provisioner.get(submitted[2].id).state, FAILED)
+        self.assertEqual([c.args[0] for c in self.create.call_args_list], [1, 2])
+        self.assertEqual(self.lock.unlock.call_count, 3)
+
+
+class Test_U_Provisioner(_ProvisionerTests, PluginTestCase):
+    """
+    Test_U_Provisioner runs the jobs tests with local states.
+    """
+
+    def test_disabled_with_several_workers(self):
+        """
+        Checks that the jobs are disabled without Redis with several CTFd workers.
+        """
+        with mock.patch.dict(
+            jobs.os.environ,
+            {"PLUGIN_SETTINGS_CM_ASYNC_PROVISIONING": "true", "WORKERS": "2"},
+        ):
+            self.assertFalse(jobs._async_provisioning())
+
+        with mock.patch.dict(
+            jobs.os.environ,
+            {"PLUGIN_SETTINGS_CM_ASYNC_PROVISIONING": "true", "WORKERS": "1"},
+        ):
+            self.assertTrue(jobs._async_provisioning())
+
+
+class Test_U_ProvisionerRedis(_ProvisionerTests, PluginTestCase):
+    """
+    Test_U_ProvisionerRedis runs the jobs tests with states in Redis.
+    """
+
+    redis = True
+
+    def test_enabled_with_several_workers(self):
+        """
+        Checks that the jobs are enabled with Redis with several CTFd workers.
+        """
+        with mock.patch.dict(
+            jobs.os.environ,
+            {"PLUGIN_SETTINGS_CM_ASYNC_PROVISIONING": "true", "WORKERS": "2"},
+        ):
+            self.assertTrue(jobs._async_provisioning())
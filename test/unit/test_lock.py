@@ -0,0 +1,290 @@
+"""
+This module defines the unit tests of the locks.
+"""
+
+import gc
+import threading
+import time
+
+from CTFd.plugins.ctfd_chall_manager.utils import lock
+from CTFd.plugins.ctfd_chall_manager.utils.lock import (
+    PENDING_PREFIX,
+    InstanceLock,
+    force_release,
+    list_locks,
+    load_or_store,
+    load_or_store_rw,
+)
+
+from .utils import PluginTestCase
+
+NAME = "source:1"
+
+
+# pylint: disable=invalid-name,no-member
+class _LockTests:
+    """
+    _LockTests defines the tests cases of the locks, run with local and
+    distributed locks. Holders run in their own thread, as the requests
+    of a worker.
+    """
+
+    modules = (lock,)
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.patch(lock, "LOCK_POLL", 0.01)
+
+    def hold(self, acquire, name: str = NAME, factory=load_or_store_rw):
+        """
+        Acquires the lock name with acquire in another thread, and holds it until
+        the returned event is set.
+        Returns whether the lock was acquired, and the event.
+        """
+        acquired, release = threading.Event(), threading.Event()
+        outcome = {}
+
+        def run():
+            held = factory(name)
+            outcome["ok"] = acquire(held)
+            acquired.set()
+            release.wait(5)
+            if outcome["ok"]:
+                held.unlock()
+
+        holder = threading.Thread(target=run)
+        holder.start()
+        acquired.wait(5)
+        self.addCleanup(holder.join, 5)
+        self.addCleanup(release.set)
+        return outcome["ok"], release, holder
+
+    def wait_until(self, condition, timeout: float = 2):
+        """
+        Waits until condition() is True, fails after timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() >= deadline:
+                self.fail("condition not met")
+            time.sleep(0.01)
+
+    def exclusive_waiting(self, rw) -> bool:
+        """
+        Returns True if an exclusive holder waits for the lock rw.
+        """
+        if self.client is None:
+            return rw._writers_waiting > 0  # pylint: disable=protected-access
+        return bool(self.client.exists(f"{PENDING_PREFIX}{rw.name}"))
+
+    def test_shared_holders_run_concurrently(self):
+        """
+        Checks that a lock held shared can be held shared by another holder.
+        """
+        ok, _, _ = self.hold(lambda rw: rw.lock_shared(0))
+        self.assertTrue(ok)
+
+        rw = load_or_store_rw(NAME)
+        self.assertTrue(rw.lock_shared(0))
+        self.assertTrue(rw.is_locked())
+        rw.unlock()
+
+    def test_exclusive_waits_for_shared(self):
+        """
+        Checks that a lock held shared cannot be held exclusively until released.
+        """
+        _, release, holder = self.hold(lambda rw: rw.lock_shared(0))
+
+        rw = load_or_store_rw(NAME)
+        self.assertFalse(rw.lock_exclusive(0))
+
+        release.set()
+        holder.join(5)
+        self.assertTrue(rw.lock_exclusive(0))
+        rw.unlock()
+        self.assertFalse(rw.is_locked())
+
+    def test_exclusive_runs_alone(self):
+        """
+        Checks that a lock held exclusively cannot be held by another holder.
+        """
+        ok, _, _ = self.hold(lambda rw: rw.lock_exclusive(0))
+        self.assertTrue(ok)
+
+        rw = load_or_store_rw(NAME)
+        self.assertFalse(rw.lock_shared(0))
+        self.assertFalse(rw.lock_exclusive(0))
+
+    def test_waiting_exclusive_has_priority(self):
+        """
+        Checks that no new shared holder gets the lock while an exclusive holder
+        waits for it, and that the exclusive holder gets it once released.
+        """
+        _, release, _ = self.hold(lambda rw: rw.lock_shared(0))
+        rw = load_or_store_rw(NAME)
+        outcome = {}
+
+        def write():
+            writer = load_or_store_rw(NAME)
+            outcome["ok"] = writer.lock_exclusive(5)
+            if outcome["ok"]:
+                writer.unlock()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        self.addCleanup(writer.join, 5)
+
+        self.wait_until(lambda: self.exclusive_waiting(rw))
+        self.assertFalse(rw.lock_shared(0))
+
+        release.set()
+        writer.join(5)
+        self.assertTrue(outcome["ok"])
+        self.assertTrue(rw.lock_shared(0))
+        rw.unlock()
+
+    def test_timed_out_exclusive_lets_shared(self):
+        """
+        Checks that an exclusive holder that gave up waiting does not hold back
+        the shared holders anymore.
+        """
+        self.hold(lambda rw: rw.lock_shared(0))
+
+        rw = load_or_store_rw(NAME)
+        self.assertFalse(rw.lock_exclusive(0.05))
+        self.assertTrue(rw.lock_shared(0))
+        rw.unlock()
+
+    def test_instances_of_a_source_run_concurrently(self):
+        """
+        Checks that the operations on different instances of a source run
+        concurrently, and the ones on the same instance do not.
+        """
+        ok, _, _ = self.hold(
+            lambda il: il.try_lock(), factory=lambda name: InstanceLock(1, 1)
+        )
+        self.assertTrue(ok)
+
+        other = InstanceLock(2, 1)
+        self.assertTrue(other.try_lock())
+        other.unlock()
+
+        self.assertFalse(InstanceLock(1, 1).try_lock())
+        self.assertFalse(InstanceLock(1, 1, exclusive=True).try_lock())
+
+    def test_exclusive_source_blocks_instances(self):
+        """
+        Checks that an operation holding its source exclusively runs alone.
+        """
+        ok, _, _ = self.hold(
+            lambda il: il.try_lock(),
+            factory=lambda name: InstanceLock(1, 1, exclusive=True),
+        )
+        self.assertTrue(ok)
+
+        self.assertFalse(InstanceLock(2, 1).try_lock())
+        other = InstanceLock(2, 2)
+        self.assertTrue(other.try_lock())
+        other.unlock()
+
+    def test_locks_handed_over(self):
+        """
+        Checks that the locks of an instance acquired by a thread can be
+        released by the thread they are handed over to.
+        """
+        held = InstanceLock(1, 1)
+        self.assertTrue(held.try_lock())
+
+        def release():
+            held.adopt()
+            held.unlock()
+
+        releaser = threading.Thread(target=release)
+        releaser.start()
+        releaser.join(5)
+
+        again = InstanceLock(1, 1, exclusive=True)
+        self.assertTrue(again.try_lock())
+        again.unlock()
+
+    def test_lock(self):
+        """
+        Checks that a lock cannot be held twice, and is listed while held.
+        """
+        ok, release, holder = self.hold(
+            lambda held: held.try_lock(), name="instance:1:1", factory=load_or_store
+        )
+        self.assertTrue(ok)
+
+        self.assertFalse(load_or_store("instance:1:1").lock(0.05))
+        self.assertIn("instance:1:1", [entry["name"] for entry in list_locks()])
+
+        release.set()
+        holder.join(5)
+        held = load_or_store("instance:1:1")
+        self.assertTrue(held.try_lock())
+        held.unlock()
+
+    def test_force_release(self):
+        """
+        Checks that a lock left by its holder can be released, and that the
+        holder release does not fail afterwards.
+        """
+        held = load_or_store("instance:1:1")
+        self.assertTrue(held.try_lock())
+
+        self.assertTrue(force_release("instance:1:1"))
+        again = load_or_store("instance:1:1")
+        self.assertTrue(again.try_lock())
+        again.unlock()
+        held.unlock()
+
+
+class Test_U_Lock(_LockTests, PluginTestCase):
+    """
+    Test_U_Lock runs the locks tests with local locks.
+    """
+
+    def test_unused_locks_are_evicted(self):
+        """
+        Checks that the registry does not keep the locks no request uses.
+        """
+        held = load_or_store(NAME)
+        self.assertIs(lock.registry.get(NAME), held)
+
+        del held
+        gc.collect()
+        self.assertIsNone(lock.registry.get(NAME))
+
+
+class Test_U_LockRedis(_LockTests, PluginTestCase):
+    """
+    Test_U_LockRedis runs the locks tests with distributed locks.
+    """
+
+    redis = True
+
+    def test_shared_lease_expires(self):
+        """
+        Checks that the shared lease of a killed worker expires.
+        """
+        self.patch(lock, "LOCK_TIMEOUT", 0.1)
+        holder = load_or_store_rw(NAME)
+        self.assertTrue(holder.lock_shared(0))
+        holder._renewal.set()  # pylint: disable=protected-access
+
+        writer = load_or_store_rw(NAME)
+        self.assertTrue(writer.lock_exclusive(1))
+        writer.unlock()
+
+    def test_lease_is_renewed(self):
+        """
+        Checks that a lock held longer than its lease is renewed.
+        """
+        self.patch(lock, "LOCK_TIMEOUT", 0.3)
+        holder = load_or_store_rw(NAME)
+        self.assertTrue(holder.lock_exclusive(0))
+
+        time.sleep(0.5)
+        self.assertFalse(load_or_store_rw(NAME).lock_shared(0))
+        holder.unlock()
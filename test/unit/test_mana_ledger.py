@@ -0,0 +1,134 @@
+"""
+This module defines the unit tests of the mana ledger.
+"""
+
+from CTFd.plugins.ctfd_chall_manager.utils import mana_ledger
+from CTFd.plugins.ctfd_chall_manager.utils.mana_ledger import (
+    _REPLACE_LUA,
+    EXISTS,
+    IN_PROGRESS,
+    REFUSED,
+    RESERVED,
+    ManaLedger,
+)
+
+from .utils import FakeClock, PluginTestCase
+
+COSTS = {1: 3, 2: 3, 3: 0}
+
+
+# pylint: disable=invalid-name,no-member
+class _ManaLedgerTests:
+    """
+    _ManaLedgerTests defines the tests cases of the mana ledger,
+    run with local and distributed states.
+    """
+
+    modules = (mana_ledger,)
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.clock = self.patch(mana_ledger, "time", FakeClock())
+        if self.client is not None:
+            self.patch(
+                mana_ledger,
+                "_replace_script",
+                self.client.register_script(_REPLACE_LUA),
+            )
+        self.ledger = ManaLedger(reconcile_interval=300)
+
+    def reserve(self, challenge_id: int, source_id: int = 1) -> str:
+        """
+        Reserve an instance of challenge_id for source_id, with a mana of 5.
+        """
+        return self.ledger.reserve(
+            challenge_id, source_id, COSTS.get, mana_total=5, timeout=10
+        )
+
+    def test_reserve_within_mana(self):
+        """
+        Checks that a source cannot reserve more than its mana.
+        """
+        self.assertEqual(self.reserve(1), RESERVED)
+        self.assertEqual(self.reserve(2), REFUSED)
+        self.assertEqual(self.reserve(3), RESERVED)  # free
+        self.assertEqual(self.reserve(2, source_id=2), RESERVED)
+
+    def test_reserve_detects_creations(self):
+        """
+        Checks that a reservation is refused while the instance is being created,
+        or once it exists.
+        """
+        self.assertEqual(self.reserve(1), RESERVED)
+        self.assertEqual(self.reserve(1), IN_PROGRESS)
+
+        self.ledger.record(1, 1, self.clock.time() + 60)
+        self.assertEqual(self.reserve(1), EXISTS)
+
+        self.ledger.release(1, 1)
+        self.assertEqual(self.reserve(2), RESERVED)
+
+    def test_reservation_expires(self):
+        """
+        Checks that a reservation never ended stops counting after its timeout.
+        """
+        self.assertEqual(self.reserve(1), RESERVED)
+        self.clock.sleep(11)
+        self.assertEqual(self.reserve(2), RESERVED)
+
+    def test_replace_corrects_entries(self):
+        """
+        Checks that a reconciliation adds the missing instances and removes
+        the ones not running anymore.
+        """
+        self.ledger.record(1, 1, None)
+        self.clock.sleep(1)
+
+        changes = self.ledger.replace({1: {2: None}, 2: {1: None}}, self.clock.time())
+
+        self.assertEqual(changes, 3)
+        self.assertEqual(set(self.ledger.entries(1)), {2})
+        self.assertEqual(set(self.ledger.entries(2)), {1})
+        self.assertEqual(self.ledger.reconciled_at(), self.clock.time())
+
+    def test_replace_keeps_recent_entries(self):
+        """
+        Checks that a reconciliation keeps the entries written since it started,
+        and the reservations in progress.
+        """
+        started_at = self.clock.time()
+        self.clock.sleep(1)
+        self.ledger.record(1, 1, None)
+        self.assertEqual(self.reserve(2, source_id=2), RESERVED)
+
+        self.assertEqual(self.ledger.replace({}, started_at), 0)
+        self.assertEqual(set(self.ledger.entries(1)), {1})
+        self.assertTrue(self.ledger.entries(2)[2].pending)
+
+    def test_replace_source(self):
+        """
+        Checks that the entries of a single source can be reconciled.
+        """
+        self.ledger.record(1, 1, None)
+        self.ledger.record(1, 2, None)
+        self.clock.sleep(1)
+
+        changes = self.ledger.replace_source(1, {2: None}, self.clock.time())
+
+        self.assertEqual(changes, 2)
+        self.assertEqual(set(self.ledger.entries(1)), {2})
+        self.assertEqual(set(self.ledger.entries(2)), {1})
+
+
+class Test_U_ManaLedger(_ManaLedgerTests, PluginTestCase):
+    """
+    Test_U_ManaLedger runs the mana ledger tests with local states.
+    """
+
+
+class Test_U_ManaLedgerRedis(_ManaLedgerTests, PluginTestCase):
+    """
+    Test_U_ManaLedgerRedis runs the mana ledger tests with states in Redis.
+    """
+
+    redis = True
@@ -0,0 +1,164 @@
+"""
+This module defines the unit tests of the coalescing of concurrent calls.
+"""
+
+import json
+import threading
+
+from CTFd.plugins.ctfd_chall_manager.utils import singleflight
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
+    ChallManagerException,
+    ChallManagerUnavailableException,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.singleflight import SingleFlight
+
+from .utils import PluginTestCase
+
+LOCK_KEY = "chall-manager:singleflight:test:key"
+
+
+# pylint: disable=invalid-name,no-member
+class _SingleFlightTests:
+    """
+    _SingleFlightTests defines the tests cases of the single-flight,
+    run with local and distributed states.
+    """
+
+    modules = (singleflight,)
+
+    def setUp(self):  # pylint: disable=missing-function-docstring
+        super().setUp()
+        self.flights = SingleFlight("test")
+
+    def test_followers_share_the_leader_call(self):
+        """
+        Checks that concurrent callers of the same key share a single call,
+        and that each one gets its own copy of the result.
+        """
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return [{"challengeId": 1}]
+
+        results = {}
+
+        def run(i):
+            results[i] = self.flights.do("key", fn, ttl=5)
+
+        leader = threading.Thread(target=run, args=(0,))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=run, args=(1,))
+        follower.start()
+        while self.flights.stats()["shared"] == 0:
+            follower.join(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results[0], results[1])
+        self.assertIsNot(results[0], results[1])
+        self.assertIsNot(results[0][0], results[1][0])
+
+    def test_leader_error_is_raised(self):
+        """
+        Checks that the error of the call is raised as is to the leader.
+        """
+
+        def fn():
+            raise ChallManagerUnavailableException()
+
+        with self.assertRaises(ChallManagerUnavailableException):
+            self.flights.do("key", fn, ttl=5)
+
+
+class Test_U_SingleFlight(_SingleFlightTests, PluginTestCase):
+    """
+    Test_U_SingleFlight runs the single-flight tests with local states.
+    """
+
+
+class Test_U_SingleFlightRedis(_SingleFlightTests, PluginTestCase):
+    """
+    Test_U_SingleFlightRedis runs the single-flight tests with states in Redis,
+    and the tests of the coalescing between workers.
+    """
+
+    redis = True
+
+    def test_follower_reads_the_leader_outcome(self):
+        """
+        Checks that a worker waits for the outcome of the leader of another worker.
+        """
+        self.client.set(LOCK_KEY, "other")
+        self.client.set(f"{LOCK_KEY}:other", json.dumps({"result": [1]}))
+
+        result = self.flights.do("key", lambda: self.fail("not the leader"), ttl=5)
+        self.assertEqual(result, [1])
+
+    def test_follower_keeps_the_error_class(self):
+        """
+        Checks that a ChallManagerUnavailableException of the leader is raised
+        as such to the followers.
+        """
+        error = ChallManagerUnavailableException()
+        self.client.set(LOCK_KEY, "other")
+        self.client.set(
+            f"{LOCK_KEY}:other",
+            json.dumps({"error": error.to_dict(), "type": type(error).__name__}),
+        )
+
+        with self.assertRaises(ChallManagerUnavailableException) as ctx:
+            self.flights.do("key", lambda: self.fail("not the leader"), ttl=5)
+        self.assertEqual(ctx.exception.http_code, 503)
+
+    def test_leader_shares_its_outcome(self):
+        """
+        Checks that the leader stores its error with its class, and releases
+        the leadership.
+        """
+
+        def fn():
+            raise ChallManagerUnavailableException()
+
+        with self.assertRaises(ChallManagerUnavailableException):
+            self.flights.do("key", fn, ttl=5)
+
+        self.assertFalse(self.client.exists(LOCK_KEY))
+        keys = self.client.keys(f"{LOCK_KEY}:*")
+        self.assertEqual(len(keys), 1)
+        outcome = json.loads(self.client.get(keys[0]))
+        self.assertEqual(outcome["type"], "ChallManagerUnavailableException")
+
+    def test_leader_keeps_a_lock_it_lost(self):
+        """
+        Checks that a leader which leadership expired does not release the
+        leadership of the next one.
+        """
+
+        def fn():
+            self.client.set(LOCK_KEY, "next")
+            return 1
+
+        self.assertEqual(self.flights.do("key", fn, ttl=5), 1)
+        self.assertEqual(self.client.get(LOCK_KEY), b"next")
+
+    def test_base_error_class(self):
+        """
+        Checks that other errors are rebuilt as ChallManagerException.
+        """
+        self.client.set(LOCK_KEY, "other")
+        self.client.set(
+            f"{LOCK_KEY}:other",
+            json.dumps({"error": ChallManagerException(message="boom").to_dict()}),
+        )
+
+        with self.assertRaises(ChallManagerException) as ctx:
+            self.flights.do("key", lambda: self.fail("not the leader"), ttl=5)
+        self.assertNotIsInstance(ctx.exception, ChallManagerUnavailableException)
+        self.assertEqual(ctx.exception.message, "boom")
@@ -0,0 +1,136 @@
+"""
+This module defines the helpers of the unit tests.
+"""
+
+import pickle
+import time
+import types
+import unittest
+from unittest import mock
+
+import fakeredis
+
+
+class FakeClock:
+    """
+    FakeClock replaces the time module of a plugin module, so tests control
+    the time elapsed.
+    """
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def time(self) -> float:
+        """
+        Returns the current fake time.
+        """
+        return self.now
+
+    def monotonic(self) -> float:
+        """
+        Returns the current fake time.
+        """
+        return self.now
+
+    def sleep(self, seconds: float):
+        """
+        Moves the fake time forward instead of waiting.
+        """
+        self.now += seconds
+
+
+class FakeCache:
+    """
+    FakeCache replaces the CTFd cache, it keeps the entries in memory or on the
+    fake Redis server if client is given (as CTFd does if REDIS_URL is configured).
+    """
+
+    def __init__(self, client=None, key_prefix: str = "ctfd_"):
+        self.client = client
+        self.cache = types.SimpleNamespace(key_prefix=key_prefix if client else "")
+        self._entries = {}  # key -> (value, expires_at)
+
+    def _key(self, key: str) -> str:
+        return self.cache.key_prefix + key
+
+    def get(self, key: str):
+        """
+        Returns the value of key, or None if it is missing or expired.
+        """
+        if self.client is not None:
+            raw = self.client.get(self._key(key))
+            return pickle.loads(raw) if raw is not None else None
+
+        value, expires_at = self._entries.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return value
+
+    def set(self, key: str, value, timeout: int | None = None) -> bool:
+        """
+        Store value for key, for timeout seconds (forever if not set).
+        """
+        if self.client is not None:
+            return bool(
+                self.client.set(self._key(key), pickle.dumps(value), ex=timeout or None)
+            )
+
+        self._entries[key] = (value, time.time() + timeout if timeout else None)
+        return True
+
+    def add(self, key: str, value, timeout: int | None = None) -> bool:
+        """
+        Same as set, but only if key is not already stored.
+        """
+        if self.client is not None:
+            return bool(
+                self.client.set(
+                    self._key(key), pickle.dumps(value), ex=timeout or None, nx=True
+                )
+            )
+
+        if self.get(key) is not None:
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key: str):
+        """
+        Delete key, if present.
+        """
+        self.delete_many(key)
+
+    def delete_many(self, *keys: str):
+        """
+        Delete keys, if present.
+        """
+        for key in keys:
+            if self.client is not None:
+                self.client.delete(self._key(key))
+            else:
+                self._entries.pop(key, None)
+
+
+class PluginTestCase(unittest.TestCase):
+    """
+    PluginTestCase runs the tests of the plugin modules with process local states,
+    or with a fake Redis server if redis is True (as if REDIS_URL was configured).
+    """
+
+    redis = False
+    modules = ()
+
+    def setUp(self):
+        self.client = fakeredis.FakeRedis() if self.redis else None
+        for module in self.modules:
+            self.patch(module, "REDIS_CLIENT", self.client)
+            if hasattr(module, "lock_is_local"):
+                self.patch(module, "lock_is_local", self.client is None)
+
+    def patch(self, target, attribute: str, value):
+        """
+        Replaces the attribute of target by value until the end of the test.
+        """
+        patcher = mock.patch.object(target, attribute, value)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return value
@@ -0,0 +1,111 @@
+"""
+This module implements the invalidation bus shared by all CTFd workers.
+
+A worker publishes an event once it mutated an instance, a challenge or the plugin
+settings, the other workers receive it and drop the local states it makes stale
+(e.g. in-process caches). The publisher updates its own states directly, so events
+are never delivered to the process that published them.
+
+Events go through Redis pub/sub on the REDIS_URL connection, delivery is
+at-most-once: an event published while a worker is not connected (e.g. starting,
+or Redis unreachable) is lost for this worker. Every local state kept on top of
+the bus must therefore expire on its own (TTL), which is also the only
+invalidation if Redis is not configured.
+"""
+
+import json
+import os
+import uuid
+from dataclasses import asdict, dataclass
+
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.redis_client import (
+    ensure_listener,
+    publish,
+    subscribe,
+)
+
+logger = configure_logger(__name__)
+
+CHANNEL = "chall-manager:bus"
+
+# Events types
+INSTANCE_CREATED = "instance.created"
+INSTANCE_RENEWED = "instance.renewed"
+INSTANCE_DELETED = "instance.deleted"
+CHALLENGE_CREATED = "challenge.created"
+CHALLENGE_UPDATED = "challenge.updated"
+CHALLENGE_DELETED = "challenge.deleted"
+CONFIG_CHANGED = "config.changed"
+
+# identify this process, so it ignores its own events
+_ORIGIN = uuid.uuid4().hex
+
+
+def origin() -> str:
+    """
+    Returns the identifier of this process (forked workers get their own).
+    """
+    return f"{_ORIGIN}:{os.getpid()}"
+
+
+@dataclass(frozen=True, slots=True)
+class Event:
+    """
+    Event describes a mutation made by a worker.
+
+    Attributes:
+        type (str): The type of the event (e.g. INSTANCE_CREATED).
+        challenge_id (int): The challenge concerned, if any.
+        source_id (int): The source concerned, if any.
+    """
+
+    type: str
+    challenge_id: int | None = None
+    source_id: int | None = None
+
+
+_handlers = {}  # type -> handlers
+
+
+def on(event_type: str, handler):
+    """
+    Register handler to be called with the events of event_type published by
+    the other workers.
+    """
+    _handlers.setdefault(event_type, []).append(handler)
+
+
+def emit(event: Event) -> bool:
+    """
+    Publish event to the other workers.
+
+    :return bool: False if Redis is not configured or unreachable,
+    the other workers then rely on TTLs.
+    """
+    return publish(CHANNEL, json.dumps({"origin": origin(), **asdict(event)}))
+
+
+def listening() -> bool:
+    """
+    Returns True if this worker receives the events of the other ones,
+    starts listening if needed.
+    """
+    return ensure_listener()
+
+
+def _dispatch(data: bytes):
+    message = json.loads(data)
+    if message.pop("origin", None) == origin():
+        return
+
+    event = Event(**message)
+    logger.debug("received %s", event)
+    for handler in _handlers.get(event.type, ()):
+        try:
+            handler(event)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("error handling %s: %s", event, e)
+
+
+subscribe(CHANNEL, _dispatch)
@@ -0,0 +1,409 @@
+"""
+This module defines the HTTP client shared by every call to the Chall-Manager API.
+
+A single client is kept per process: it owns a bounded pool of keep-alive
+connections, so calls to Chall-Manager reuse TCP connections instead of opening
+a new one each time. The client is re-initialized after a fork (e.g. gunicorn
+workers) so that no socket is ever shared between processes.
+"""
+
+import contextlib
+import os
+import random
+import threading
+import time
+
+import requests
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
+    ChallManagerUnavailableException,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.circuit_breaker import breaker
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.settings import settings
+from CTFd.plugins.ctfd_chall_manager.utils.setup import load_positive_int
+from requests.adapters import HTTPAdapter
+
+logger = configure_logger(__name__)
+
+DEFAULT_POOL_MAXSIZE = 10
+
+# Operations kinds, each one has its own timeout budget
+READ = "read"  # get, query
+WRITE = "write"  # create, update, delete (may wait for an IaC deployment)
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_WRITE_TIMEOUT = 600
+
+# Responses meaning Chall-Manager (or its proxy) is not able to serve requests
+UNAVAILABLE_STATUS_CODES = (502, 503, 504)
+
+DEFAULT_RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.2  # seconds
+RETRY_MAX_DELAY = 2  # seconds
+
+
+def _backoff(attempt: int) -> float:
+    """
+    Returns the delay before the next attempt: capped exponential backoff
+    with full jitter, so retries from many workers do not synchronize.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+def _budget(timeout) -> float | None:
+    """
+    Returns the total duration (in seconds) allowed to a call by its timeout.
+    """
+    if isinstance(timeout, tuple):
+        return sum(timeout)
+    return timeout
+
+
+def _cap_timeout(timeout, remaining: float):
+    """
+    Returns timeout capped to the remaining seconds of the budget of a call,
+    None if there is not enough time left to connect.
+    """
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        if remaining <= connect:
+            return None
+        return connect, min(read, remaining - connect)
+    if remaining <= 0:
+        return None
+    return min(timeout, remaining)
+
+
+def _pool_block() -> bool:
+    """
+    Read PLUGIN_SETTINGS_CM_POOL_BLOCK, if true callers wait for a free connection
+    instead of opening a new (non kept-alive) one when the pool is saturated.
+    """
+    return os.getenv("PLUGIN_SETTINGS_CM_POOL_BLOCK", "false").lower() == "true"
+
+
+def _config_seconds(key: str, default: int) -> float:
+    """
+    Read a strictly positive duration (in seconds) from the plugin settings.
+    """
+    value = settings.get(key)
+    if value in (None, ""):
+        return default
+
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        logger.warning("invalid %s, got %s. Falling back to default.", key, value)
+        return default
+
+    if value <= 0:
+        logger.warning("invalid %s, got %s. Falling back to default.", key, value)
+        return default
+
+    return value
+
+
+def timeout_for(operation: str) -> tuple[float, float]:
+    """
+    Returns the (connect, read) timeout budget of an operation kind.
+    Values are read from the plugin settings on each call, so an update on the
+    settings page applies without restarting CTFd.
+
+    :param operation: READ or WRITE
+    :return tuple: (connect timeout, read timeout) in seconds
+    """
+    connect = _config_seconds(
+        "chall-manager_api_connect_timeout", DEFAULT_CONNECT_TIMEOUT
+    )
+    if operation == WRITE:
+        return connect, _config_seconds(
+            "chall-manager_api_timeout", DEFAULT_WRITE_TIMEOUT
+        )
+    return connect, _config_seconds(
+        "chall-manager_api_read_timeout", DEFAULT_READ_TIMEOUT
+    )
+
+
+class ChallManagerClient:  # pylint: disable=too-many-instance-attributes
+    """
+    ChallManagerClient wraps a requests.Session configured with a bounded pool
+    of keep-alive connections to Chall-Manager.
+
+    Attributes:
+        pool_maxsize (int): The maximum number of connections kept alive.
+        pool_block (bool): Whether callers wait for a free connection when saturated.
+        retry_attempts (int): The maximum number of attempts of idempotent calls.
+    """
+
+    def __init__(
+        self, pool_maxsize: int, pool_block: bool = False, retry_attempts: int = 1
+    ):
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.retry_attempts = retry_attempts
+        self.pid = os.getpid()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,  # only one host: Chall-Manager
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._counters = {
+            "requests": 0,
+            "saturated": 0,
+            "retries": 0,  # attempts after the first one
+            "retry_succeeded": 0,  # calls succeeding after at least one retry
+            "retry_exhausted": 0,  # calls failing after at least one retry
+        }
+
+    def __repr__(self):
+        return f"ChallManagerClient pid={self.pid} pool_maxsize={self.pool_maxsize}"
+
+    @staticmethod
+    def url(path: str) -> str:
+        """
+        Build the Chall-Manager URL of path, based on the plugin settings.
+        """
+        cm_api_url = settings.get("chall-manager_api_url")
+        return f"{cm_api_url}{path}"
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            self._counters[counter] += 1
+
+    def _enter(self):
+        with self._stats_lock:
+            self._counters["requests"] += 1
+            if self._in_flight >= self.pool_maxsize:
+                self._counters["saturated"] += 1
+                logger.debug(
+                    "connection pool saturated (%s in flight)", self._in_flight
+                )
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    def _exit(self):
+        with self._stats_lock:
+            self._in_flight -= 1
+
+    def _send(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request through the circuit breaker, and record its outcome.
+        """
+        if not breaker.allow():
+            logger.warning("circuit breaker is open, reject %s %s", method, path)
+            raise ChallManagerUnavailableException()
+
+        succeeded = None
+        try:
+            resp = self.session.request(method, self.url(path), **kwargs)
+            succeeded = resp.status_code not in UNAVAILABLE_STATUS_CODES
+        except requests.RequestException:
+            succeeded = False
+            raise
+        finally:
+            # always end the call, else a half-open breaker waits for its probe
+            if succeeded is None:
+                breaker.abandon()
+            elif succeeded:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+        return resp
+
+    def _send_with_retries(
+        self, method: str, path: str, idempotent: bool, **kwargs
+    ) -> requests.Response:
+        """
+        Send a request, retry it on transient failures if it is idempotent.
+        Retries stop once the attempts or the timeout budget of the call are exhausted,
+        each attempt only gets the remaining budget.
+        """
+        if not idempotent or self.retry_attempts <= 1:
+            return self._send(method, path, **kwargs)
+
+        timeout = kwargs.pop("timeout", None)
+        budget = _budget(timeout)
+        deadline = time.monotonic() + budget if budget else None
+
+        attempt = 0
+        while True:
+            error = None
+            attempt_timeout = timeout
+            if deadline is not None:
+                attempt_timeout = _cap_timeout(timeout, deadline - time.monotonic())
+            try:
+                resp = self._send(method, path, timeout=attempt_timeout, **kwargs)
+                if resp.status_code not in UNAVAILABLE_STATUS_CODES:
+                    if attempt > 0:
+                        self._count("retry_succeeded")
+                    return resp
+            except (requests.ConnectionError, requests.Timeout) as e:
+                resp = None
+                error = e
+
+            delay = _backoff(attempt)
+            attempt += 1
+            # stop if the next attempt could not even connect within the budget
+            if attempt >= self.retry_attempts or (
+                deadline is not None
+                and _cap_timeout(timeout, deadline - time.monotonic() - delay) is None
+            ):
+                if attempt > 1:
+                    self._count("retry_exhausted")
+                if error is not None:
+                    raise error
+                return resp
+
+            if resp is not None:
+                resp.close()
+            logger.info(
+                "transient failure on %s %s, retry in %.2fs (attempt %s/%s)",
+                method,
+                path,
+                delay,
+                attempt + 1,
+                self.retry_attempts,
+            )
+            self._count("retries")
+            time.sleep(delay)
+
+    def request(
+        self, method: str, path: str, idempotent: bool = False, **kwargs
+    ) -> requests.Response:
+        """
+        Perform a request on Chall-Manager and return the whole response.
+
+        :param method: HTTP method (e.g. "GET")
+        :param path: path of the API (e.g. "/api/v1/instance")
+        :param idempotent: if True, the request is retried on transient failures
+        :param **kwargs: arguments forwarded to requests (e.g. data, headers, timeout)
+        :return Response: of chall-manager API
+        :raise ChallManagerUnavailableException: if the circuit breaker is open
+        """
+        self._enter()
+        try:
+            return self._send_with_retries(method, path, idempotent, **kwargs)
+        finally:
+            self._exit()
+
+    @contextlib.contextmanager
+    def stream(self, method: str, path: str, **kwargs):
+        """
+        Perform a streamed request on Chall-Manager.
+        The connection is given back to the pool once the context is closed.
+        The request is considered idempotent, so it is retried on transient failures
+        until the body starts to be read.
+
+        :param method: HTTP method (e.g. "GET")
+        :param path: path of the API (e.g. "/api/v1/challenge")
+        :param **kwargs: arguments forwarded to requests (e.g. timeout)
+        :yield Response: of chall-manager API, with a body not yet consumed
+        :raise ChallManagerUnavailableException: if the circuit breaker is open
+        """
+        self._enter()
+        try:
+            with self._send_with_retries(
+                method, path, True, stream=True, **kwargs
+            ) as resp:
+                yield resp
+        finally:
+            self._exit()
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """
+        Perform a GET request on Chall-Manager, retried on transient failures.
+        """
+        return self.request("GET", path, idempotent=True, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        """
+        Perform a POST request on Chall-Manager.
+        It is never retried, as Chall-Manager creations are not idempotent.
+        """
+        return self.request("POST", path, **kwargs)
+
+    def patch(self, path: str, idempotent: bool = False, **kwargs) -> requests.Response:
+        """
+        Perform a PATCH request on Chall-Manager.
+        """
+        return self.request("PATCH", path, idempotent=idempotent, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        """
+        Perform a DELETE request on Chall-Manager.
+        """
+        return self.request("DELETE", path, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Returns the usage statistics of the connection pool and retries.
+        A request is counted as saturated if it started while all
+        kept-alive connections were already in use.
+        """
+        with self._stats_lock:
+            return {
+                "pid": self.pid,
+                "pool_maxsize": self.pool_maxsize,
+                "pool_block": self.pool_block,
+                "retry_attempts": self.retry_attempts,
+                "in_flight": self._in_flight,
+                "peak_in_flight": self._peak_in_flight,
+                **self._counters,
+            }
+
+    def close(self):
+        """
+        Close all connections of the pool.
+        """
+        self.session.close()
+
+
+_client = None  # pylint: disable=invalid-name
+_client_lock = threading.Lock()
+
+
+def get_client() -> ChallManagerClient:
+    """
+    Returns the process-wide Chall-Manager client, creates it if necessary.
+    """
+    global _client  # pylint: disable=global-statement
+
+    client = _client
+    if client is not None and client.pid == os.getpid():
+        return client
+
+    with _client_lock:
+        if _client is None or _client.pid != os.getpid():
+            _client = ChallManagerClient(
+                load_positive_int(
+                    "PLUGIN_SETTINGS_CM_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE
+                ),
+                _pool_block(),
+                load_positive_int(
+                    "PLUGIN_SETTINGS_CM_RETRY_ATTEMPTS", DEFAULT_RETRY_ATTEMPTS
+                ),
+            )
+            logger.info("chall-manager client configured: %s", _client)
+        return _client
+
+
+def _reset_after_fork():
+    """
+    Drop the client inherited from the parent process, without closing
+    its sockets as they are still used by the parent.
+    """
+    global _client, _client_lock  # pylint: disable=global-statement
+    _client = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
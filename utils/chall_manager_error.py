@@ -32,13 +32,33 @@ class ChallManagerException(Exception):
             http_code={self.http_code}, \
             message='{self.message}'{details_str})"
 
+    def to_dict(self) -> dict:
+        """
+        Returns the exception fields, so it can be rebuilt with ChallManagerException(**d).
+        """
+        return {
+            "code": self.code,
+            "message": self.message,
+            "details": self.details,
+            "http_code": self.http_code,
+        }
+
 
 def chall_manager_exception_builder(resp: requests.Response) -> ChallManagerException:
     """
     Helper function to create internal exception based on Chall-Manager API response
     """
 
-    cm_error = json.loads(resp.text)
+    try:
+        cm_error = json.loads(resp.text)
+    except json.JSONDecodeError:
+        # the error did not come from Chall-Manager (e.g. reverse proxy)
+        logger.warning("unexpected error response: %s %s", resp.status_code, resp.text)
+        return ChallManagerException(
+            message=resp.reason or "An error occurred",
+            http_code=resp.status_code,
+        )
+
     cm_exception = ChallManagerException(
         code=cm_error["code"],
         message=cm_error["message"],
@@ -49,7 +69,33 @@ def chall_manager_exception_builder(resp: requests.Response) -> ChallManagerExce
     return cm_exception
 
 
+class ChallManagerUnavailableException(ChallManagerException):
+    """
+    This class handles calls rejected without reaching Chall-Manager API,
+    as it is considered unavailable (i.e. circuit breaker is open).
+    """
+
+    def __init__(self, message="Chall-Manager is unavailable, retry later"):
+        super().__init__(code=14, message=message, http_code=503)
+
+
 class ChallManagerPluginException(Exception):
     """
     Internal plugin exception
     """
+
+
+def chall_manager_exception_from_dict(
+    d: dict, kind: str = "ChallManagerException"
+) -> ChallManagerException:
+    """
+    Rebuilds an exception from its fields (see ChallManagerException.to_dict),
+    as the class named kind, so e.g. ChallManagerUnavailableException is kept.
+    """
+    classes = {
+        c.__name__: c for c in (ChallManagerException, ChallManagerUnavailableException)
+    }
+    cls = classes.get(kind, ChallManagerException)
+    e = cls.__new__(cls)
+    ChallManagerException.__init__(e, **d)
+    return e
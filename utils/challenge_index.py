@@ -0,0 +1,203 @@
+"""
+This module keeps an in-memory index of the dynamic_iac challenges.
+
+The few attributes needed on the instances hot paths (shared, mana_cost,
+timeout...) of every challenge are loaded at once by a single query,
+then read from memory. The index is invalidated once a challenge creation,
+update or deletion is committed, and the other workers are notified through the
+invalidation bus. If the bus is not available, the index is reloaded after a
+short delay so that the other workers eventually see the changes.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from CTFd.models import db
+from CTFd.plugins.ctfd_chall_manager.utils.bus import (
+    CHALLENGE_CREATED,
+    CHALLENGE_DELETED,
+    CHALLENGE_UPDATED,
+    Event,
+    emit,
+    listening,
+    on,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+logger = configure_logger(__name__)
+
+# Maximum age of the index, bounds the staleness if an invalidation is missed
+LOCAL_MAX_AGE = 10  # seconds, changes from other workers are not notified
+SUBSCRIBED_MAX_AGE = 300  # seconds, changes are notified through the bus
+
+SESSION_KEY = "chall-manager:challenges"
+
+
+@dataclass(frozen=True, slots=True)
+class ChallengeInfo:  # pylint: disable=too-many-instance-attributes
+    """
+    ChallengeInfo holds the attributes of a challenge used on the hot paths.
+    """
+
+    id: int
+    name: str
+    category: str
+    state: str
+    mana_cost: int
+    shared: bool
+    timeout: int | None
+    cache_ttl: int | None
+
+    def is_visible(self) -> bool:
+        """
+        Returns True if the challenge is visible by players.
+        """
+        return self.state not in ("hidden", "locked")
+
+
+class ChallengeIndex:
+    """
+    A class used to read the challenges attributes from memory.
+    """
+
+    def __init__(self):
+        self._model = None
+        self._lock = threading.Lock()
+        self._records = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._pid = None
+        self._listening = False
+
+    def __repr__(self):
+        return f"ChallengeIndex model={self._model}"
+
+    def track(self, model):
+        """
+        Index the challenges of model, and invalidate the index
+        once a creation, an update or a deletion is committed.
+        Bulk deletions (Query.delete) are not seen, they must call notify.
+        """
+        self._model = model
+        event.listen(model, "after_insert", _on_change(CHALLENGE_CREATED))
+        event.listen(model, "after_update", _on_change(CHALLENGE_UPDATED))
+        event.listen(model, "after_delete", _on_change(CHALLENGE_DELETED))
+
+    def _index(self) -> dict[int, ChallengeInfo]:
+        # the index is kept longer if invalidations from other workers
+        # have been received since it was loaded
+        subscribed = listening()
+        max_age = (
+            SUBSCRIBED_MAX_AGE if self._listening and subscribed else LOCAL_MAX_AGE
+        )
+
+        records = self._records
+        if (
+            records is not None
+            and self._pid == os.getpid()
+            and time.monotonic() - self._loaded_at < max_age
+        ):
+            return records
+
+        with self._lock:
+            self._pid = os.getpid()
+            self._listening = subscribed
+            generation = self._generation
+
+            model = self._model
+            rows = db.session.execute(
+                select(
+                    model.id,
+                    model.name,
+                    model.category,
+                    model.state,
+                    model.mana_cost,
+                    model.shared,
+                    model.timeout,
+                    model.cache_ttl,
+                )
+            ).all()
+            records = {
+                row.id: ChallengeInfo(
+                    row.id,
+                    row.name,
+                    row.category,
+                    row.state,
+                    row.mana_cost or 0,
+                    bool(row.shared),
+                    row.timeout,
+                    row.cache_ttl,
+                )
+                for row in rows
+            }
+
+            # do not keep the index if it was invalidated while loading
+            if generation == self._generation:
+                self._records = records
+                self._loaded_at = time.monotonic()
+            logger.debug("indexed %s challenges", len(records))
+
+        return records
+
+    def get(self, challenge_id: int) -> ChallengeInfo | None:
+        """
+        Returns the attributes of challenge_id, None if it does not exist.
+        """
+        return self._index().get(int(challenge_id))
+
+    def all(self) -> dict[int, ChallengeInfo]:
+        """
+        Returns the attributes of all challenges, by id.
+        """
+        return self._index()
+
+    def invalidate(self):
+        """
+        Drop the index of this worker, the next read reloads it.
+        """
+        with self._lock:
+            self._generation += 1
+            self._records = None
+        logger.debug("challenges index invalidated")
+
+    def notify(self, event_type: str, challenge_id: int):
+        """
+        Invalidate the index of this worker, and notify the other ones.
+        Must be called once the change is committed.
+        """
+        self.invalidate()
+        emit(Event(event_type, challenge_id=challenge_id))
+
+
+challenge_index = ChallengeIndex()
+
+
+def _on_change(event_type: str):
+    def _mark(_mapper, _connection, target):
+        # notified on commit, so that no worker reloads the previous values
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault(SESSION_KEY, []).append((event_type, target.id))
+
+    return _mark
+
+
+@event.listens_for(Session, "after_commit")
+def _on_commit(session):
+    for event_type, challenge_id in session.info.pop(SESSION_KEY, ()):
+        challenge_index.notify(event_type, challenge_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _on_rollback(session):
+    # the index may have been loaded with the changes flushed meanwhile
+    if session.info.pop(SESSION_KEY, None):
+        challenge_index.invalidate()
+
+
+for _event_type in (CHALLENGE_CREATED, CHALLENGE_UPDATED, CHALLENGE_DELETED):
+    on(_event_type, lambda _: challenge_index.invalidate())
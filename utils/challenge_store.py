@@ -3,17 +3,23 @@ This module contains all functions to use Chall-Manager ChallengeStore group.
 """
 
 import json
+from collections.abc import Iterator
 
 import requests
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_client import (
+    READ,
+    WRITE,
+    get_client,
+    timeout_for,
+)
 from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
     ChallManagerException,
     chall_manager_exception_builder,
 )
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
-from CTFd.utils import get_config
+from CTFd.plugins.ctfd_chall_manager.utils.records import ChallengeRecord, loads
 
 logger = configure_logger(__name__)
-CM_API_TIMEOUT = get_config("chall-manager:chall-manager_api_timeout")
 # pylint: disable=duplicate-code
 # pylint detect duplicate-code between challenge_store and intance_manager
 # This is false positive
@@ -25,26 +31,49 @@ def query_challenges() -> list | ChallManagerException:
 
     :return list: list of challenges [{ . }, { . }]
     """
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/challenge"
-    s = requests.Session()
-    result = []
+    result = list(iter_challenges())
+    logger.debug("successfully queried %s challenges", len(result))
+
+    return result
+
+
+def iter_challenges() -> Iterator[dict]:
+    """
+    Query all challenges information and their instances running,
+    yield challenges as soon as they are received from chall-manager.
+    The connection is kept until the iteration is over, so prefer
+    consuming it without interruption.
+
+    :yield dict: challenge { . }
+    :raise ChallManagerException:
+    """
+    url = "/api/v1/challenge"
 
     logger.debug("querying challenges from %s", url)
 
     try:
-        with s.get(url, headers=None, stream=True, timeout=CM_API_TIMEOUT) as resp:
+        with get_client().stream("GET", url, timeout=timeout_for(READ)) as resp:
             for line in resp.iter_lines():
                 if line:
-                    res = line.decode("utf-8")
-                    res = json.loads(res)
-                    result.append(res["result"])
-        logger.debug("successfully queried challenges: %s", result)
+                    res = loads(line)
+                    yield res["result"]
+    except ChallManagerException:
+        raise
     except Exception as e:
         logger.error("error querying challenges: %s", e)
         raise ChallManagerException(message="error querying challenges") from e
 
-    return result
+
+def iter_challenge_records() -> Iterator[ChallengeRecord]:
+    """
+    Same as iter_challenges, but yield compact records only holding
+    the fields used by the plugin.
+
+    :yield ChallengeRecord: challenge
+    :raise ChallManagerException:
+    """
+    for challenge in iter_challenges():
+        yield ChallengeRecord.from_json(challenge)
 
 
 def create_challenge(
@@ -59,8 +88,7 @@ def create_challenge(
 
     :return Response: of chall-manager API
     """
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/challenge"
+    url = "/api/v1/challenge"
     headers = {"Content-Type": "application/json"}
     payload = kwargs
 
@@ -69,8 +97,8 @@ def create_challenge(
     payload["id"] = str(challenge_id)
 
     try:
-        r = requests.post(
-            url, data=json.dumps(payload), headers=headers, timeout=CM_API_TIMEOUT
+        r = get_client().post(
+            url, data=json.dumps(payload), headers=headers, timeout=timeout_for(WRITE)
         )
         logger.debug("received response: %s %s", r.status_code, r.text)
         r.raise_for_status()
@@ -91,13 +119,12 @@ def delete_challenge(challenge_id: int) -> requests.Response | ChallManagerExcep
 
     :return Response: of chall-manager API
     """
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/challenge/{challenge_id}"
+    url = f"/api/v1/challenge/{challenge_id}"
 
     logger.debug("deleting challenge with id=%s", challenge_id)
 
     try:
-        r = requests.delete(url, timeout=CM_API_TIMEOUT)
+        r = get_client().delete(url, timeout=timeout_for(WRITE))
         logger.debug("received response: %s %s", r.status_code, r.text)
         r.raise_for_status()
     except requests.HTTPError as e:
@@ -116,13 +143,12 @@ def get_challenge(challenge_id: int) -> requests.Response | ChallManagerExceptio
     :param challenge_id* (int): 1
     :return Response: of chall-manager API
     """
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/challenge/{challenge_id}"
+    url = f"/api/v1/challenge/{challenge_id}"
 
     logger.debug("getting challenge information for id=%s", challenge_id)
 
     try:
-        r = requests.get(url, timeout=CM_API_TIMEOUT)
+        r = get_client().get(url, timeout=timeout_for(READ))
         logger.debug("recieved response: %s %s", r.status_code, r.text)
         r.raise_for_status()
     except requests.HTTPError as e:
@@ -145,8 +171,7 @@ def update_challenge(
     (e.g {'timeout': '600s', 'updateStrategy': 'update_in_place', 'until': '2024-07-10 15:00:00' })
     :return Response: of chall-manager API
     """
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/challenge/{challenge_id}"
+    url = f"/api/v1/challenge/{challenge_id}"
     headers = {"Content-Type": "application/json"}
     payload = kwargs
 
@@ -163,8 +188,8 @@ def update_challenge(
     )
 
     try:
-        r = requests.patch(
-            url, data=json.dumps(payload), headers=headers, timeout=CM_API_TIMEOUT
+        r = get_client().patch(
+            url, data=json.dumps(payload), headers=headers, timeout=timeout_for(WRITE)
         )
         logger.debug("received response: %s %s", r.status_code, r.text)
         r.raise_for_status()
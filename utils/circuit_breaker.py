@@ -0,0 +1,219 @@
+"""
+This module implements the circuit breaker placed in front of the Chall-Manager API.
+
+When Chall-Manager fails too many times in a row, the breaker opens and calls are
+rejected without waiting for a timeout. After a recovery delay, a single call is
+let through (half-open): if it succeeds the breaker closes, else it opens again.
+If Redis is configured, the state is shared by all CTFd workers.
+"""
+
+import threading
+import time
+
+import redis
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.redis_client import REDIS_CLIENT
+from CTFd.plugins.ctfd_chall_manager.utils.setup import load_positive_int
+
+logger = configure_logger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RECOVERY_TIMEOUT = 30  # seconds
+
+# Close the breaker (KEYS[1]) and end the probe (KEYS[2]), only if the breaker is
+# not already closed without failures, so a successful call usually writes nothing
+_SUCCESS_LUA = """
+local values = redis.call('HMGET', KEYS[1], 'state', 'failures')
+local state, failures = values[1], values[2]
+if (not state or state == 'closed') and (not failures or failures == '0') then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'state', 'closed', 'failures', 0)
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+
+class CircuitBreaker:  # pylint: disable=too-many-instance-attributes
+    """
+    A class used to stop calling Chall-Manager while it is failing.
+
+    Attributes:
+        name (str): The name of the breaker.
+        failure_threshold (int): Consecutive failures before opening.
+        recovery_timeout (int): Seconds to wait before letting a probe call through.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: int):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        # local state, used if Redis is not configured
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._prober = None  # thread sending the half-open probe
+
+        # distributed state
+        self._key = f"chall-manager:breaker:{name}"
+        self._probe_key = f"{self._key}:probe"
+
+    def __repr__(self):
+        return f"CircuitBreaker name={self.name} state={self.state()}"
+
+    def allow(self) -> bool:
+        """
+        Returns True if a call can be sent to Chall-Manager, otherwise False.
+        """
+        if REDIS_CLIENT is not None:
+            try:
+                return self._allow_redis()
+            except redis.RedisError as e:
+                logger.warning("cannot read circuit breaker state, got %s", e)
+                return True
+
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.time() - self._opened_at < self.recovery_timeout:
+                    return False
+                logger.info("circuit breaker %s is half-open", self.name)
+                self._state = HALF_OPEN
+                self._probing = False
+            # half-open: only one probe call at a time
+            if self._probing:
+                return False
+            self._probing = True
+            self._prober = threading.get_ident()
+            return True
+
+    def _allow_redis(self) -> bool:
+        state, opened_at = REDIS_CLIENT.hmget(self._key, "state", "opened_at")
+        if state is None or state.decode() == CLOSED:
+            return True
+        if time.time() - float(opened_at or 0) < self.recovery_timeout:
+            return False
+
+        # half-open: only one worker sends the probe call
+        probing = REDIS_CLIENT.set(
+            self._probe_key, 1, nx=True, ex=self.recovery_timeout
+        )
+        if probing:
+            logger.info("circuit breaker %s is half-open", self.name)
+        return bool(probing)
+
+    def record_success(self):
+        """
+        Records a successful call, closes the breaker.
+        """
+        if REDIS_CLIENT is not None:
+            try:
+                if REDIS_CLIENT.eval(_SUCCESS_LUA, 2, self._key, self._probe_key):
+                    logger.info("circuit breaker %s is closed", self.name)
+            except redis.RedisError as e:
+                logger.warning("cannot write circuit breaker state, got %s", e)
+            return
+
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("circuit breaker %s is closed", self.name)
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """
+        Records a failed call, opens the breaker if the threshold is reached
+        or if the failed call was the half-open probe.
+        """
+        if REDIS_CLIENT is not None:
+            try:
+                self._record_failure_redis()
+            except redis.RedisError as e:
+                logger.warning("cannot write circuit breaker state, got %s", e)
+            return
+
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    logger.warning(
+                        "circuit breaker %s is open after %s failures",
+                        self.name,
+                        self._failures,
+                    )
+                self._state = OPEN
+                self._opened_at = time.time()
+                self._probing = False
+
+    def abandon(self):
+        """
+        Ends a call which outcome is unknown (e.g. an unexpected error), so that
+        the half-open breaker lets another probe through if it was the probe.
+        Distributed probes are released on their own after recovery_timeout.
+        """
+        if REDIS_CLIENT is not None:
+            return
+
+        with self._lock:
+            if self._probing and self._prober == threading.get_ident():
+                self._probing = False
+
+    def _record_failure_redis(self):
+        failures = REDIS_CLIENT.hincrby(self._key, "failures", 1)
+        state = REDIS_CLIENT.hget(self._key, "state")
+        if (state is not None and state.decode() != CLOSED) or (
+            failures >= self.failure_threshold
+        ):
+            if state is None or state.decode() == CLOSED:
+                logger.warning(
+                    "circuit breaker %s is open after %s failures",
+                    self.name,
+                    failures,
+                )
+            pipe = REDIS_CLIENT.pipeline()
+            pipe.hset(self._key, mapping={"state": OPEN, "opened_at": time.time()})
+            pipe.delete(self._probe_key)
+            pipe.execute()
+
+    def state(self) -> str:
+        """
+        Returns the current state of the breaker: closed, open or half-open.
+        """
+        if REDIS_CLIENT is not None:
+            try:
+                state, opened_at = REDIS_CLIENT.hmget(self._key, "state", "opened_at")
+            except redis.RedisError:
+                return "unknown"
+            if state is None or state.decode() == CLOSED:
+                return CLOSED
+            if time.time() - float(opened_at or 0) < self.recovery_timeout:
+                return OPEN
+            return HALF_OPEN
+
+        with self._lock:
+            if (
+                self._state == OPEN
+                and time.time() - self._opened_at >= self.recovery_timeout
+            ):
+                return HALF_OPEN
+            return self._state
+
+
+breaker = CircuitBreaker(
+    "chall-manager",
+    failure_threshold=load_positive_int(
+        "PLUGIN_SETTINGS_CM_BREAKER_THRESHOLD", DEFAULT_FAILURE_THRESHOLD
+    ),
+    recovery_timeout=load_positive_int(
+        "PLUGIN_SETTINGS_CM_BREAKER_RECOVERY", DEFAULT_RECOVERY_TIMEOUT
+    ),
+)
@@ -4,11 +4,14 @@ This module defines decorators used by API endpoints.
 
 import functools
 
-from CTFd.models import Challenges
+from CTFd.plugins.ctfd_chall_manager.utils.challenge_index import challenge_index
+from CTFd.plugins.ctfd_chall_manager.utils.helpers import (
+    load_challenge,
+    load_challenge_state,
+)
 from CTFd.utils.user import is_admin
 from flask import request
 from flask_restx import abort
-from sqlalchemy.sql import and_
 
 
 def challenge_visible(func):
@@ -30,15 +33,23 @@ def challenge_visible(func):
         if not challenge_id:
             abort(400, "missing args", success=False)
 
+        try:
+            state = load_challenge_state(challenge_id)
+        except (TypeError, ValueError):
+            abort(400, "invalid args", success=False)
+
         if is_admin():
-            if not Challenges.query.filter(Challenges.id == challenge_id).first():
+            if state is None:
                 abort(404, "no such challenge", success=False)
         else:
-            if not Challenges.query.filter(
-                Challenges.id == challenge_id,
-                and_(Challenges.state != "hidden", Challenges.state != "locked"),
-            ).first():
+            if state is None or state in ("hidden", "locked"):
                 abort(403, "challenge not visible", success=False)
+
+        # the challenge may have been created after the index of this worker
+        if load_challenge(challenge_id) is None:
+            challenge_index.invalidate()
+            if load_challenge(challenge_id) is None:
+                abort(404, "no such challenge", success=False)
         return func(*args, **kwargs)
 
     return _challenge_visible
@@ -3,85 +3,265 @@
 This module defines the helpers functions.
 """
 
+import threading
+import time
+
 import requests
-from CTFd.models import db  # type: ignore
-from CTFd.plugins.ctfd_chall_manager.models import DynamicIaCChallenge
+from CTFd.cache import cache
+from CTFd.models import Challenges, db
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_client import (
+    READ,
+    WRITE,
+    get_client,
+    timeout_for,
+)
 from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
     ChallManagerException,
 )
-from CTFd.plugins.ctfd_chall_manager.utils.challenge_store import query_challenges
-from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import query_instance
+from CTFd.plugins.ctfd_chall_manager.utils.challenge_index import (
+    ChallengeInfo,
+    challenge_index,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.challenge_store import (
+    iter_challenge_records,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.instance_cache import LocalCache
+from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import (
+    expires_at,
+    iter_instance_records,
+)
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
-from CTFd.utils import get_config
-from sqlalchemy import func
+from CTFd.plugins.ctfd_chall_manager.utils.mana_ledger import (
+    REFUSED,
+    RESERVED,
+    mana_ledger,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.settings import settings
+from CTFd.plugins.ctfd_chall_manager.utils.singleflight import SingleFlight
+from flask import current_app, g
+from sqlalchemy import select
 
 logger = configure_logger(__name__)
 
+# Coalesce concurrent reconciliations of the mana ledger
+mana_flights = SingleFlight("mana")
 
-def calculate_mana_used(source_id: int) -> int | ChallManagerException:
+# Sources reconciled recently by this worker, if the mana ledger is not shared
+SOURCE_RECONCILE_INTERVAL = 10  # seconds
+reconciled_sources = LocalCache(maxsize=4096, ttl=SOURCE_RECONCILE_INTERVAL)
+
+# Mana of all sources, displayed on the admin mana page
+ALL_MANA_CACHE_KEY = "chall-manager:all-mana"
+ALL_MANA_CACHE_TIMEOUT = 10  # seconds
+
+
+def load_challenge_state(challenge_id: int) -> str | None:
     """
-    Calculate the mana used by source_id based on existing instances on Chall-Manager.
-    return: mana_used (int)
+    Load the state of the challenge challenge_id once per request, then reuse
+    it for the visibility checks of the request. It is read from the database
+    so that a challenge hidden by an admin is not served from a stale index.
+
+    :param challenge_id: id of the challenge (e.g 1)
+    :return str: the state of the challenge, None if it does not exist
     """
+    states = g.setdefault("chall_manager_states", {})
+    challenge_id = int(challenge_id)
+    if challenge_id not in states:
+        states[challenge_id] = db.session.execute(
+            select(Challenges.state).where(
+                Challenges.id == challenge_id, Challenges.type == "dynamic_iac"
+            )
+        ).scalar()
+    return states[challenge_id]
+
+
+def load_challenge(challenge_id: int) -> ChallengeInfo | None:
+    """
+    Returns the attributes of the challenge challenge_id used by the checks
+    (shared, mana_cost, timeout), from the challenges index.
+
+    :param challenge_id: id of the challenge (e.g 1)
+    :return ChallengeInfo: the challenge, None if it does not exist
+    """
+    return challenge_index.get(challenge_id)
 
-    # retrieve all challenge_ids for source_id of running instances
+
+def reconcile_mana_ledger() -> int | ChallManagerException:
+    """
+    Replace the mana ledger by the instances running on Chall-Manager.
+    return: number of entries corrected (int)
+    raise: ChallManagerException
+    """
+    started_at = time.time()
+
+    # challenges are streamed, so only the ledger entries are kept in memory
+    snapshot = {}
     try:
-        instances = query_instance(source_id)
+        for challenge in iter_challenge_records():
+            for instance in challenge.instances:
+                snapshot.setdefault(int(instance.source_id), {})[
+                    int(instance.challenge_id)
+                ] = expires_at(instance.until)
     except ChallManagerException as e:
         raise e
 
-    chall_ids = []
-    for i in instances:
-        chall_ids.append(i["challengeId"])
+    logger.debug("reconcile mana ledger with %s sources", len(snapshot))
+    return mana_ledger.replace(snapshot, started_at)
+
+
+def reconcile_source_mana(source_id: int) -> int | ChallManagerException:
+    """
+    Replace the entries of source_id in the mana ledger by its instances running
+    on Chall-Manager, e.g. created by another worker which ledger is not shared.
+    return: number of entries corrected (int)
+    raise: ChallManagerException
+    """
+    started_at = time.time()
+    instances = {
+        int(instance.challenge_id): expires_at(instance.until)
+        for instance in iter_instance_records(source_id)
+    }
+    return mana_ledger.replace_source(source_id, instances, started_at)
+
+
+def _reconcile_in_background(app):
+    with app.app_context():
+        try:
+            reconcile_mana_ledger()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("error while reconciling mana ledger: %s", e)
+        finally:
+            mana_ledger.release_reconcile()
+
+
+def ensure_mana_ledger_reconciled():
+    """
+    Reconcile the mana ledger if it was never reconciled (e.g. first start),
+    else start a reconciliation in background every reconcile_interval.
+    raise: ChallManagerException
+    """
+    reconciled_at = mana_ledger.reconciled_at()
+    if reconciled_at is None:
+        # the ledger cannot be trusted yet, concurrent callers wait for a single call
+        mana_flights.do(
+            "reconcile", reconcile_mana_ledger, ttl=mana_ledger.reconcile_interval
+        )
+        return
+
+    if (
+        time.time() - reconciled_at >= mana_ledger.reconcile_interval
+        and mana_ledger.claim_reconcile()
+    ):
+        logger.debug("start mana ledger reconciliation")
+        app = current_app._get_current_object()  # pylint: disable=protected-access
+        threading.Thread(
+            target=_reconcile_in_background, args=(app,), daemon=True
+        ).start()
+
+
+def ensure_source_mana_reconciled(source_id: int):
+    """
+    Reconcile the entries of source_id if the mana ledger is not shared, so that
+    the instances created by the other workers are counted. A source is
+    reconciled at most every SOURCE_RECONCILE_INTERVAL seconds by a worker.
+    If Chall-Manager cannot be reached, the ledger of this worker is kept.
+    """
+    if mana_ledger.is_shared() or reconciled_sources.get(str(source_id)):
+        return
+
+    try:
+        mana_flights.do(
+            f"reconcile:{source_id}",
+            lambda: reconcile_source_mana(source_id),
+            ttl=sum(timeout_for(READ)),
+        )
+    except ChallManagerException as e:
+        logger.warning("cannot reconcile mana of source_id %s: %s", source_id, e)
+        return
+    reconciled_sources.set(str(source_id), True)
+
+
+def calculate_mana_usage(source_id: int) -> dict | ChallManagerException:
+    """
+    Calculate the mana used by source_id based on its instances in the mana ledger.
+    Expired instances are not counted, even if Chall-Manager did not delete them yet.
+    The ledger is read without waiting for the creations in progress, their mana is
+    reserved so it is counted in used, and also reported as pending.
+    return: {"used": mana_used (int), "pending": mana_reserved (int)}
+    raise: ChallManagerException
+    """
+    ensure_mana_ledger_reconciled()
+    ensure_source_mana_reconciled(source_id)
+
+    entries = mana_ledger.entries(source_id)
+    now = time.time()
+    live = {
+        challenge_id: entry
+        for challenge_id, entry in entries.items()
+        if entry.is_live(now)
+    }
 
     logger.debug(
         "source_id %s has %s instances for challenges %s",
         source_id,
-        len(chall_ids),
-        chall_ids,
+        len(live),
+        list(live),
     )
 
-    # SQL command to SUM all mana_cost of all challenges_ids from Chall-Manager
-    mana_used = (
-        db.session.query(func.sum(DynamicIaCChallenge.mana_cost).label("mana"))
-        .filter(DynamicIaCChallenge.id.in_(chall_ids))
-        .scalar()
-    )
+    # SUM all mana_cost of all challenges_ids of the ledger
+    challenges = challenge_index.all()
+    usage = {"used": 0, "pending": 0}
+    for chall_id, entry in live.items():
+        if chall_id not in challenges:
+            continue
+        usage["used"] += challenges[chall_id].mana_cost
+        if entry.pending:
+            usage["pending"] += challenges[chall_id].mana_cost
+
+    logger.debug("mana usage for source_id %s is %s", source_id, usage)
 
-    logger.debug("mana_used for source_id %s is %s", source_id, mana_used)
+    return usage
 
-    if mana_used is None:
-        return 0
 
-    return int(mana_used)
+def calculate_mana_used(source_id: int) -> int | ChallManagerException:
+    """
+    Calculate the mana used by source_id, including the creations in progress.
+    return: mana_used (int)
+    raise: ChallManagerException
+    """
+    return calculate_mana_usage(source_id)["used"]
 
 
 def calculate_all_mana_used() -> dict | ChallManagerException:
     """
     Retrieve all instances for all source_id, then calculate the amound of mana used.
+    Instances are counted in a single pass over the challenges of Chall-Manager,
+    the result is cached for ALL_MANA_CACHE_TIMEOUT seconds.
     return: {"source_id": "mana_used"}
     raise: ChallManagerException
     """
+    cached = cache.get(ALL_MANA_CACHE_KEY)
+    if cached is not None:
+        logger.debug("use cache informations for mana of all sources")
+        return cached
+
+    # mana_cost of all challenges, loaded at once
+    challenges = challenge_index.all()
 
-    # find all source_id with running instances
+    # challenges are streamed, so only the mana of each source_id is kept in memory
     source_ids = {}
-    instances = []
     try:
-        challenges = query_challenges()
+        for challenge in iter_challenge_records():
+            chall_id = int(challenge.id)
+            mana_cost = challenges[chall_id].mana_cost if chall_id in challenges else 0
+            for instance in challenge.instances:
+                source_ids[instance.source_id] = (
+                    source_ids.get(instance.source_id, 0) + mana_cost
+                )
     except ChallManagerException as e:
         raise e
 
-    for item in challenges:
-        instances = instances + list(item["instances"])
-
-    for item in instances:
-        source_id = item["sourceId"]
-
-        # calculate the mana_used for this source_id
-        # dict prevent calculate multiple times the same source_id
-        if source_id not in source_ids:
-            source_ids[source_id] = calculate_mana_used(source_id)
-
+    cache.set(ALL_MANA_CACHE_KEY, source_ids, timeout=ALL_MANA_CACHE_TIMEOUT)
     return source_ids
 
 
@@ -92,7 +272,7 @@ def check_source_can_edit_instance(challenge_id: int, source_id: int) -> bool:
     Default: True
     """
 
-    challenge = DynamicIaCChallenge.query.filter_by(id=challenge_id).first()
+    challenge = load_challenge(challenge_id)
     # if instance must be shared (admins only can deploy it)
     if challenge.shared:
         logger.warning(
@@ -105,58 +285,87 @@ def check_source_can_edit_instance(challenge_id: int, source_id: int) -> bool:
     return True
 
 
-def check_source_can_create_instance(challenge_id: int, source_id: int) -> bool:
+def reserve_instance_mana(challenge_id: int, source_id: int) -> str:
     """
-    Checks that source_id can create instance of challenge_id.
+    Checks that source_id can create instance of challenge_id, and reserve its mana.
     - need challenge to be editable (non-shared).
-    - source_id can afford the instance (mana)
+    - source_id can afford the instance (mana), considering the creations in progress
+    The reservation ends once the instance is created (create_instance) or
+    with cancel_mana_reservation, else it expires after the creation timeout.
+    return: RESERVED, EXISTS (already counted), IN_PROGRESS or REFUSED
     """
     if not check_source_can_edit_instance(challenge_id, source_id):
-        return False
+        return REFUSED
 
-    challenge = DynamicIaCChallenge.query.filter_by(id=challenge_id).first()
+    cm_mana_total = settings.get_int("chall-manager_mana_total")
+    challenges = challenge_index.all()
 
-    # if mana feature is not enabled
-    cm_mana_total = get_config("chall-manager:chall-manager_mana_total")
-    if cm_mana_total <= 0:
-        logger.debug(
-            "source_id %s can edit an instance of challenge_id %s, reason: mana not enabled",
-            source_id,
-            challenge_id,
-        )
-        return True
+    def mana_cost(chall_id: int) -> int:
+        return challenges[chall_id].mana_cost if chall_id in challenges else 0
 
-    # if instance do not define a mana_cost (free)
-    if challenge.mana_cost == 0:
-        logger.debug(
-            "source_id %s can edit an instance of challenge_id %s, reason: challenge is free",
-            source_id,
-            challenge_id,
-        )
-        return True
+    # if mana feature is not enabled, or the instance is free, the reservation
+    # only detects creations in progress, without reaching Chall-Manager
+    charged = cm_mana_total > 0 and mana_cost(challenge_id) > 0
 
     try:
-        mana_used = calculate_mana_used(source_id)
-    except ChallManagerException:
-        return False  # block create if CM generate an error
-
-    new_mana = mana_used + challenge.mana_cost
-    # if source can afford it
-    if new_mana <= cm_mana_total:
-        logger.debug(
-            "source_id %s can create an instance of challenge_id %s, reason: source can afford it",
-            source_id,
+        if charged and mana_ledger.is_shared():
+            ensure_mana_ledger_reconciled()
+        elif charged:
+            # the ledger of this worker misses the instances of the others
+            reconcile_source_mana(source_id)
+            reconciled_sources.set(str(source_id), True)
+        outcome = mana_ledger.reserve(
             challenge_id,
+            source_id,
+            mana_cost=mana_cost,
+            mana_total=cm_mana_total if charged else None,
+            timeout=sum(timeout_for(WRITE)),
         )
-        return True
+    except ChallManagerException:
+        return REFUSED  # block create if CM generate an error
 
-    # default
     logger.debug(
-        "source_id %s cannot create instance of challenge_id %s, reason: source can't afford it",
+        "reservation of an instance of challenge_id %s for source_id %s: %s",
+        challenge_id,
         source_id,
+        outcome,
+    )
+    return outcome
+
+
+def renew_mana_reservation(challenge_id: int, source_id: int) -> str:
+    """
+    Extends the mana reservation of an instance which creation starts late
+    (e.g. a job waiting for a thread), for the creation timeout.
+    If it expired meanwhile, the mana is reserved again.
+    return: RESERVED, or the outcome of reserve_instance_mana
+    """
+    try:
+        if mana_ledger.renew(challenge_id, source_id, timeout=sum(timeout_for(WRITE))):
+            return RESERVED
+    except ChallManagerException:
+        return REFUSED  # block create if CM generate an error
+
+    logger.debug(
+        "reservation of an instance of challenge_id %s for source_id %s expired",
         challenge_id,
+        source_id,
     )
-    return False
+    return reserve_instance_mana(challenge_id, source_id)
+
+
+def cancel_mana_reservation(
+    challenge_id: int, source_id: int, instance_exists: bool = False
+):
+    """
+    Ends the mana reservation of an instance that could not be created.
+    If the instance already exists, it still counts in the mana of source_id,
+    without expiration date until the next reconciliation of the ledger.
+    """
+    if instance_exists:
+        mana_ledger.record(challenge_id, source_id, None)
+    else:
+        mana_ledger.release(challenge_id, source_id)
 
 
 def check_source_can_patch_instance(challenge_id: int, source_id: int) -> bool:
@@ -166,7 +375,7 @@ def check_source_can_patch_instance(challenge_id: int, source_id: int) -> bool:
     if not check_source_can_edit_instance(challenge_id, source_id):
         return False
 
-    challenge = DynamicIaCChallenge.query.filter_by(id=challenge_id).first()
+    challenge = load_challenge(challenge_id)
     if not challenge.timeout:
         logger.warning(
             "unauthorized attempt to patch non timeout instance challenge_id: %s, source_id: %s",
@@ -193,12 +402,13 @@ def check_chall_manager_healthcheck() -> bool:
 
     try:
         logger.debug("getting connection status with chall-manager")
-        health_url = f'{get_config("chall-manager:chall-manager_api_url")}/healthcheck'
-        requests.get(health_url, timeout=5).raise_for_status()
+        get_client().get("/healthcheck", timeout=5).raise_for_status()
     except requests.HTTPError as e:
         logger.warning("can communicate with CM, but got error %s", e)
     except requests.RequestException as e:
         logger.warning("cannot communicate with CM, got %s", e)
+    except ChallManagerException as e:
+        logger.warning("cannot communicate with CM, got %s", e)
     else:
         logger.info("communication with CM configured successfully")
         cm_api_reachable = True
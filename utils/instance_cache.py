@@ -0,0 +1,324 @@
+"""
+This module defines the two-tier cache of the instances informations.
+
+The first tier is a small in-process LRU with a short TTL, it serves the repeated
+reads of a worker without a round trip to the shared CTFd cache (second tier).
+When an instance or a challenge is mutated, the other workers evict their local
+copies on the events of the invalidation bus. The short TTL of the local tier
+bounds the staleness if an event is missed, or if Redis is not configured.
+
+Entries can be tagged (e.g. by challenge), to delete all the entries of a tag at
+once. With Redis (shared by the CTFd cache through REDIS_URL), tags are Redis sets
+and are deleted with their entries by a single script call. Otherwise, tags are
+entries of the CTFd cache, so they are shared by the workers and expire as well.
+"""
+
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+import redis
+from CTFd.cache import cache
+from CTFd.plugins.ctfd_chall_manager.utils.bus import listening
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.redis_client import REDIS_CLIENT
+from CTFd.plugins.ctfd_chall_manager.utils.setup import load_positive_int
+
+logger = configure_logger(__name__)
+
+DEFAULT_LOCAL_SIZE = 1024  # entries
+DEFAULT_LOCAL_TTL = 5  # seconds
+
+# Early refresh of entries (XFetch), a greater beta refreshes earlier
+XFETCH_BETA = 1.0
+XFETCH_MIN_DELTA = 1.0  # seconds, Chall-Manager reads are usually much faster
+
+# Tags are Redis sets of the (prefixed) keys of the CTFd cache
+TAG_PREFIX = "chall-manager:tag:"
+
+# Delete the keys of all tags (KEYS) and the tags, returns the keys deleted
+_INVALIDATE_LUA = """
+local keys = redis.call('SUNION', unpack(KEYS))
+for i = 1, #keys, 1000 do
+    redis.call('DEL', unpack(keys, i, math.min(i + 999, #keys)))
+end
+redis.call('DEL', unpack(KEYS))
+return keys
+"""
+_invalidate_script = (
+    REDIS_CLIENT.register_script(_INVALIDATE_LUA) if REDIS_CLIENT is not None else None
+)
+
+
+def _key_prefix() -> str:
+    """
+    Returns the prefix added by the CTFd cache backend to the keys stored on Redis.
+    """
+    return getattr(cache.cache, "key_prefix", "") or ""
+
+
+class LocalCache:
+    """
+    A class used to keep a bounded number of entries in memory, for a short time.
+    Values are shared by the callers, they must not be modified.
+
+    Attributes:
+        maxsize (int): Maximum number of entries, least recently used are evicted first.
+        ttl (float): Maximum age of an entry, in seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __repr__(self):
+        return f"LocalCache maxsize={self.maxsize} ttl={self.ttl}"
+
+    def get(self, key: str):
+        """
+        Returns the value of key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def set(self, key: str, value, timeout: float | None = None):
+        """
+        Store value for key, for at most timeout seconds (bounded by ttl).
+        """
+        ttl = self.ttl if timeout is None else min(self.ttl, timeout)
+        if ttl <= 0:
+            self.delete(key)
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def delete(self, key: str):
+        """
+        Evict key, if present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str):
+        """
+        Evict all keys starting with prefix.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        """
+        Returns the number of hits, misses, evictions and entries.
+        """
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
+
+
+class CacheEntry(NamedTuple):
+    """
+    A cached value, with the informations needed to refresh it before it expires.
+    """
+
+    value: Any
+    expires_at: float  # timestamp
+    delta: float  # seconds it took to compute value
+
+
+class InstanceCache:
+    """
+    A class used to cache the instances informations on two tiers:
+    the local cache of the worker, then the shared CTFd cache.
+    """
+
+    def __init__(self, local: LocalCache):
+        self.local = local
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "early_refreshes": 0}
+
+    def __repr__(self):
+        return f"InstanceCache local={self.local}"
+
+    def get(self, key: str):
+        """
+        Returns the cached value of key, or None if it is not cached.
+        """
+        entry = self.get_entry(key)
+        return entry.value if entry is not None else None
+
+    def get_entry(self, key: str) -> CacheEntry | None:
+        """
+        Returns the cache entry of key, or None if it is not cached.
+        """
+        # receive the mutations of the other workers
+        listening()
+
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry
+
+        entry = cache.get(key)
+        if not isinstance(entry, tuple):
+            entry = None  # missing, or stored by a previous version
+        with self._lock:
+            self._stats["hits" if entry is not None else "misses"] += 1
+        if entry is not None:
+            entry = CacheEntry(*entry)
+            self.local.set(key, entry, entry.expires_at - time.time())
+        return entry
+
+    def set(self, key: str, value, timeout: int, delta: float = 0.0):
+        """
+        Store value for key on both tiers.
+        The copies of the other workers are evicted by the events of the mutation.
+
+        :param timeout: seconds before the value expires, must be strictly positive
+        :param delta: seconds it took to compute value, used for early refresh
+        """
+        entry = CacheEntry(value, time.time() + timeout, delta)
+        cache.set(key, tuple(entry), timeout=timeout)
+        self.local.set(key, entry, timeout)
+
+    def add(self, key: str, value, timeout: int) -> bool:
+        """
+        Same as set, but only if key is not already stored on the shared tier.
+        Returns True if value has been stored.
+        """
+        entry = CacheEntry(value, time.time() + timeout, 0.0)
+        added = cache.add(key, tuple(entry), timeout=timeout)
+        if added:
+            self.local.set(key, entry, timeout)
+        return added
+
+    def delete(self, key: str):
+        """
+        Delete key from both tiers.
+        """
+        cache.delete(key)
+        self.local.delete(key)
+
+    def tag(self, keys: tuple[str, ...], tags: tuple[str, ...], timeout: int):
+        """
+        Tag keys, so they can be deleted at once with invalidate_tags.
+        Tags hold the keys, and are kept at least timeout seconds.
+        Without Redis, tags are updated by read-modify-write: a key tagged by two
+        workers at once may be missed, it then expires on its own.
+        """
+        if REDIS_CLIENT is None:
+            for tag in tags:
+                tagged = cache.get(f"{TAG_PREFIX}{tag}") or set()
+                cache.set(f"{TAG_PREFIX}{tag}", tagged | set(keys), timeout=timeout)
+            return
+
+        prefix = _key_prefix()
+        try:
+            pipe = REDIS_CLIENT.pipeline(transaction=False)
+            for tag in tags:
+                pipe.sadd(f"{TAG_PREFIX}{tag}", *(prefix + key for key in keys))
+                pipe.expire(f"{TAG_PREFIX}{tag}", timeout)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("cannot tag %s, got %s", keys, e)
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """
+        Delete all keys tagged with any of tags from both tiers.
+        With Redis, keys are deleted in a single round trip.
+
+        :return int: number of keys deleted
+        """
+        if REDIS_CLIENT is None:
+            keys = set()
+            for tag in tags:
+                keys.update(cache.get(f"{TAG_PREFIX}{tag}") or ())
+            cache.delete_many(*keys, *(f"{TAG_PREFIX}{tag}" for tag in tags))
+        else:
+            prefix = _key_prefix()
+            try:
+                deleted = _invalidate_script(
+                    keys=[f"{TAG_PREFIX}{tag}" for tag in tags]
+                )
+            except redis.RedisError as e:
+                logger.error("cannot invalidate tags %s, got %s", tags, e)
+                return 0
+            keys = {key.decode()[len(prefix) :] for key in deleted}
+
+        for key in keys:
+            self.local.delete(key)
+        logger.debug("invalidated %s keys tagged %s", len(keys), tags)
+        return len(keys)
+
+    @staticmethod
+    def should_refresh(entry: CacheEntry, beta: float = XFETCH_BETA) -> bool:
+        """
+        Decide whether entry should be refreshed before it expires (XFetch).
+        The closer it is to expire, and the longer it takes to compute,
+        the more likely it is refreshed early. Readers do not decide it at the
+        same moment, so a hot key does not expire for all of them at once.
+        """
+        delta = max(entry.delta, XFETCH_MIN_DELTA)
+        return time.time() - delta * beta * math.log(1.0 - random.random()) >= (
+            entry.expires_at
+        )
+
+    def claim_refresh(self, key: str, timeout: int) -> bool:
+        """
+        Returns True for a single caller per key among all workers, until
+        release_refresh is called or timeout seconds passed.
+        """
+        claimed = cache.add(f"refresh-{key}", 1, timeout=timeout)
+        if claimed:
+            with self._lock:
+                self._stats["early_refreshes"] += 1
+        return claimed
+
+    @staticmethod
+    def release_refresh(key: str):
+        """
+        Let another caller refresh key.
+        """
+        cache.delete(f"refresh-{key}")
+
+    def stats(self) -> dict:
+        """
+        Returns the hits and misses of each tier. Shared tier is only
+        reached on local misses.
+        """
+        with self._lock:
+            return {
+                "local": self.local.stats(),
+                "shared": {
+                    "hits": self._stats["hits"],
+                    "misses": self._stats["misses"],
+                },
+                "early_refreshes": self._stats["early_refreshes"],
+            }
+
+
+instance_cache = InstanceCache(
+    LocalCache(
+        maxsize=load_positive_int(
+            "PLUGIN_SETTINGS_CM_LOCAL_CACHE_SIZE", DEFAULT_LOCAL_SIZE
+        ),
+        ttl=load_positive_int("PLUGIN_SETTINGS_CM_LOCAL_CACHE_TTL", DEFAULT_LOCAL_TTL),
+    )
+)
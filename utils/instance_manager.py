@@ -2,24 +2,159 @@
 This module contains all functions to use Chall-Manager InstanceManager group.
 """
 
+import datetime
 import json
+import math
+import re
+import time
+from collections.abc import Iterator
 
 import requests
 from CTFd.cache import cache
+from CTFd.plugins.ctfd_chall_manager.utils.bus import (
+    CHALLENGE_DELETED,
+    CHALLENGE_UPDATED,
+    INSTANCE_CREATED,
+    INSTANCE_DELETED,
+    INSTANCE_RENEWED,
+    Event,
+    emit,
+    on,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_client import (
+    READ,
+    WRITE,
+    get_client,
+    timeout_for,
+)
 from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
     ChallManagerException,
+    ChallManagerUnavailableException,
     chall_manager_exception_builder,
 )
+from CTFd.plugins.ctfd_chall_manager.utils.challenge_index import challenge_index
+from CTFd.plugins.ctfd_chall_manager.utils.instance_cache import instance_cache
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
-from CTFd.utils import get_config
+from CTFd.plugins.ctfd_chall_manager.utils.mana_ledger import mana_ledger
+from CTFd.plugins.ctfd_chall_manager.utils.records import InstanceRecord, loads
+from CTFd.plugins.ctfd_chall_manager.utils.setup import load_positive_int
+from CTFd.plugins.ctfd_chall_manager.utils.singleflight import SingleFlight
 
 logger = configure_logger(__name__)
-CM_API_TIMEOUT = get_config("chall-manager:chall-manager_api_timeout")
 
 # pylint: disable=duplicate-code
 # pylint detect duplicate-code between challenge_store and intance_manager
 # This is false positive
 
+# Last known instance informations, served while Chall-Manager is unavailable
+STALE_CACHE_TIMEOUT = 3600
+
+# Instance informations cache policy, if the challenge does not define one
+DEFAULT_CACHE_TIMEOUT = 60
+
+# Instances known to not exist, until created
+NEGATIVE_CACHE_TIMEOUT = load_positive_int("PLUGIN_SETTINGS_CM_NEGATIVE_CACHE_TTL", 10)
+MISSING = "missing"
+
+# Coalesce concurrent identical reads
+flights = SingleFlight("instance")
+
+# Chall-Manager dates have up to 9 fractional digits, Python handles 6
+_FRACTION_RE = re.compile(r"(\.\d{6})\d+")
+
+
+def seconds_until(until: str | None) -> float | None:
+    """
+    Returns the number of seconds before the date until (RFC3339), negative if passed.
+    Returns None if until is not defined or cannot be parsed.
+    """
+    if not until:
+        return None
+
+    try:
+        date = datetime.datetime.fromisoformat(_FRACTION_RE.sub(r"\1", until))
+    except ValueError:
+        logger.warning("cannot parse date %s", until)
+        return None
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+
+
+def expires_at(until: str | None) -> float | None:
+    """
+    Returns the timestamp of the date until (RFC3339).
+    Returns None if until is not defined or cannot be parsed.
+    """
+    remaining = seconds_until(until)
+    if remaining is None:
+        return None
+    return time.time() + remaining
+
+
+def challenge_cache_ttl(challenge_id: int) -> int:
+    """
+    Returns the instances cache policy of the challenge, in seconds.
+    """
+    challenge = challenge_index.get(challenge_id)
+    if challenge is None or challenge.cache_ttl is None:
+        return DEFAULT_CACHE_TIMEOUT
+    return challenge.cache_ttl
+
+
+def cache_timeout(challenge_id: int, result: dict) -> int:
+    """
+    Returns the number of seconds the instance result can be cached:
+    the cache policy of the challenge, bounded by the instance expiry (until).
+    """
+    timeout = challenge_cache_ttl(challenge_id)
+    remaining = seconds_until(result.get("until"))
+    if remaining is not None:
+        timeout = min(timeout, int(remaining))
+    return max(timeout, 0)
+
+
+def _expired(result: dict) -> bool:
+    """
+    Returns True if the instance result is past its expiry (until).
+    """
+    remaining = seconds_until(result.get("until"))
+    return remaining is not None and remaining <= 0
+
+
+def _store(challenge_id: int, source_id: int, result: dict, delta: float = 0.0):
+    """
+    Store the instance result on cache, as long as allowed by cache_timeout.
+    delta is the duration of the call to chall-manager, in seconds.
+    """
+    cache_key = f"instance:{challenge_id}:{source_id}"
+    timeout = cache_timeout(challenge_id, result)
+    if timeout > 0:
+        logger.debug("store result in cache for %s seconds", timeout)
+        instance_cache.set(cache_key, result, timeout=timeout, delta=delta)
+    else:
+        # a timeout of 0 would never expire
+        instance_cache.delete(cache_key)
+    cache.set(f"stale-{cache_key}", result, timeout=STALE_CACHE_TIMEOUT)
+
+    instance_cache.tag(
+        (cache_key, f"stale-{cache_key}"),
+        (f"challenge:{challenge_id}",),
+        timeout=STALE_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_instances(challenge_id: int) -> int:
+    """
+    Delete the cached informations of all instances of challenge_id,
+    e.g. once the challenge is updated or deleted.
+
+    :param challenge_id: id of challenge of the instances
+    :return int: number of cache entries deleted
+    """
+    return instance_cache.invalidate_tags(f"challenge:{challenge_id}")
+
 
 def create_instance(challenge_id: int, source_id: int) -> dict | ChallManagerException:
     """
@@ -31,9 +166,7 @@ def create_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExc
     :raise ChallManagerException:
     """
 
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/instance"
-    cache_key = f"instance:{challenge_id}:{source_id}"
+    url = "/api/v1/instance"
 
     payload = {"challengeId": str(challenge_id), "sourceId": str(source_id)}
 
@@ -44,8 +177,8 @@ def create_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExc
     )
 
     try:
-        r = requests.post(
-            url, data=json.dumps(payload), headers=headers, timeout=CM_API_TIMEOUT
+        r = get_client().post(
+            url, data=json.dumps(payload), headers=headers, timeout=timeout_for(WRITE)
         )
         logger.debug("received response: %s, %s", r.status_code, r.text)
         r.raise_for_status()
@@ -56,8 +189,11 @@ def create_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExc
         raise ChallManagerException() from e
 
     # store the informations on cache
-    result = r.json()
-    cache.set(cache_key, result, timeout=60)
+    result = loads(r.content)
+    _store(challenge_id, source_id, result)
+    cache.delete(f"stale-query:{source_id}")
+    mana_ledger.record(challenge_id, source_id, expires_at(result.get("until")))
+    emit(Event(INSTANCE_CREATED, challenge_id=challenge_id, source_id=source_id))
 
     return result
 
@@ -73,8 +209,7 @@ def delete_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExc
     :raise ChallManagerException:
     """
 
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/instance/{challenge_id}/{source_id}"
+    url = f"/api/v1/instance/{challenge_id}/{source_id}"
     cache_key = f"instance:{challenge_id}:{source_id}"
 
     logger.debug(
@@ -82,7 +217,7 @@ def delete_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExc
     )
 
     try:
-        r = requests.delete(url, timeout=CM_API_TIMEOUT)
+        r = get_client().delete(url, timeout=timeout_for(WRITE))
         logger.debug("received response: %s %s", r.status_code, r.text)
         r.raise_for_status()
     except requests.HTTPError as e:
@@ -92,12 +227,14 @@ def delete_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExc
         raise ChallManagerException() from e
 
     # delete cache to prevent connectionInfo in front
-    cached = cache.get(cache_key)
-    if cached:
-        logger.debug("delete cache informations for %s", cache_key)
-        cache.delete(cache_key)
+    logger.debug("delete cache informations for %s", cache_key)
+    instance_cache.delete(cache_key)
+    cache.delete(f"stale-{cache_key}")
+    cache.delete(f"stale-query:{source_id}")
+    mana_ledger.release(challenge_id, source_id)
+    emit(Event(INSTANCE_DELETED, challenge_id=challenge_id, source_id=source_id))
 
-    return r.json()
+    return loads(r.content)
 
 
 def get_instance(challenge_id: int, source_id: int) -> dict | ChallManagerException:
@@ -111,15 +248,70 @@ def get_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExcept
     :raise ChallManagerException:
     """
 
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/instance/{challenge_id}/{source_id}"
     cache_key = f"instance:{challenge_id}:{source_id}"
 
-    cached = cache.get(cache_key)
-    if cached:
+    entry = instance_cache.get_entry(cache_key)
+    if entry is not None:
+        cached = entry.value
+        if MISSING in cached:
+            logger.debug("use cache informations for %s, no instance", cache_key)
+            raise ChallManagerException(**cached[MISSING])
+
+        # refresh hot entries before they expire, by a single caller
+        if instance_cache.should_refresh(entry) and instance_cache.claim_refresh(
+            cache_key, timeout=math.ceil(sum(timeout_for(READ)))
+        ):
+            return _refresh_instance(challenge_id, source_id, cached)
+
         logger.debug("use cache informations for %s", cache_key)
         return cached
 
+    # concurrent cache misses share a single call to chall-manager
+    return flights.do(
+        cache_key,
+        lambda: _fetch_instance(challenge_id, source_id),
+        ttl=sum(timeout_for(READ)),
+    )
+
+
+def _refresh_instance(challenge_id: int, source_id: int, cached: dict) -> dict:
+    """
+    Refresh the cached instance information before it expires.
+    The cached one is still valid, so it is returned if chall-manager fails
+    for another reason than the instance no longer exists.
+    """
+    cache_key = f"instance:{challenge_id}:{source_id}"
+    logger.debug("refresh cache informations for %s", cache_key)
+
+    try:
+        return flights.do(
+            cache_key,
+            lambda: _fetch_instance(challenge_id, source_id),
+            ttl=sum(timeout_for(READ)),
+        )
+    except ChallManagerException as e:
+        if e.http_code == 404:
+            # the instance is gone, forget it rather than serving it until
+            # it expires (the negative entry cannot be added over it)
+            instance_cache.delete(cache_key)
+            cache.delete(f"stale-{cache_key}")
+            instance_cache.add(
+                cache_key, {MISSING: e.to_dict()}, timeout=NEGATIVE_CACHE_TIMEOUT
+            )
+            raise
+        logger.warning("cannot refresh %s, use cache informations: %s", cache_key, e)
+        return cached
+    finally:
+        instance_cache.release_refresh(cache_key)
+
+
+def _fetch_instance(challenge_id: int, source_id: int) -> dict:
+    """
+    Retrieve the instance information from chall-manager, and store it on cache.
+    """
+    url = f"/api/v1/instance/{challenge_id}/{source_id}"
+    cache_key = f"instance:{challenge_id}:{source_id}"
+
     logger.debug(
         "getting instance information for challenge_id=%s, source_id=%s",
         challenge_id,
@@ -127,20 +319,36 @@ def get_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExcept
     )
 
     try:
-        r = requests.get(url, timeout=CM_API_TIMEOUT)
+        r = get_client().get(url, timeout=timeout_for(READ))
         logger.debug("received response: %s %s", r.status_code, r.text)
         r.raise_for_status()
+    except ChallManagerUnavailableException:
+        stale = cache.get(f"stale-{cache_key}")
+        if stale and not _expired(stale):
+            logger.warning(
+                "chall-manager unavailable, use stale cache for %s", cache_key
+            )
+            return stale
+        raise
     except requests.HTTPError as e:
         custom_exception = chall_manager_exception_builder(r)
+        if custom_exception.http_code == 404:
+            # most reads are for instances not booted yet, remember it
+            # for a short time (create_instance overwrites it)
+            # only if not created meanwhile
+            instance_cache.add(
+                cache_key,
+                {MISSING: custom_exception.to_dict()},
+                timeout=NEGATIVE_CACHE_TIMEOUT,
+            )
         raise custom_exception from e
     except requests.RequestException as e:
         raise ChallManagerException() from e
 
-    result = r.json()
+    result = loads(r.content)
     if "since" in result.keys() and result["since"] is not None:
         # store in cache only if the instance exists
-        logger.debug("store result in cache for better performances")
-        cache.set(cache_key, result, timeout=60)
+        _store(challenge_id, source_id, result, delta=r.elapsed.total_seconds())
 
     return result
 
@@ -155,9 +363,7 @@ def update_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExc
     :raise ChallManagerException:
     """
 
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/instance/{challenge_id}/{source_id}"
-    cache_key = f"instance:{challenge_id}:{source_id}"
+    url = f"/api/v1/instance/{challenge_id}/{source_id}"
 
     payload = {}
 
@@ -168,8 +374,13 @@ def update_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExc
     )
 
     try:
-        r = requests.patch(
-            url, data=json.dumps(payload), headers=headers, timeout=CM_API_TIMEOUT
+        # renewing an instance is idempotent, it can be retried
+        r = get_client().patch(
+            url,
+            data=json.dumps(payload),
+            headers=headers,
+            timeout=timeout_for(WRITE),
+            idempotent=True,
         )
         logger.debug("received response: %s %s", r.status_code, r.text)
         r.raise_for_status()
@@ -180,10 +391,11 @@ def update_instance(challenge_id: int, source_id: int) -> dict | ChallManagerExc
         raise ChallManagerException() from e
 
     # update informations for the next GET request
-    result = r.json()
+    result = loads(r.content)
     if "since" in result.keys() and result["since"] is not None:
-        logger.debug("store result in cache for better performances")
-        cache.set(cache_key, result, timeout=60)
+        _store(challenge_id, source_id, result)
+        mana_ledger.record(challenge_id, source_id, expires_at(result.get("until")))
+    emit(Event(INSTANCE_RENEWED, challenge_id=challenge_id, source_id=source_id))
 
     return result
 
@@ -196,25 +408,89 @@ def query_instance(source_id: int) -> list | ChallManagerException:
     :return list: all instances for the source_id (e.g [{source_id:x, challenge_id, y},..])
     """
 
-    cm_api_url = get_config("chall-manager:chall-manager_api_url")
-    url = f"{cm_api_url}/api/v1/instance?sourceId={source_id}"
-    s = requests.Session()
+    # concurrent queries share a single call to chall-manager
+    return flights.do(
+        f"query:{source_id}",
+        lambda: _query_instance(source_id),
+        ttl=sum(timeout_for(READ)),
+    )
+
+
+def _query_instance(source_id: int) -> list:
+    """
+    Query all instances of source_id on chall-manager,
+    only keep the fields used by the plugin, and store them on cache
+    as a fallback while chall-manager is unavailable.
+    """
+    cache_key = f"stale-query:{source_id}"
+
+    try:
+        result = [record.to_dict() for record in iter_instance_records(source_id)]
+    except ChallManagerUnavailableException:
+        stale = cache.get(cache_key)
+        if stale is None:
+            raise
+        logger.warning("chall-manager unavailable, use stale cache for %s", cache_key)
+        # drop the instances expired meanwhile
+        return [instance for instance in stale if not _expired(instance)]
+    logger.debug("successfully queried instances: %s", result)
+    cache.set(cache_key, result, timeout=STALE_CACHE_TIMEOUT)
+
+    return result
 
-    result = []
+
+def iter_instances(source_id: int) -> Iterator[dict]:
+    """
+    This will yield all instances that exists on chall-manager for the source_id given,
+    as soon as they are received from chall-manager.
+    The connection is kept until the iteration is over, so prefer
+    consuming it without interruption.
+
+    :param source_id: id of source for the instance
+    :yield dict: instance of the source_id (e.g {source_id:x, challenge_id, y})
+    :raise ChallManagerException:
+    """
+    url = f"/api/v1/instance?sourceId={source_id}"
 
     logger.debug("querying instances for sourceId=%s", source_id)
 
     try:
-        with s.get(url, headers=None, stream=True, timeout=CM_API_TIMEOUT) as resp:
+        with get_client().stream("GET", url, timeout=timeout_for(READ)) as resp:
             for line in resp.iter_lines():
                 if line:
-                    res = line.decode("utf-8")
-                    res = json.loads(res)
+                    res = loads(line)
                     if "result" in res.keys():
-                        result.append(res["result"])
-        logger.debug("successfully queried instances: %s", result)
+                        yield res["result"]
+    except ChallManagerException:
+        raise
     except Exception as e:
         logger.error("connection error: %s", e)
         raise ChallManagerException(message="connection error") from e
 
-    return result
+
+def iter_instance_records(source_id: int) -> Iterator[InstanceRecord]:
+    """
+    Same as iter_instances, but yield compact records only holding
+    the fields used by the plugin.
+
+    :param source_id: id of source for the instance
+    :yield InstanceRecord: instance of the source_id
+    :raise ChallManagerException:
+    """
+    for instance in iter_instances(source_id):
+        yield InstanceRecord.from_json(instance)
+
+
+def _on_instance_event(event: Event):
+    instance_cache.local.delete(f"instance:{event.challenge_id}:{event.source_id}")
+
+
+def _on_challenge_event(event: Event):
+    instance_cache.local.delete_prefix(f"instance:{event.challenge_id}:")
+
+
+# evict the local copies of instances mutated by other workers
+for _event_type in (INSTANCE_CREATED, INSTANCE_RENEWED, INSTANCE_DELETED):
+    on(_event_type, _on_instance_event)
+for _event_type in (CHALLENGE_UPDATED, CHALLENGE_DELETED):
+    on(_event_type, _on_challenge_event)
@@ -0,0 +1,365 @@
+"""
+This module runs the instance creations in background (asynchronous provisioning).
+
+Creating an instance can take minutes (e.g. Pulumi-based scenarios), so when
+PLUGIN_SETTINGS_CM_ASYNC_PROVISIONING is enabled the creation is submitted as a job
+to a pool of threads of the CTFd worker, and the request returns immediately with
+the job id. The state of the jobs is kept in Redis if it is configured, so any CTFd
+worker can answer the polling of a job, otherwise in the memory of the worker that
+runs it.
+
+The mana of the instance is reserved and the locks of the instance are acquired
+before the job is submitted. The locks are handed over to the job, so no other
+operation runs on the instance until the job is over, and the reservation is
+extended once the job starts, so a job only fails once accepted if Chall-Manager
+fails to create the instance (or if it waits too long for a thread).
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+import redis
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_client import (
+    WRITE,
+    timeout_for,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
+    ChallManagerException,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.helpers import (
+    cancel_mana_reservation,
+    renew_mana_reservation,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.instance_manager import create_instance
+from CTFd.plugins.ctfd_chall_manager.utils.lock import InstanceLock
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.mana_ledger import (
+    EXISTS,
+    REFUSED,
+    RESERVED,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.redis_client import REDIS_CLIENT
+from CTFd.plugins.ctfd_chall_manager.utils.setup import load_positive_int
+
+logger = configure_logger(__name__)
+
+KEY_PREFIX = "chall-manager:job:"
+
+# Seconds a job is kept, it must outlive the creation timeout
+JOB_TTL = 3600
+
+# Seconds a job can wait for a thread of the pool, then it is given up
+QUEUE_TIMEOUT = 1800
+
+DEFAULT_WORKERS = 4
+
+# States of a job
+PENDING = "pending"  # waiting for a thread of the pool
+RUNNING = "running"  # the instance is being created
+SUCCEEDED = "succeeded"  # the instance is created
+FAILED = "failed"  # the instance could not be created
+
+
+def _async_provisioning() -> bool:
+    enabled = (
+        os.getenv("PLUGIN_SETTINGS_CM_ASYNC_PROVISIONING", "false").lower() == "true"
+    )
+    # without Redis, a job is only known by the CTFd worker running it, the
+    # polling of another worker would not find it
+    workers = load_positive_int("WORKERS", 1)
+    if enabled and REDIS_CLIENT is None and workers > 1:
+        logger.warning(
+            "asynchronous provisioning requires REDIS_URL with %s CTFd workers, "
+            "instances are created synchronously",
+            workers,
+        )
+        return False
+    return enabled
+
+
+@dataclass(slots=True)
+class Job:
+    """
+    Job describes the creation of an instance in background.
+
+    Attributes:
+        id (str): The id of the job.
+        challenge_id (int): The challenge of the instance.
+        source_id (int): The source of the instance.
+        state (str): PENDING, RUNNING, SUCCEEDED or FAILED.
+        data (dict): The instance (connectionInfo, until, since) once SUCCEEDED.
+        message (str): The reason of the failure once FAILED.
+        updated_at (float): The timestamp of the last change of state.
+    """
+
+    id: str
+    challenge_id: int
+    source_id: int
+    state: str = PENDING
+    data: dict | None = None
+    message: str | None = None
+    updated_at: float = 0.0
+
+    def is_done(self) -> bool:
+        """
+        Returns True if the job is over (SUCCEEDED or FAILED).
+        """
+        return self.state in (SUCCEEDED, FAILED)
+
+
+class JobStore:
+    """
+    A class used to keep the state of the jobs for JOB_TTL seconds.
+    If Redis is configured, the jobs are shared by all CTFd workers,
+    otherwise each worker keeps its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}  # id -> (job, expires_at)
+
+    def __repr__(self):
+        return f"JobStore distributed={REDIS_CLIENT is not None}"
+
+    def save(self, job: Job):
+        """
+        Stores job, and resets its expiration.
+        raise: ChallManagerException
+        """
+        job.updated_at = time.time()
+        if REDIS_CLIENT is None:
+            with self._lock:
+                self._purge()
+                self._jobs[job.id] = (Job(**asdict(job)), time.monotonic() + JOB_TTL)
+            return
+
+        try:
+            REDIS_CLIENT.set(
+                f"{KEY_PREFIX}{job.id}", json.dumps(asdict(job)), ex=JOB_TTL
+            )
+        except redis.RedisError as e:
+            logger.error("cannot save %s, got %s", job.id, e)
+            raise ChallManagerException(message="jobs store unavailable") from e
+
+    def get(self, job_id: str) -> Job | None:
+        """
+        Returns the job job_id, None if it does not exist or expired.
+        raise: ChallManagerException
+        """
+        if REDIS_CLIENT is None:
+            with self._lock:
+                self._purge()
+                entry = self._jobs.get(job_id)
+            return Job(**asdict(entry[0])) if entry is not None else None
+
+        try:
+            value = REDIS_CLIENT.get(f"{KEY_PREFIX}{job_id}")
+        except redis.RedisError as e:
+            logger.error("cannot read job %s, got %s", job_id, e)
+            raise ChallManagerException(message="jobs store unavailable") from e
+        return Job(**json.loads(value)) if value is not None else None
+
+    def _purge(self):
+        now = time.monotonic()
+        for job_id in [k for k, (_, exp) in self._jobs.items() if exp <= now]:
+            del self._jobs[job_id]
+
+
+class Provisioner:
+    """
+    A class used to create the instances in background, with a pool of threads
+    per CTFd worker.
+
+    Attributes:
+        enabled (bool): Whether the instances are created in background.
+        workers (int): The number of threads creating instances, per CTFd worker.
+    """
+
+    def __init__(self, enabled: bool, workers: int):
+        self.enabled = enabled
+        self.workers = workers
+        self.store = JobStore()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._stats = {"submitted": 0, "running": 0, "succeeded": 0, "failed": 0}
+
+    def __repr__(self):
+        return f"Provisioner enabled={self.enabled} workers={self.workers}"
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # the threads of the master process are not inherited by forked workers
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="chall-manager-provisioning",
+                )
+            return self._executor
+
+    def submit(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        app,
+        challenge_id: int,
+        source_id: int,
+        reservation: str,
+        lock: InstanceLock,
+    ) -> Job:
+        """
+        Submits the creation of the instance of challenge_id for source_id,
+        which mana reservation is reservation (see reserve_instance_mana).
+        The locks of the instance held by the caller are handed over to the job,
+        which releases them once over. If submit fails, the caller keeps them.
+        The job runs within an application context of app.
+        raise: ChallManagerException
+        """
+        job = Job(uuid.uuid4().hex, challenge_id, source_id)
+        self.store.save(job)
+        self._pool().submit(self._run, app, job, reservation, lock)
+        with self._lock:
+            self._stats["submitted"] += 1
+        logger.debug("submitted %s", job)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """
+        Returns the job job_id, None if it does not exist or expired.
+        A job waiting for a thread for queue_timeout seconds, or running for
+        stale_after seconds, is reported FAILED: the pool is saturated, or the
+        CTFd worker running it was likely stopped.
+        raise: ChallManagerException
+        """
+        job = self.store.get(job_id)
+        if job is None or job.is_done():
+            return job
+
+        if job.state == PENDING and self._queued_too_long(job):
+            logger.warning("%s waited too long for a thread, report it failed", job)
+            job.state = FAILED
+            job.message = "too many instances are being created, retry later"
+        elif job.state == RUNNING and time.time() - job.updated_at > self.stale_after():
+            logger.warning("%s did not change for too long, report it failed", job)
+            job.state = FAILED
+            job.message = "instance creation interrupted, retry later"
+        return job
+
+    @staticmethod
+    def stale_after() -> float:
+        """
+        Returns the seconds a job can run: the creation timeout.
+        """
+        return sum(timeout_for(WRITE))
+
+    @staticmethod
+    def queue_timeout() -> float:
+        """
+        Returns the seconds a job can wait for a thread of the pool.
+        """
+        return QUEUE_TIMEOUT
+
+    def _queued_too_long(self, job: Job) -> bool:
+        # updated_at is the submission of the job while it is pending
+        return time.time() - job.updated_at > self.queue_timeout()
+
+    def _run(self, app, job: Job, reservation: str, lock: InstanceLock):
+        with self._lock:
+            self._stats["running"] += 1
+        try:
+            # the locks were acquired by the request, release them once over
+            lock.adopt()
+            with app.app_context():
+                self._provision(job, reservation)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("error while running %s: %s", job, e)
+            if reservation == RESERVED and not job.is_done():
+                # the reservation was not ended, do not wait for it to expire
+                cancel_mana_reservation(job.challenge_id, job.source_id)
+            job.state, job.message = FAILED, "error while creating instance"
+        finally:
+            lock.unlock()
+            self._finish(job)
+            with self._lock:
+                self._stats["running"] -= 1
+                self._stats[job.state] += 1
+
+    def _provision(self, job: Job, reservation: str):
+        if self._queued_too_long(job):
+            # already reported failed, do not create the instance anymore
+            if reservation == RESERVED:
+                cancel_mana_reservation(job.challenge_id, job.source_id)
+            job.state = FAILED
+            job.message = "too many instances are being created, retry later"
+            return
+
+        job.state = RUNNING
+        self.store.save(job)
+
+        if reservation == RESERVED:
+            # the reservation may have expired while the job was waiting
+            reservation = renew_mana_reservation(job.challenge_id, job.source_id)
+            if reservation not in (RESERVED, EXISTS):
+                job.state = FAILED
+                job.message = (
+                    "You or your team used up all your mana."
+                    if reservation == REFUSED
+                    else "an operation is already in progress for this instance"
+                )
+                return
+
+        try:
+            result = create_instance(job.challenge_id, job.source_id)
+        except ChallManagerException as e:
+            exists = "already exist" in e.message
+            if reservation == RESERVED:
+                cancel_mana_reservation(
+                    job.challenge_id, job.source_id, instance_exists=exists
+                )
+            logger.error("error while creating instance of %s: %s", job, e)
+            job.state = FAILED
+            job.message = (
+                "instance already exists"
+                if exists
+                else "error while creating instance, contact admins"
+            )
+        else:
+            logger.info(
+                "instance for challenge_id: %s, source_id: %s created successfully",
+                job.challenge_id,
+                job.source_id,
+            )
+            job.state = SUCCEEDED
+            # keep only necessary values
+            job.data = {
+                k: result[k]
+                for k in ["connectionInfo", "until", "since"]
+                if k in result
+            }
+
+    def _finish(self, job: Job):
+        try:
+            self.store.save(job)
+        except ChallManagerException as e:
+            # the job is polled until it expires
+            logger.error("cannot save the outcome of %s: %s", job, e)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of jobs submitted, running, succeeded and failed
+        by this worker.
+        """
+        with self._lock:
+            return {"enabled": self.enabled, "workers": self.workers, **self._stats}
+
+
+provisioner = Provisioner(
+    enabled=_async_provisioning(),
+    workers=load_positive_int(
+        "PLUGIN_SETTINGS_CM_PROVISIONING_WORKERS", DEFAULT_WORKERS
+    ),
+)
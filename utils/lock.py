@@ -1,31 +1,50 @@
 """
 This module implements the generic class used by the plugin to maintain synchronization
-inside the plugin (i.e mana)
+inside the plugin (i.e mana).
+
+The operations on an instance hold the lock of the instance, and the lock of its
+source shared (see InstanceLock), so they only wait for the operations on the same
+instance, or for those holding the lock of the source exclusively.
 """
 
-import os
 import threading
+import time
+import uuid
+import weakref
 
 import redis
 from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.redis_client import REDIS_CLIENT
+from CTFd.plugins.ctfd_chall_manager.utils.setup import load_positive_int
 
 logger = configure_logger(__name__)
 
-# https://github.com/ctfer-io/ctfd-chall-manager/issues/141
-lockers = {}
-lockers_lock = threading.Lock()
+KEY_PREFIX = "chall-manager:lock:"
 
+# Exclusive holders waiting for a shared/exclusive lock, no new shared holder gets it
+# meanwhile
+PENDING_PREFIX = "chall-manager:lock-pending:"
+
+# Distributed locks are leases: they expire after LOCK_TIMEOUT seconds unless renewed
+# by their holder, so a killed worker does not hold a lock forever
+LOCK_TIMEOUT = load_positive_int("PLUGIN_SETTINGS_CM_LOCK_TIMEOUT", 30)
+
+# Maximum duration to wait for a lock
+LOCK_WAIT = load_positive_int("PLUGIN_SETTINGS_CM_LOCK_WAIT", 30)
+
+# Delay between two attempts to acquire a distributed shared/exclusive lock
+LOCK_POLL = 0.1  # seconds
+
+# Shards of the local locks registry, lookups of different shards never wait
+# for each other
+LOCK_SHARDS = 16
 
-REDIS_URL = os.getenv("REDIS_URL")
-REDIS_CLIENT = None
-if REDIS_URL:
-    REDIS_CLIENT = redis.Redis.from_url(REDIS_URL)
-    logger.info("redis lock configured successfully")
-else:
-    logger.info("local lock configured successfully")
 
 lock_is_local = REDIS_CLIENT is None
-logger.debug("distributed redis lock configured: %s", (not lock_is_local))
+if lock_is_local:
+    logger.info("local lock configured successfully")
+else:
+    logger.info("redis lock configured successfully")
 
 
 class Lock:
@@ -37,9 +56,9 @@ class Lock:
         gr (threading.Lock or redis_client.lock): A lock object for global locking.
     """
 
-    # <name>_gr is a lock made to block concurrency calls to chall-manager instances.
-    # rw_lock system is an optional (and experimental) feature
-    # that priorise the access of the <name>_gr lock.
+    # chall-manager:lock:<name> is a lock made to block concurrency calls to
+    # chall-manager instances.
+    # see RWLock for the shared/exclusive locks of the sources.
 
     def __init__(self, name: str):
         """
@@ -50,9 +69,15 @@ class Lock:
         """
         self.name = name
         self.gr = threading.Lock()
+        self._owner = None  # thread holding the local lock
+        self._renewal = None
         if REDIS_CLIENT is not None:
             logger.debug("redis client found, use distributed cache")
-            self.gr = REDIS_CLIENT.lock(name=f"{name}_gr", thread_local=False)
+            self.gr = REDIS_CLIENT.lock(
+                name=f"{KEY_PREFIX}{name}",
+                timeout=LOCK_TIMEOUT,
+                thread_local=False,
+            )
 
     def __repr__(self):
         return f"Lock name={self.name}"
@@ -63,17 +88,454 @@ class Lock:
         """
         return self.gr.locked()
 
-    def lock(self):
+    def lock(self, wait: float = LOCK_WAIT) -> bool:
+        """
+        Acquires the lock, waiting at most wait seconds (0 to not wait).
+        The check and the acquisition are atomic, for local and distributed locks.
+        A distributed lock is renewed in background until it is released.
+
+        Returns True if the lock is acquired, otherwise False.
+        """
+        blocking = wait > 0
+        if lock_is_local:
+            if not self.gr.acquire(blocking, wait if blocking else -1):
+                return False
+            self._owner = threading.get_ident()
+            return True
+
+        if not self.gr.acquire(
+            blocking=blocking, blocking_timeout=wait if blocking else None
+        ):
+            return False
+
+        stop = threading.Event()
+        self._renewal = stop
+        threading.Thread(target=self._renew, args=(stop,), daemon=True).start()
+        return True
+
+    def try_lock(self) -> bool:
+        """
+        Acquires the lock if it is free, without waiting.
+
+        Returns True if the lock is acquired, otherwise False.
+        """
+        return self.lock(wait=0)
+
+    def _renew(self, stop: threading.Event):
+        # renew well before the lease expires, so a slow renewal does not lose it
+        while not stop.wait(LOCK_TIMEOUT / 3):
+            try:
+                self.gr.reacquire()
+            except redis.exceptions.LockError as e:
+                logger.warning("lock %s lost (expired or force-released): %s", self, e)
+                return
+            except redis.RedisError as e:
+                logger.warning("cannot renew lock %s, got %s", self, e)
+
+    def adopt(self, owner: int):
         """
-        Acquires the lock.
+        Makes the current thread the holder of the lock held by the thread owner,
+        e.g. to hand it over to a background job.
+        A distributed lock is not bound to a thread, so it is left as is.
         """
-        self.gr.acquire()
+        if lock_is_local and self._owner == owner:
+            self._owner = threading.get_ident()
 
     def unlock(self):
         """
         Releases the lock.
+        Does nothing if it was force-released meanwhile (see force_release).
+        """
+        if lock_is_local:
+            if self._owner != threading.get_ident():
+                logger.warning("lock %s already released", self)
+                return
+            self._owner = None
+            try:
+                self.gr.release()
+            except RuntimeError as e:
+                logger.warning("lock %s already released: %s", self, e)
+            return
+
+        if self._renewal is not None:
+            self._renewal.set()
+            self._renewal = None
+
+        try:
+            self.gr.release()
+        except redis.exceptions.LockError as e:
+            logger.warning("lock %s already released: %s", self, e)
+
+    def force_release(self) -> bool:
+        """
+        Releases the local lock, whoever holds it.
+
+        Returns True if the lock was held, otherwise False.
+        """
+        if self._owner is None:
+            return False
+        self._owner = None
+        try:
+            self.gr.release()
+        except RuntimeError:
+            return False  # released meanwhile
+        return True
+
+
+# Acquire a distributed lock shared (KEYS: writer, readers, pending, ARGV: token,
+# lease in ms), unless it is held or awaited exclusively. Readers are the members of
+# a sorted set scored by the end of their lease, so the ones of a killed worker expire.
+_SHARED_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 or redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), ARGV[1])
+if redis.call('PTTL', KEYS[2]) < tonumber(ARGV[2]) then
+    redis.call('PEXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+# Renew the lease of a shared holder (same KEYS and ARGV as _SHARED_LUA).
+# Returns 0 if it was lost (expired or force-released).
+_RENEW_SHARED_LUA = """
+if not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    return 0
+end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZADD', KEYS[2], 'XX', now + tonumber(ARGV[2]), ARGV[1])
+if redis.call('PTTL', KEYS[2]) < tonumber(ARGV[2]) then
+    redis.call('PEXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+# Acquire a distributed lock exclusively (same KEYS and ARGV as _SHARED_LUA).
+# If it is held and ARGV[3] is 1, the holder announces it waits for it.
+_EXCLUSIVE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+if redis.call('EXISTS', KEYS[1]) == 0 and redis.call('ZCARD', KEYS[2]) == 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    if redis.call('GET', KEYS[3]) == ARGV[1] then
+        redis.call('DEL', KEYS[3])
+    end
+    return 1
+end
+if ARGV[3] == '1' then
+    local pending = redis.call('GET', KEYS[3])
+    if not pending or pending == ARGV[1] then
+        redis.call('SET', KEYS[3], ARGV[1], 'PX', ARGV[2])
+    end
+end
+return 0
+"""
+
+# Delete KEYS[1] if its value is ARGV[1], or set its lease to ARGV[2] ms if given.
+# Returns 0 if it is not held by ARGV[1].
+_OWNED_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+else
+    redis.call('DEL', KEYS[1])
+end
+return 1
+"""
+
+
+class RWLock:  # pylint: disable=too-many-instance-attributes
+    """
+    A class used to manage shared/exclusive locks for synchronization.
+
+    The shared holders of a lock run concurrently, while an exclusive holder runs
+    alone. An exclusive holder waiting for the lock has the priority over the next
+    shared ones, so it is not starved by a continuous flow of shared holders.
+
+    Attributes:
+        name (str): The name of the lock.
+    """
+
+    def __init__(self, name: str):
+        """
+        Initializes a new instance of the RWLock class.
+
+        Args:
+            name (str): The name of the lock.
+        """
+        self.name = name
+        # local lock, shared by the requests of the worker (see load_or_store_rw)
+        self._cond = threading.Condition()
+        self._writer = None  # thread holding the lock exclusively
+        self._readers = {}  # threads holding the lock shared, with their count
+        self._writers_waiting = 0
+        # distributed lock, one instance per holder
+        self._keys = [
+            f"{KEY_PREFIX}{name}",
+            f"{KEY_PREFIX}{name}:shared",
+            f"{PENDING_PREFIX}{name}",
+        ]
+        self._token = uuid.uuid4().hex
+        self._exclusive = None  # mode of the distributed lock, if held
+        self._renewal = None
+
+    def __repr__(self):
+        return f"RWLock name={self.name}"
+
+    def is_locked(self) -> bool:
+        """
+        Returns True if this key is locked (shared or exclusively) by any process,
+        otherwise False.
+        """
+        if lock_is_local:
+            with self._cond:
+                return self._writer is not None or bool(self._readers)
+        return REDIS_CLIENT.exists(*self._keys[:2]) > 0
+
+    def lock_shared(self, wait: float = LOCK_WAIT) -> bool:
+        """
+        Acquires the lock shared, waiting at most wait seconds (0 to not wait).
+
+        Returns True if the lock is acquired, otherwise False.
+        """
+        if lock_is_local:
+            with self._cond:
+                if not self._cond.wait_for(
+                    lambda: self._writer is None and not self._writers_waiting,
+                    timeout=wait,
+                ):
+                    return False
+                ident = threading.get_ident()
+                self._readers[ident] = self._readers.get(ident, 0) + 1
+            return True
+
+        return self._acquire(exclusive=False, wait=wait)
+
+    def lock_exclusive(self, wait: float = LOCK_WAIT) -> bool:
+        """
+        Acquires the lock exclusively, waiting at most wait seconds (0 to not wait).
+
+        Returns True if the lock is acquired, otherwise False.
+        """
+        if lock_is_local:
+            with self._cond:
+                self._writers_waiting += 1
+                try:
+                    acquired = self._cond.wait_for(
+                        lambda: self._writer is None and not self._readers,
+                        timeout=wait,
+                    )
+                finally:
+                    self._writers_waiting -= 1
+                if not acquired:
+                    # shared holders may have waited for this one
+                    self._cond.notify_all()
+                    return False
+                self._writer = threading.get_ident()
+            return True
+
+        return self._acquire(exclusive=True, wait=wait)
+
+    def _acquire(self, exclusive: bool, wait: float) -> bool:
+        script = _EXCLUSIVE_LUA if exclusive else _SHARED_LUA
+        args = [self._token, int(LOCK_TIMEOUT * 1000), int(wait > 0)]
+        deadline = time.monotonic() + wait
+        while not REDIS_CLIENT.eval(script, 3, *self._keys, *args):
+            if time.monotonic() >= deadline:
+                if exclusive and wait > 0:
+                    # do not hold back the shared holders anymore
+                    REDIS_CLIENT.eval(_OWNED_LUA, 1, self._keys[2], self._token)
+                return False
+            time.sleep(LOCK_POLL)
+
+        self._exclusive = exclusive
+        stop = threading.Event()
+        self._renewal = stop
+        threading.Thread(target=self._renew, args=(stop,), daemon=True).start()
+        return True
+
+    def _renew(self, stop: threading.Event):
+        # renew well before the lease expires, so a slow renewal does not lose it
+        lease = int(LOCK_TIMEOUT * 1000)
+        while not stop.wait(LOCK_TIMEOUT / 3):
+            try:
+                if self._exclusive:
+                    renewed = REDIS_CLIENT.eval(
+                        _OWNED_LUA, 1, self._keys[0], self._token, lease
+                    )
+                else:
+                    renewed = REDIS_CLIENT.eval(
+                        _RENEW_SHARED_LUA, 3, *self._keys, self._token, lease
+                    )
+            except redis.RedisError as e:
+                logger.warning("cannot renew lock %s, got %s", self, e)
+                continue
+            if not renewed:
+                logger.warning("lock %s lost (expired or force-released)", self)
+                return
+
+    def adopt(self, owner: int):
+        """
+        Makes the current thread the holder of the lock held (shared or
+        exclusively) by the thread owner, e.g. to hand it over to a background job.
+        A distributed lock is not bound to a thread, so it is left as is.
+        """
+        if not lock_is_local:
+            return
+
+        ident = threading.get_ident()
+        with self._cond:
+            if self._writer == owner:
+                self._writer = ident
+            elif owner in self._readers:
+                self._readers[owner] -= 1
+                if not self._readers[owner]:
+                    del self._readers[owner]
+                self._readers[ident] = self._readers.get(ident, 0) + 1
+
+    def unlock(self):
+        """
+        Releases the lock, held shared or exclusively.
+        Does nothing if it was force-released meanwhile (see force_release).
         """
-        self.gr.release()
+        if lock_is_local:
+            ident = threading.get_ident()
+            with self._cond:
+                if self._writer == ident:
+                    self._writer = None
+                elif ident in self._readers:
+                    self._readers[ident] -= 1
+                    if not self._readers[ident]:
+                        del self._readers[ident]
+                else:
+                    logger.warning("lock %s already released", self)
+                    return
+                self._cond.notify_all()
+            return
+
+        if self._renewal is not None:
+            self._renewal.set()
+            self._renewal = None
+
+        if self._exclusive:
+            released = REDIS_CLIENT.eval(_OWNED_LUA, 1, self._keys[0], self._token)
+        else:
+            released = REDIS_CLIENT.zrem(self._keys[1], self._token)
+        self._exclusive = None
+        if not released:
+            logger.warning("lock %s already released", self)
+
+    def force_release(self) -> bool:
+        """
+        Releases the local lock, whoever holds it (shared or exclusively).
+
+        Returns True if the lock was held, otherwise False.
+        """
+        with self._cond:
+            held = self._writer is not None or bool(self._readers)
+            self._writer = None
+            self._readers.clear()
+            self._cond.notify_all()
+        return held
+
+
+class _Shard:  # pylint: disable=too-few-public-methods
+    """
+    A part of the local locks registry, with its own lock.
+    """
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        # locks are evicted once no request references them
+        self.locks = weakref.WeakValueDictionary()
+        self.stats = {"lookups": 0, "created": 0, "contended": 0}
+
+
+class LockRegistry:
+    """
+    A class used to share the local locks of a worker by name.
+
+    A lock is kept as long as a request uses it (waiting, holding or releasing it),
+    then it is evicted, so the registry does not grow with the number of sources.
+    The registry is sharded by name, so lookups of different names rarely contend.
+
+    Attributes:
+        shards (int): The number of shards.
+    """
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self._shards = [_Shard() for _ in range(shards)]
+
+    def __repr__(self):
+        return f"LockRegistry shards={self.shards}"
+
+    def _shard(self, name: str) -> _Shard:
+        return self._shards[hash(name) % self.shards]
+
+    def load_or_store(self, name: str, factory=Lock) -> Lock | RWLock:
+        """
+        Returns the lock name, creates it with factory if no request uses it.
+        """
+        shard = self._shard(name)
+        contended = not shard.mutex.acquire(  # pylint: disable=consider-using-with
+            blocking=False
+        )
+        if contended:
+            shard.mutex.acquire()  # pylint: disable=consider-using-with
+        try:
+            shard.stats["lookups"] += 1
+            shard.stats["contended"] += contended
+            lock = shard.locks.get(name)
+            if lock is None:
+                logger.debug("previous lock NOT found, create new one")
+                shard.stats["created"] += 1
+                lock = factory(name)
+                shard.locks[name] = lock
+        finally:
+            shard.mutex.release()
+        return lock
+
+    def get(self, name: str) -> Lock | RWLock | None:
+        """
+        Returns the lock name if a request uses it, otherwise None.
+        """
+        shard = self._shard(name)
+        with shard.mutex:
+            return shard.locks.get(name)
+
+    def items(self) -> list[tuple[str, Lock | RWLock]]:
+        """
+        Returns the locks used by requests, by name.
+        """
+        items = []
+        for shard in self._shards:
+            with shard.mutex:
+                items.extend(shard.locks.items())
+        return items
+
+    def stats(self) -> dict:
+        """
+        Returns the number of locks in use, of lookups, of locks created and of
+        lookups that waited for another one on the same shard.
+        """
+        stats = {"size": 0, "lookups": 0, "created": 0, "contended": 0}
+        for shard in self._shards:
+            with shard.mutex:
+                stats["size"] += len(shard.locks)
+                for k, v in shard.stats.items():
+                    stats[k] += v
+        return stats
+
+
+registry = LockRegistry(LOCK_SHARDS)
 
 
 def load_or_store(name: str) -> Lock:
@@ -86,28 +548,151 @@ def load_or_store(name: str) -> Lock:
 
     Notes:
         - If the distributed lock system is activated, it returns a new ManaLock instance.
-        - If the distributed lock system is not activated, it uses a local lock system.
-        - The function ensures thread safety by acquiring and releasing a lock on the
-        lockers dictionary.
+        - If the distributed lock system is not activated, it uses the local locks
+        registry, which evicts the locks no longer used.
     """
 
     if not lock_is_local:
         return Lock(name)
 
-    try:
+    # https://github.com/ctfer-io/ctfd-chall-manager/issues/179
+    return registry.load_or_store(name)
+
+
+def load_or_store_rw(name: str) -> RWLock:
+    """
+    Loads an existing shared/exclusive lock or creates a new one if it doesn't exist,
+    like load_or_store.
+    """
+    if not lock_is_local:
+        return RWLock(name)
+
+    return registry.load_or_store(name, RWLock)
+
+
+class InstanceLock:
+    """
+    A class used to serialize the operations on an instance.
+
+    The lock of the instance (source, challenge) is held exclusively, and the lock of
+    its source shared, so the operations on instances of different challenges of a
+    source run in parallel. An operation that changes the mana of the source
+    outside of the mana reservation (e.g. by an admin) holds the lock of the source
+    exclusively instead, so it runs alone on the source.
+
+    Attributes:
+        source (RWLock): The lock of the source, named source:<source_id>.
+        instance (Lock): The lock of the instance, named instance:<source_id>:<challenge_id>,
+            None if the source is locked exclusively.
+    """
+
+    def __init__(self, challenge_id: int, source_id: int, exclusive: bool = False):
+        """
+        Initializes a new instance of the InstanceLock class.
+
+        Args:
+            challenge_id (int): The challenge of the instance.
+            source_id (int): The source of the instance.
+            exclusive (bool): Whether the source is locked exclusively.
+        """
+        self.source = load_or_store_rw(f"source:{source_id}")
+        self.instance = None
+        self._holder = None  # thread which acquired the locks
+        if not exclusive:
+            self.instance = load_or_store(f"instance:{source_id}:{challenge_id}")
+
+    def __repr__(self):
+        return f"InstanceLock source={self.source} instance={self.instance}"
+
+    def lock(self, wait: float = LOCK_WAIT) -> bool:
+        """
+        Acquires the locks, waiting at most wait seconds overall (0 to not wait).
+        The source is always locked first, so two operations never wait for
+        each other.
+
+        Returns True if the locks are acquired, otherwise False.
+        """
+        self._holder = threading.get_ident()
+        if self.instance is None:
+            return self.source.lock_exclusive(wait)
+
+        deadline = time.monotonic() + wait
+        if not self.source.lock_shared(wait):
+            return False
+        if self.instance.lock(max(0.0, deadline - time.monotonic())):
+            return True
+        self.source.unlock()
+        return False
+
+    def try_lock(self) -> bool:
+        """
+        Acquires the locks if they are free, without waiting.
+
+        Returns True if the locks are acquired, otherwise False.
+        """
+        return self.lock(wait=0)
+
+    def adopt(self):
+        """
+        Makes the current thread the holder of the locks, acquired by another
+        thread (e.g. a request handing them over to a background job).
+        """
+        ident = threading.get_ident()
+        if self.instance is not None:
+            self.instance.adopt(self._holder)
+        self.source.adopt(self._holder)
+        self._holder = ident
+
+    def unlock(self):
+        """
+        Releases the locks.
+        """
+        if self.instance is not None:
+            self.instance.unlock()
+        self.source.unlock()
+
+
+def list_locks() -> list[dict]:
+    """
+    Returns the locks currently held, with the seconds before their lease expires
+    (None for local locks, they are held until released).
+    """
+    if lock_is_local:
+        return [
+            {"name": name, "ttl": None}
+            for name, lock in registry.items()
+            if lock.is_locked()
+        ]
+
+    keys = list(REDIS_CLIENT.scan_iter(match=f"{KEY_PREFIX}*", count=1000))
+    pipe = REDIS_CLIENT.pipeline(transaction=False)
+    for key in keys:
+        pipe.pttl(key)
+    locks = []
+    for key, pttl in zip(keys, pipe.execute()):
+        if pttl == -2:
+            continue  # released meanwhile
+        locks.append(
+            {
+                "name": key.decode()[len(KEY_PREFIX) :],
+                "ttl": pttl / 1000 if pttl >= 0 else None,
+            }
+        )
+    return locks
 
-        logger.debug("distributed locking system not found, use local lock")
-        # https://github.com/ctfer-io/ctfd-chall-manager/issues/179
-        lockers_lock.acquire()  # pylint: disable=consider-using-with
 
-        if name in lockers.keys():  # pylint: disable=consider-iterating-dictionary
-            logger.debug("previous lock found in lockers, use previous")
-            return lockers[name]
+def force_release(name: str) -> bool:
+    """
+    Releases the lock name, whoever holds it (e.g. a lock left by a killed worker).
+    The holder is not interrupted, it keeps running without the lock.
 
-        logger.debug("previous lock NOT found, create new one")
-        lock = Lock(name)
-        lockers[name] = lock
-    finally:
-        lockers_lock.release()
+    Returns True if the lock was held, otherwise False.
+    """
+    logger.warning("force release of lock %s", name)
+    if not lock_is_local:
+        return REDIS_CLIENT.delete(f"{KEY_PREFIX}{name}") == 1
 
-    return lock
+    lock = registry.get(name)
+    if lock is None:
+        return False
+    return lock.force_release()
@@ -0,0 +1,511 @@
+"""
+This module defines the ledger of the instances counted in the mana of each source.
+
+Instead of querying Chall-Manager on every mana check, the instances of a source are
+recorded when they are created, renewed or deleted through the plugin, along with
+their expiration date (until). The ledger is periodically reconciled with the
+instances running on Chall-Manager, to correct the changes made outside of the
+plugin (e.g. instances deleted by the janitor or directly on Chall-Manager).
+
+Before an instance is created, its mana is reserved atomically: the reservation
+counts in the mana of the source until the instance is created or the creation
+fails, or until it expires if the worker never ends it. So concurrent creations for
+a source do not need to be serialized to not overspend its mana.
+
+If Redis is configured, the ledger is shared by all CTFd workers, otherwise each
+worker keeps its own: the entries of a source are then replaced by its instances
+running on Chall-Manager before its mana is reserved, as the other workers may
+have created some since.
+"""
+
+import threading
+import time
+from collections.abc import Callable
+from typing import NamedTuple
+
+import redis
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
+    ChallManagerException,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.redis_client import REDIS_CLIENT
+from CTFd.plugins.ctfd_chall_manager.utils.setup import load_positive_int
+
+logger = configure_logger(__name__)
+
+DEFAULT_RECONCILE_INTERVAL = 300  # seconds
+
+# A released entry is kept until the next reconciliation, so that a reconciliation
+# in progress does not restore an instance deleted meanwhile
+RELEASED = -1.0
+
+KEY_PREFIX = "chall-manager:mana:"
+
+# Outcomes of a reservation
+RESERVED = "reserved"  # the mana is reserved until the creation ends
+EXISTS = "exists"  # the instance is already counted, nothing reserved
+IN_PROGRESS = "in-progress"  # a creation of the instance is already in progress
+REFUSED = "refused"  # the source cannot afford the instance
+
+# Attempts of a reservation while the ledger of the source is concurrently written
+RESERVE_ATTEMPTS = 10
+
+# Replace the entries of a source (KEYS[1]) by the ones of a reconciliation started
+# at ARGV[1] (ARGV[2:] are field, value pairs). Entries written since it started,
+# and reservations in progress, are kept. Returns the number of entries added or
+# removed.
+_REPLACE_LUA = """
+local started_at = tonumber(ARGV[1])
+local fresh = {}
+for i = 2, #ARGV, 2 do
+    fresh[ARGV[i]] = ARGV[i + 1]
+end
+local changes = 0
+local current = redis.call('HGETALL', KEYS[1])
+for i = 1, #current, 2 do
+    local field, value = current[i], current[i + 1]
+    local expires_at = tonumber(string.match(value, '^([^:]*)'))
+    local updated_at = tonumber(string.match(value, '^[^:]*:([^:]*)'))
+    local pending = string.sub(value, -2) == ':p'
+    local released = string.sub(value, 1, 1) == '-'
+    if updated_at >= started_at or (pending and expires_at > started_at) then
+        fresh[field] = nil
+    elseif fresh[field] == nil then
+        redis.call('HDEL', KEYS[1], field)
+        if not released then
+            changes = changes + 1
+        end
+    elseif released then
+        changes = changes + 1
+    end
+end
+for field, value in pairs(fresh) do
+    if redis.call('HSET', KEYS[1], field, value) == 1 then
+        changes = changes + 1
+    end
+end
+return changes
+"""
+_replace_script = (
+    REDIS_CLIENT.register_script(_REPLACE_LUA) if REDIS_CLIENT is not None else None
+)
+
+# Replace the reservation of challenge ARGV[1] in the entries of a source (KEYS[1])
+# by ARGV[2], if it has not expired at ARGV[3]. Returns 0 if there is none.
+_RENEW_LUA = """
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value or string.sub(value, -2) ~= ':p' then
+    return 0
+end
+if tonumber(string.match(value, '^([^:]*)')) <= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
+
+class LedgerEntry(NamedTuple):
+    """
+    An instance counted in the mana of its source.
+    """
+
+    expires_at: float | None  # timestamp, None if the instance never expires
+    updated_at: float  # timestamp
+    pending: bool = False  # reserved, the instance is being created
+
+    def is_live(self, now: float) -> bool:
+        """
+        Returns True if the instance still counts at now.
+        """
+        return self.expires_at is None or self.expires_at > now
+
+    def encode(self) -> str:
+        """
+        Returns the entry as stored on Redis.
+        """
+        expires_at = "" if self.expires_at is None else repr(self.expires_at)
+        pending = ":p" if self.pending else ""
+        return f"{expires_at}:{self.updated_at!r}{pending}"
+
+    @classmethod
+    def decode(cls, value: bytes | str) -> "LedgerEntry":
+        """
+        Build an entry stored on Redis.
+        """
+        if isinstance(value, bytes):
+            value = value.decode()
+        expires_at, updated_at, *pending = value.split(":")
+        return cls(
+            float(expires_at) if expires_at else None, float(updated_at), bool(pending)
+        )
+
+
+def _decide(
+    entries: dict[int, LedgerEntry],
+    challenge_id: int,
+    mana_cost: Callable[[int], int],
+    mana_total: int | None,
+    now: float,
+) -> str:
+    """
+    Decide the outcome of the reservation of challenge_id, given the entries of
+    the source.
+    """
+    entry = entries.get(challenge_id)
+    if entry is not None and entry.is_live(now):
+        return IN_PROGRESS if entry.pending else EXISTS
+
+    cost = mana_cost(challenge_id)
+    if mana_total is None or cost == 0:
+        return RESERVED
+
+    used = sum(
+        mana_cost(chall_id) for chall_id, entry in entries.items() if entry.is_live(now)
+    )
+    return RESERVED if used + cost <= mana_total else REFUSED
+
+
+class ManaLedger:
+    """
+    A class used to keep the instances of each source, by challenge.
+
+    Attributes:
+        reconcile_interval (int): Seconds between two reconciliations with Chall-Manager.
+    """
+
+    def __init__(self, reconcile_interval: int):
+        self.reconcile_interval = reconcile_interval
+
+        # local state, used if Redis is not configured
+        self._lock = threading.Lock()
+        self._entries = {}  # source_id -> challenge_id -> LedgerEntry
+        self._reconciled_at = None
+        self._reconciling = False
+
+        self._stats = {"reconciliations": 0, "corrections": 0}
+
+    def __repr__(self):
+        return f"ManaLedger reconcile_interval={self.reconcile_interval}"
+
+    @staticmethod
+    def is_shared() -> bool:
+        """
+        Returns True if the ledger is shared by all CTFd workers (Redis).
+        """
+        return REDIS_CLIENT is not None
+
+    def entries(self, source_id: int) -> dict[int, LedgerEntry]:
+        """
+        Returns the entries of source_id, by challenge_id.
+
+        :raise ChallManagerException: if the ledger cannot be read
+        """
+        if REDIS_CLIENT is None:
+            with self._lock:
+                return dict(self._entries.get(int(source_id), {}))
+
+        try:
+            values = REDIS_CLIENT.hgetall(f"{KEY_PREFIX}{source_id}")
+        except redis.RedisError as e:
+            logger.error("cannot read mana ledger of %s, got %s", source_id, e)
+            raise ChallManagerException(message="mana ledger unavailable") from e
+        return {
+            int(challenge_id): LedgerEntry.decode(value)
+            for challenge_id, value in values.items()
+        }
+
+    def record(self, challenge_id: int, source_id: int, expires_at: float | None):
+        """
+        Record the instance of challenge_id for source_id (created or renewed).
+
+        :param expires_at: timestamp of the instance expiration, None if never
+        """
+        self._write(challenge_id, source_id, LedgerEntry(expires_at, time.time()))
+
+    def release(self, challenge_id: int, source_id: int):
+        """
+        Record the deletion of the instance of challenge_id for source_id.
+        """
+        self._write(challenge_id, source_id, LedgerEntry(RELEASED, time.time()))
+
+    def reserve(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        challenge_id: int,
+        source_id: int,
+        mana_cost: Callable[[int], int],
+        mana_total: int | None,
+        timeout: float,
+    ) -> str:
+        """
+        Atomically check that source_id can afford an instance of challenge_id,
+        and reserve its mana for at most timeout seconds. The reservation ends with
+        record (created) or release (failed).
+
+        :param mana_cost: returns the mana cost of a challenge (by id)
+        :param mana_total: mana of a source, None if unlimited
+        :param timeout: seconds before the reservation expires (e.g. worker killed)
+        :return str: RESERVED, EXISTS, IN_PROGRESS or REFUSED
+        :raise ChallManagerException: if the ledger cannot be read
+        """
+        reservation = LedgerEntry(time.time() + timeout, time.time(), pending=True)
+
+        if REDIS_CLIENT is None:
+            with self._lock:
+                entries = self._entries.setdefault(int(source_id), {})
+                outcome = _decide(
+                    entries, int(challenge_id), mana_cost, mana_total, time.time()
+                )
+                if outcome == RESERVED:
+                    entries[int(challenge_id)] = reservation
+            return outcome
+
+        key = f"{KEY_PREFIX}{source_id}"
+        try:
+            with REDIS_CLIENT.pipeline() as pipe:
+                for _ in range(RESERVE_ATTEMPTS):
+                    try:
+                        # the reservation is dropped if the entries changed meanwhile
+                        pipe.watch(key)
+                        entries = {
+                            int(k): LedgerEntry.decode(v)
+                            for k, v in pipe.hgetall(key).items()
+                        }
+                        outcome = _decide(
+                            entries,
+                            int(challenge_id),
+                            mana_cost,
+                            mana_total,
+                            time.time(),
+                        )
+                        if outcome == RESERVED:
+                            pipe.multi()
+                            pipe.hset(key, challenge_id, reservation.encode())
+                            pipe.sadd(f"{KEY_PREFIX}sources", source_id)
+                            pipe.execute()
+                        return outcome
+                    except redis.WatchError:
+                        logger.debug("mana ledger of %s changed, retry", source_id)
+        except redis.RedisError as e:
+            logger.error("cannot reserve mana of %s, got %s", source_id, e)
+            raise ChallManagerException(message="mana ledger unavailable") from e
+
+        logger.warning("cannot reserve mana of %s, too many attempts", source_id)
+        raise ChallManagerException(message="mana ledger busy")
+
+    def renew(self, challenge_id: int, source_id: int, timeout: float) -> bool:
+        """
+        Extend the reservation of challenge_id for source_id to timeout seconds from
+        now, e.g. once the creation starts after waiting in a queue.
+
+        :return bool: False if there is no reservation, or it expired meanwhile
+        :raise ChallManagerException: if the ledger cannot be written
+        """
+        now = time.time()
+        reservation = LedgerEntry(now + timeout, now, pending=True)
+
+        if REDIS_CLIENT is None:
+            with self._lock:
+                entries = self._entries.get(int(source_id), {})
+                entry = entries.get(int(challenge_id))
+                if entry is None or not entry.pending or not entry.is_live(now):
+                    return False
+                entries[int(challenge_id)] = reservation
+            return True
+
+        try:
+            return bool(
+                REDIS_CLIENT.eval(
+                    _RENEW_LUA,
+                    1,
+                    f"{KEY_PREFIX}{source_id}",
+                    challenge_id,
+                    reservation.encode(),
+                    repr(now),
+                )
+            )
+        except redis.RedisError as e:
+            logger.error("cannot renew mana reservation of %s, got %s", source_id, e)
+            raise ChallManagerException(message="mana ledger unavailable") from e
+
+    def _write(self, challenge_id: int, source_id: int, entry: LedgerEntry):
+        if REDIS_CLIENT is None:
+            with self._lock:
+                self._entries.setdefault(int(source_id), {})[int(challenge_id)] = entry
+            return
+
+        try:
+            pipe = REDIS_CLIENT.pipeline(transaction=False)
+            pipe.hset(f"{KEY_PREFIX}{source_id}", challenge_id, entry.encode())
+            pipe.sadd(f"{KEY_PREFIX}sources", source_id)
+            pipe.execute()
+        except redis.RedisError as e:
+            # the next reconciliation will record it
+            logger.warning(
+                "cannot write mana ledger of %s for challenge %s, got %s",
+                source_id,
+                challenge_id,
+                e,
+            )
+
+    def replace(self, snapshot: dict[int, dict[int, float | None]], started_at: float):
+        """
+        Replace the entries of all sources by snapshot, the instances running on
+        Chall-Manager when the reconciliation started. Entries written since
+        started_at are more recent, so they are kept.
+
+        :param snapshot: source_id -> challenge_id -> expires_at
+        :param started_at: timestamp of the beginning of the reconciliation
+        :return int: number of entries added or removed
+        """
+        if REDIS_CLIENT is None:
+            changes = self._replace_local(snapshot, started_at)
+        else:
+            changes = self._replace_redis(snapshot, started_at)
+
+        with self._lock:
+            self._stats["reconciliations"] += 1
+            self._stats["corrections"] += changes
+        logger.info("mana ledger reconciled, %s corrections", changes)
+        return changes
+
+    def replace_source(
+        self, source_id: int, instances: dict[int, float | None], started_at: float
+    ) -> int:
+        """
+        Same as replace, for the entries of source_id only.
+
+        :param instances: challenge_id -> expires_at
+        :param started_at: timestamp of the beginning of the query of the instances
+        :return int: number of entries added or removed
+        """
+        if REDIS_CLIENT is None:
+            with self._lock:
+                return self._replace_source_local(int(source_id), instances, started_at)
+
+        args = [repr(started_at)]
+        for challenge_id, expires_at in instances.items():
+            args += [challenge_id, LedgerEntry(expires_at, started_at).encode()]
+        try:
+            return _replace_script(keys=[f"{KEY_PREFIX}{source_id}"], args=args)
+        except redis.RedisError as e:
+            logger.error("cannot reconcile mana ledger of %s, got %s", source_id, e)
+            raise ChallManagerException(message="mana ledger unavailable") from e
+
+    def _replace_local(self, snapshot: dict, started_at: float) -> int:
+        changes = 0
+        with self._lock:
+            for source_id in set(self._entries) | set(snapshot):
+                changes += self._replace_source_local(
+                    source_id, snapshot.get(source_id, {}), started_at
+                )
+            self._reconciled_at = started_at
+        return changes
+
+    def _replace_source_local(
+        self, source_id: int, instances: dict, started_at: float
+    ) -> int:
+        # the caller holds the lock
+        changes = 0
+        current = self._entries.get(source_id, {})
+        fresh = {
+            challenge_id: LedgerEntry(expires_at, started_at)
+            for challenge_id, expires_at in instances.items()
+        }
+        for challenge_id, entry in current.items():
+            if entry.updated_at >= started_at or (
+                entry.pending and entry.is_live(started_at)
+            ):
+                fresh[challenge_id] = entry
+            elif (challenge_id in fresh) == (entry.expires_at == RELEASED):
+                changes += 1
+        changes += sum(1 for challenge_id in fresh if challenge_id not in current)
+        if fresh:
+            self._entries[source_id] = fresh
+        else:
+            self._entries.pop(source_id, None)
+        return changes
+
+    def _replace_redis(self, snapshot: dict, started_at: float) -> int:
+        try:
+            known = {int(s) for s in REDIS_CLIENT.smembers(f"{KEY_PREFIX}sources")}
+            sources = known | set(snapshot)
+            pipe = REDIS_CLIENT.pipeline(transaction=False)
+            for source_id in sources:
+                args = [repr(started_at)]
+                for challenge_id, expires_at in snapshot.get(source_id, {}).items():
+                    args += [challenge_id, LedgerEntry(expires_at, started_at).encode()]
+                _replace_script(
+                    keys=[f"{KEY_PREFIX}{source_id}"], args=args, client=pipe
+                )
+            if snapshot:
+                pipe.sadd(f"{KEY_PREFIX}sources", *snapshot)
+            pipe.set(f"{KEY_PREFIX}reconciled", repr(started_at))
+            results = pipe.execute()
+        except redis.RedisError as e:
+            logger.error("cannot reconcile mana ledger, got %s", e)
+            raise ChallManagerException(message="mana ledger unavailable") from e
+        return sum(results[: len(sources)])
+
+    def reconciled_at(self) -> float | None:
+        """
+        Returns the timestamp of the last reconciliation, None if never reconciled.
+        """
+        if REDIS_CLIENT is None:
+            return self._reconciled_at
+
+        try:
+            value = REDIS_CLIENT.get(f"{KEY_PREFIX}reconciled")
+        except redis.RedisError as e:
+            logger.error("cannot read mana ledger state, got %s", e)
+            raise ChallManagerException(message="mana ledger unavailable") from e
+        return float(value) if value is not None else None
+
+    def claim_reconcile(self) -> bool:
+        """
+        Returns True for a single caller among all workers per reconcile_interval,
+        until release_reconcile is called (local mode).
+        """
+        if REDIS_CLIENT is None:
+            with self._lock:
+                if self._reconciling:
+                    return False
+                self._reconciling = True
+                return True
+
+        try:
+            return bool(
+                REDIS_CLIENT.set(
+                    f"{KEY_PREFIX}reconciling", 1, nx=True, ex=self.reconcile_interval
+                )
+            )
+        except redis.RedisError as e:
+            logger.warning("cannot claim mana ledger reconciliation, got %s", e)
+            return False
+
+    def release_reconcile(self):
+        """
+        Let another caller reconcile, once the interval passed (local mode).
+        With Redis, the claim expires after reconcile_interval.
+        """
+        with self._lock:
+            self._reconciling = False
+
+    def stats(self) -> dict:
+        """
+        Returns the number of reconciliations of this worker, and the number
+        of entries they corrected.
+        """
+        try:
+            reconciled_at = self.reconciled_at()
+        except ChallManagerException:
+            reconciled_at = None
+        with self._lock:
+            return dict(self._stats, reconciled_at=reconciled_at)
+
+
+mana_ledger = ManaLedger(
+    reconcile_interval=load_positive_int(
+        "PLUGIN_SETTINGS_CM_MANA_RECONCILE_INTERVAL", DEFAULT_RECONCILE_INTERVAL
+    ),
+)
@@ -0,0 +1,95 @@
+"""
+This module defines the decoding of Chall-Manager responses.
+
+Responses are decoded with orjson if it is installed (fallbacks to the standard
+json module), and the records returned by queries are converted into compact
+objects keeping only the fields used by the plugin.
+"""
+
+import json
+from dataclasses import dataclass
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # pylint: disable=invalid-name
+
+
+def loads(data: bytes | str):
+    """
+    Decode a JSON document received from Chall-Manager.
+
+    :param data: JSON document
+    :return: decoded document
+    """
+    if orjson is not None:
+        return orjson.loads(data)  # pylint: disable=no-member
+    return json.loads(data)
+
+
+@dataclass(slots=True)
+class InstanceRecord:
+    """
+    InstanceRecord holds the fields of a Chall-Manager instance used by the plugin.
+    """
+
+    challenge_id: str
+    source_id: str
+    since: str | None = None
+    until: str | None = None
+    last_renew: str | None = None
+    connection_info: str | None = None
+    flags: tuple[str, ...] = ()
+
+    @classmethod
+    def from_json(cls, data: dict) -> "InstanceRecord":
+        """
+        Build an InstanceRecord from a decoded Chall-Manager instance.
+        """
+        get = data.get
+        return cls(
+            data["challengeId"],
+            data["sourceId"],
+            get("since"),
+            get("until"),
+            get("lastRenew"),
+            get("connectionInfo"),
+            tuple(get("flags") or ()),
+        )
+
+    def to_dict(self) -> dict:
+        """
+        Returns the instance in Chall-Manager format (e.g. for templates or caching).
+        """
+        data = {
+            "challengeId": self.challenge_id,
+            "sourceId": self.source_id,
+            "since": self.since,
+            "until": self.until,
+            "lastRenew": self.last_renew,
+            "connectionInfo": self.connection_info,
+        }
+        if self.flags:
+            data["flags"] = list(self.flags)
+        return data
+
+
+@dataclass(slots=True)
+class ChallengeRecord:
+    """
+    ChallengeRecord holds the fields of a Chall-Manager challenge used by the plugin.
+    """
+
+    id: str
+    instances: tuple[InstanceRecord, ...] = ()
+
+    @classmethod
+    def from_json(cls, data: dict) -> "ChallengeRecord":
+        """
+        Build a ChallengeRecord from a decoded Chall-Manager challenge.
+        """
+        from_json = InstanceRecord.from_json
+        return cls(
+            data["id"],
+            tuple(from_json(i) for i in data.get("instances") or ()),
+        )
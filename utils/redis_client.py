@@ -0,0 +1,113 @@
+"""
+This module configures the optional Redis client shared by the plugin
+(i.e. distributed locks, circuit breaker), and the pub/sub listener used to
+notify the other workers (e.g. of an invalidation).
+"""
+
+import os
+import threading
+import time
+
+import redis
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+
+logger = configure_logger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_CLIENT = None
+if REDIS_URL:
+    REDIS_CLIENT = redis.Redis.from_url(REDIS_URL)
+    logger.info("redis client configured successfully")
+else:
+    logger.info("redis not configured, use process local states")
+
+# channel -> handlers, called with the message data (bytes)
+_handlers = {}
+_listener = {"pid": None, "thread": None, "channels": (), "retry_at": 0.0}
+LISTENER_RETRY_DELAY = 5  # seconds between subscription attempts
+_listener_lock = threading.Lock()
+
+
+def subscribe(channel: str, handler):
+    """
+    Register handler to be called with the data of each message published on channel.
+    Messages are received once the listener is started (see ensure_listener).
+    """
+    with _listener_lock:
+        _handlers.setdefault(channel, []).append(handler)
+
+
+def _dispatch(message: dict):
+    channel = message["channel"]
+    if isinstance(channel, bytes):
+        channel = channel.decode()
+    for handler in _handlers.get(channel, ()):
+        try:
+            handler(message["data"])
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("error handling message on %s: %s", channel, e)
+
+
+def is_listening() -> bool:
+    """
+    Returns True if this worker receives the messages published on Redis.
+    """
+    thread = _listener["thread"]
+    return (
+        _listener["pid"] == os.getpid()
+        and thread is not None
+        and thread.is_alive()
+        # restart the listener when a new channel is registered
+        and len(_listener["channels"]) == len(_handlers)
+    )
+
+
+def ensure_listener() -> bool:
+    """
+    Start the pub/sub listener of this worker if needed.
+    Threads are not inherited by forked workers, so it is started lazily.
+
+    :return bool: True if this worker receives the published messages
+    """
+    if REDIS_CLIENT is None or not _handlers:
+        return False
+    if is_listening():
+        return True
+
+    with _listener_lock:
+        if is_listening() or time.monotonic() < _listener["retry_at"]:
+            return is_listening()
+
+        if _listener["pid"] == os.getpid() and _listener["thread"] is not None:
+            # stop the previous listener of this worker, the one of a parent
+            # process is left untouched as its sockets must not be used
+            _listener["thread"].stop()
+        _listener["pid"] = os.getpid()
+        _listener["thread"] = None
+        _listener["channels"] = tuple(_handlers)
+
+        try:
+            pubsub = REDIS_CLIENT.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{channel: _dispatch for channel in _handlers})
+            _listener["thread"] = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            logger.debug("listening to %s", ", ".join(_handlers))
+        except redis.RedisError as e:
+            logger.warning("cannot subscribe to redis channels, got %s", e)
+            _listener["retry_at"] = time.monotonic() + LISTENER_RETRY_DELAY
+            return False
+
+    return True
+
+
+def publish(channel: str, data: str) -> bool:
+    """
+    Publish data on channel, returns False if Redis is not configured or unreachable.
+    """
+    if REDIS_CLIENT is None:
+        return False
+    try:
+        REDIS_CLIENT.publish(channel, data)
+    except redis.RedisError as e:
+        logger.warning("cannot publish on %s, got %s", channel, e)
+        return False
+    return True
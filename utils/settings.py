@@ -0,0 +1,171 @@
+"""
+This module keeps a process-local snapshot of the plugin settings.
+
+All the chall-manager:* settings are loaded at once and then read from memory,
+instead of going through the CTFd cache for each key on every request.
+The snapshot is invalidated when a setting is committed (e.g. from the settings
+page or set_config), and the other workers are notified through the invalidation
+bus. If the bus is not available, the snapshot is reloaded after a short delay so
+that the other workers eventually see the changes.
+"""
+
+import os
+import threading
+import time
+
+from CTFd.models import Configs, db
+from CTFd.plugins.ctfd_chall_manager.utils.bus import (
+    CONFIG_CHANGED,
+    Event,
+    emit,
+    listening,
+    on,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+logger = configure_logger(__name__)
+
+PREFIX = "chall-manager:"
+
+# Maximum age of a snapshot, bounds the staleness if an invalidation is missed
+LOCAL_MAX_AGE = 5  # seconds, changes from other workers are not notified
+SUBSCRIBED_MAX_AGE = 300  # seconds, changes are notified through pub/sub
+
+
+def _convert(value: str | None):
+    """
+    Convert a raw setting the same way CTFd get_config does.
+    """
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    if value.lower() == "true":
+        return True
+    if value.lower() == "false":
+        return False
+    return value
+
+
+class PluginSettings:
+    """
+    A class used to read the plugin settings from memory.
+
+    Attributes:
+        prefix (str): The prefix of the settings keys.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._values = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._pid = None
+        self._listening = False
+
+    def __repr__(self):
+        return f"PluginSettings prefix={self.prefix}"
+
+    def _snapshot(self) -> dict:
+        # the snapshot is kept longer if invalidations from other workers
+        # have been received since it was loaded
+        subscribed = listening()
+        max_age = (
+            SUBSCRIBED_MAX_AGE if self._listening and subscribed else LOCAL_MAX_AGE
+        )
+
+        values = self._values
+        if (
+            values is not None
+            and self._pid == os.getpid()
+            and time.monotonic() - self._loaded_at < max_age
+        ):
+            return values
+
+        with self._lock:
+            self._pid = os.getpid()
+            self._listening = subscribed
+            generation = self._generation
+            rows = db.session.execute(
+                select(Configs.key, Configs.value).where(
+                    Configs.key.startswith(self.prefix)
+                )
+            ).all()
+            values = {key[len(self.prefix) :]: _convert(value) for key, value in rows}
+
+            # do not keep the snapshot if it was invalidated while loading
+            if generation == self._generation:
+                self._values = values
+                self._loaded_at = time.monotonic()
+            logger.debug("loaded %s settings", len(values))
+
+        return values
+
+    def get(self, key: str, default=None):
+        """
+        Returns the value of the setting key (without prefix), or default if unset.
+
+        :param key: name of the setting (e.g. "chall-manager_api_url")
+        :param default: value returned if the setting is not defined
+        """
+        value = self._snapshot().get(key)
+        return default if value is None else value
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        """
+        Returns the value of the setting key as an integer, or default if unset or invalid.
+        """
+        value = self.get(key, default)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            logger.warning("invalid %s, got %s. Falling back to default.", key, value)
+            return default
+
+    def invalidate(self):
+        """
+        Drop the snapshot of this worker, the next read reloads it.
+        """
+        with self._lock:
+            self._generation += 1
+            self._values = None
+        logger.debug("settings snapshot invalidated")
+
+    def publish(self):
+        """
+        Invalidate the snapshot of this worker, and of the other ones if Redis
+        is configured.
+        """
+        self.invalidate()
+        emit(Event(CONFIG_CHANGED))
+
+
+settings = PluginSettings(PREFIX)
+on(CONFIG_CHANGED, lambda _: settings.invalidate())
+
+
+@event.listens_for(Configs, "after_insert")
+@event.listens_for(Configs, "after_update")
+@event.listens_for(Configs, "after_delete")
+def _on_config_change(_mapper, _connection, target):
+    """
+    Mark the session as changing plugin settings, invalidation happens on commit.
+    """
+    if target.key and target.key.startswith(PREFIX):
+        session = Session.object_session(target)
+        if session is not None:
+            session.info["chall-manager:settings"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _on_commit(session):
+    if session.info.pop("chall-manager:settings", False):
+        settings.publish()
+
+
+@event.listens_for(Session, "after_rollback")
+def _on_rollback(session):
+    session.info.pop("chall-manager:settings", None)
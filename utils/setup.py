@@ -12,6 +12,33 @@ from CTFd.utils import set_config
 logger = configure_logger(__name__)
 
 
+def load_positive_int(varenv: str, default: int) -> int:
+    """
+    Load a strictly positive integer from the environment variable varenv.
+    Fallbacks to default if the variable is missing or invalid.
+    """
+    value = os.getenv(varenv, str(default))  # default value must be str
+    try:
+        value = int(value)  # try to trigger an execption
+    except ValueError:
+        logger.warning(
+            "invalid %s, got %s. Falling back to default.",
+            varenv,
+            value,
+        )
+        return default
+
+    if value <= 0:
+        logger.warning(
+            "invalid %s, got %s. Falling back to default.",
+            varenv,
+            value,
+        )
+        return default
+
+    return value
+
+
 def setup_default_configs():
     """
     Configure settings with environment variable or defaults values.
@@ -20,6 +47,8 @@ def setup_default_configs():
 
     default_cm_api_url = "http://localhost:8080"
     default_cm_api_timeout = 600  # 10* 60 = 600s => 10m
+    default_cm_api_connect_timeout = 5
+    default_cm_api_read_timeout = 30
 
     default_cm_mana_total = 0
 
@@ -37,29 +66,24 @@ def setup_default_configs():
 
     logger.debug("configuring chall-manager_api_url to %s", cm_api_url)
 
-    # Load env
-    cm_api_timeout = os.getenv(
-        "PLUGIN_SETTINGS_CM_API_TIMEOUT",
-        str(default_cm_api_timeout),  # default value must be str
+    cm_api_timeout = load_positive_int(
+        "PLUGIN_SETTINGS_CM_API_TIMEOUT", default_cm_api_timeout
     )
-    try:
-        cm_api_timeout = int(cm_api_timeout)  # try to trigger an execption
-    except TypeError:
-        logger.warning(
-            "invalid PLUGIN_SETTINGS_CM_API_TIMEOUT, got %s. Falling back to default.",
-            cm_api_timeout,
-        )
-        cm_api_timeout = default_cm_api_timeout  # default value
+    logger.debug("configuring chall-manager_api_timeout to %s", cm_api_timeout)
 
-    # Validate cm_mana_total
-    if not cm_api_timeout > 0:
-        logger.warning(
-            "invalid PLUGIN_SETTINGS_CM_API_TIMEOUT, got %s. Falling back to default.",
-            cm_api_timeout,
-        )
-        cm_api_timeout = default_cm_api_timeout  # default value
+    cm_api_connect_timeout = load_positive_int(
+        "PLUGIN_SETTINGS_CM_API_CONNECT_TIMEOUT", default_cm_api_connect_timeout
+    )
+    logger.debug(
+        "configuring chall-manager_api_connect_timeout to %s", cm_api_connect_timeout
+    )
 
-    logger.debug("configuring chall-manager_api_timeout to %s", cm_api_timeout)
+    cm_api_read_timeout = load_positive_int(
+        "PLUGIN_SETTINGS_CM_API_READ_TIMEOUT", default_cm_api_read_timeout
+    )
+    logger.debug(
+        "configuring chall-manager_api_read_timeout to %s", cm_api_read_timeout
+    )
 
     # Load env
     cm_mana_total = os.getenv(
@@ -90,6 +114,8 @@ def setup_default_configs():
         "setup": "true",
         "chall-manager_api_url": cm_api_url,
         "chall-manager_api_timeout": cm_api_timeout,
+        "chall-manager_api_connect_timeout": cm_api_connect_timeout,
+        "chall-manager_api_read_timeout": cm_api_read_timeout,
         "chall-manager_mana_total": cm_mana_total,
     }.items():
         set_config("chall-manager:" + key, val)
@@ -0,0 +1,212 @@
+"""
+This module implements the coalescing of concurrent identical calls (single-flight).
+
+While a call for a key is in flight, other callers for the same key wait for its
+outcome instead of sending the same request to Chall-Manager. Within a worker,
+callers wait on the in-flight call directly. If Redis is configured, workers also
+elect a single leader per key and share its outcome through Redis.
+"""
+
+import copy
+import json
+import threading
+import time
+import uuid
+
+import redis
+from CTFd.plugins.ctfd_chall_manager.utils.chall_manager_error import (
+    ChallManagerException,
+    chall_manager_exception_from_dict,
+)
+from CTFd.plugins.ctfd_chall_manager.utils.logger import configure_logger
+from CTFd.plugins.ctfd_chall_manager.utils.redis_client import REDIS_CLIENT
+
+logger = configure_logger(__name__)
+
+POLL_INTERVAL = 0.05  # seconds
+RESULT_TIMEOUT = 5  # seconds, outcome kept for workers still polling
+
+# Share the outcome (if any) then release the leadership, only if it has not
+# expired meanwhile (i.e. the lock still holds the leader token)
+_RELEASE_LUA = """
+if ARGV[2] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:  # pylint: disable=too-few-public-methods
+    """
+    An in-flight call, shared by all callers of the same key in this worker.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    A class used to coalesce concurrent calls sharing the same key.
+
+    Attributes:
+        name (str): The name of the group of calls, used as Redis namespace.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "shared": 0}
+
+    def __repr__(self):
+        return f"SingleFlight name={self.name}"
+
+    def do(self, key: str, fn, ttl: float):
+        """
+        Call fn, unless an identical call (same key) is already in flight.
+        In this case, wait for its outcome and return (or raise) it.
+
+        :param key: identify identical calls (e.g. "instance:1:2")
+        :param fn: function to call, its result must be JSON serializable
+        :param ttl: maximum duration of fn, in seconds
+        :return: result of fn, a copy per caller so callers can modify it
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self._stats["shared"] += 1
+
+        if not leader:
+            logger.debug("wait for in-flight call %s", key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = self._do_distributed(key, fn, ttl)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return copy.deepcopy(call.result)
+
+    def _do_distributed(self, key: str, fn, ttl: float):
+        """
+        Elect a leader among workers through Redis, then call fn or wait for
+        the leader outcome. Fallbacks to fn if Redis is not configured.
+        """
+        if REDIS_CLIENT is None:
+            return fn()
+
+        lock_key = f"chall-manager:singleflight:{self.name}:{key}"
+        token = uuid.uuid4().hex
+
+        try:
+            leader = REDIS_CLIENT.set(lock_key, token, nx=True, px=int(ttl * 1000))
+            if not leader:
+                token = REDIS_CLIENT.get(lock_key)
+        except redis.RedisError as e:
+            logger.warning("cannot coalesce call %s, got %s", key, e)
+            return fn()
+
+        if leader:
+            return self._lead(lock_key, token, fn)
+
+        if token is None:
+            # the leader finished meanwhile
+            return fn()
+
+        outcome = self._follow(lock_key, token.decode(), ttl)
+        if outcome is None:
+            # the leader failed without sharing its outcome
+            return fn()
+
+        with self._lock:
+            self._stats["shared"] += 1
+
+        if "error" in outcome:
+            raise chall_manager_exception_from_dict(
+                outcome["error"], outcome.get("type", "ChallManagerException")
+            )
+        return outcome["result"]
+
+    @staticmethod
+    def _lead(lock_key: str, token: str, fn):
+        """
+        Call fn and share its outcome with the other workers.
+        The outcome is stored under the leader token, so that followers never
+        read the outcome of a previous call.
+        """
+        outcome = None
+        try:
+            result = fn()
+            outcome = {"result": result}
+            return result
+        except ChallManagerException as e:
+            outcome = {"error": e.to_dict(), "type": type(e).__name__}
+            raise
+        finally:
+            try:
+                payload = json.dumps(outcome) if outcome is not None else None
+            except TypeError as e:
+                logger.warning("cannot serialize outcome of %s, got %s", lock_key, e)
+                payload = None
+
+            try:
+                REDIS_CLIENT.eval(
+                    _RELEASE_LUA,
+                    2,
+                    lock_key,
+                    f"{lock_key}:{token}",
+                    token,
+                    payload or "",
+                    RESULT_TIMEOUT,
+                )
+            except redis.RedisError as e:
+                logger.warning("cannot share outcome of %s, got %s", lock_key, e)
+
+    @staticmethod
+    def _follow(lock_key: str, token: str, ttl: float) -> dict | None:
+        """
+        Wait for the outcome of the leader identified by token,
+        returns None if it is not shared.
+        """
+        result_key = f"{lock_key}:{token}"
+        deadline = time.monotonic() + ttl
+        try:
+            while time.monotonic() < deadline:
+                raw = REDIS_CLIENT.get(result_key)
+                if raw is not None:
+                    return json.loads(raw)
+                if not REDIS_CLIENT.exists(lock_key):
+                    # leader is gone, check a last time for its outcome
+                    raw = REDIS_CLIENT.get(result_key)
+                    return json.loads(raw) if raw is not None else None
+                time.sleep(POLL_INTERVAL)
+        except redis.RedisError as e:
+            logger.warning("cannot wait for outcome of %s, got %s", lock_key, e)
+        return None
+
+    def stats(self) -> dict:
+        """
+        Returns the number of calls, and the number of calls that shared
+        the outcome of another one.
+        """
+        with self._lock:
+            return dict(self._stats)